@@ -0,0 +1,88 @@
+"""
+Micro-benchmark of the header closure engine against the previous
+in-place list expansion of `CProject.expand_deps`.
+
+    python benchmarks/bench_closure.py --headers 20000 --sources 5000
+"""
+from argparse import ArgumentParser
+import random
+import time
+
+from mkmake.graph import transitive_closure
+
+
+def legacy_expand(deps, keys):
+    for key in keys:
+        expanded = deps[key]
+        i = 0
+        while i < len(expanded):
+            dep = expanded[i]
+            if dep in deps:
+                for f in deps[dep]:
+                    if f not in expanded:
+                        expanded.append(f)
+            i += 1
+    return deps
+
+
+def make_graph(headers, sources, fan_out, depth, cycles, seed):
+    rng = random.Random(seed)
+    layer = max(1, headers // depth)
+    edges = {}
+    for i in range(headers):
+        below = range(min(headers, (i // layer + 1) * layer), headers)
+        edges[f"h{i}.h"] = [
+            f"h{j}.h" for j in rng.sample(below, min(fan_out, len(below)))
+        ]
+    for _ in range(cycles):
+        a, b = rng.sample(range(headers), 2)
+        edges[f"h{a}.h"].append(f"h{b}.h")
+        edges[f"h{b}.h"].append(f"h{a}.h")
+    roots = [f"s{i}.c" for i in range(sources)]
+    for root in roots:
+        edges[root] = [
+            f"h{j}.h" for j in rng.sample(range(headers), min(fan_out, headers))
+        ]
+    return roots + [f"h{i}.h" for i in range(headers)], edges
+
+
+def run(name, fn):
+    start = time.perf_counter()
+    result = fn()
+    print(f"{name:>8}: {time.perf_counter() - start:.3f}s")
+    return result
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--headers", type=int, default=5000)
+    parser.add_argument("--sources", type=int, default=2000)
+    parser.add_argument("--fan-out", type=int, default=4)
+    parser.add_argument("--depth", type=int, default=12)
+    parser.add_argument("--cycles", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--skip-legacy", action="store_true")
+    args = parser.parse_args()
+
+    keys, edges = make_graph(
+        args.headers, args.sources, args.fan_out,
+        args.depth, args.cycles, args.seed)
+    print(f"{len(keys)} nodes, {sum(map(len, edges.values()))} edges")
+
+    new = run("scc", lambda: transitive_closure(keys, edges))
+    if args.skip_legacy:
+        return
+    old = run("legacy", lambda: legacy_expand(
+        {key: list(value) for key, value in edges.items()}, keys))
+
+    # compare as sets, the legacy order depends on iteration order
+    # inside cycles
+    mismatches = sum(
+        1 for key in keys
+        if set(new[key]) - {key} != set(old[key]) - {key}
+    )
+    print(f"{mismatches} nodes differ from legacy")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Compare two `benchmarks/run.py` results and flag regressions.
+
+    python benchmarks/compare.py base.json head.json --threshold 0.2
+
+Exits with status 1 when a phase median got slower than the threshold
+allows (and by more than --min-seconds, to ignore noise on tiny phases).
+"""
+from argparse import ArgumentParser
+import json
+import sys
+
+
+def rows(summary):
+    yield "total", summary["total_seconds"]
+    for phase, seconds in sorted(summary["phases"].items()):
+        yield phase, seconds
+    for kind, phases in sorted(summary["kinds"].items()):
+        for phase, seconds in sorted(phases.items()):
+            yield f"{kind}.{phase}", seconds
+
+
+def compare(base, head, threshold, min_seconds):
+    regressions = []
+    for mode in sorted(set(base["summary"]) & set(head["summary"])):
+        old = dict(rows(base["summary"][mode]))
+        for key, new_seconds in rows(head["summary"][mode]):
+            if key not in old:
+                continue
+            old_seconds = old[key]
+            ratio = new_seconds / old_seconds if old_seconds else float("inf")
+            slower = (
+                new_seconds - old_seconds > min_seconds
+                and ratio > 1 + threshold
+            )
+            mark = " REGRESSION" if slower else ""
+            print(f"{mode:>5} {key:<40} {old_seconds:9.4f}s "
+                  f"{new_seconds:9.4f}s {ratio:6.2f}x{mark}")
+            if slower:
+                regressions.append((mode, key))
+    return regressions
+
+
+def main(argv=None):
+    parser = ArgumentParser()
+    parser.add_argument("base")
+    parser.add_argument("head")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    parser.add_argument("--min-seconds", type=float, default=0.01)
+    args = parser.parse_args(argv)
+
+    with open(args.base) as fin:
+        base = json.load(fin)
+    with open(args.head) as fin:
+        head = json.load(fin)
+    if base.get("config") != head.get("config"):
+        print("warning: benchmark configs differ", file=sys.stderr)
+
+    regressions = compare(base, head, args.threshold, args.min_seconds)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,125 @@
+"""
+Benchmark `make_projects` over a synthetic workspace.
+
+    python benchmarks/run.py --projects 8 --sources 500 -o bench.json
+    python benchmarks/compare.py old.json bench.json
+
+Each repetition runs a cold generation (no scan cache) and a warm one
+(scan cache filled by the previous run). The JSON output holds the raw
+reports and per-phase medians, overall and per project kind.
+"""
+from argparse import ArgumentParser
+from statistics import median
+import json
+import os
+import platform
+import sys
+import tempfile
+
+from mkmake import __version__, make_projects
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from synth import (  # noqa: E402
+    DEFAULTS, generate_workspace, make_workspace, makefile_bytes, project_kind
+)
+
+
+def run_once(specs, cache, jobs, trace_memory):
+    projects = make_workspace(specs)
+    return make_projects(
+        projects, cache=cache, jobs=jobs,
+        verbose=0, trace_memory=trace_memory)
+
+
+def summarize(specs, reports):
+    phases = {}
+    kinds = {}
+    for report in reports:
+        for phase, seconds in report["phases"].items():
+            phases.setdefault(phase, []).append(seconds)
+        per_kind = {}
+        for name, records in report["projects"].items():
+            kind = per_kind.setdefault(project_kind(specs, name), {})
+            for phase, record in records.items():
+                kind[phase] = kind.get(phase, 0.0) + record["seconds"]
+        for kind, records in per_kind.items():
+            for phase, seconds in records.items():
+                kinds.setdefault(kind, {}).setdefault(phase, []).append(seconds)
+    summary = {
+        "total_seconds": median(r["total_seconds"] for r in reports),
+        "phases": {phase: median(v) for phase, v in phases.items()},
+        "kinds": {
+            kind: {phase: median(v) for phase, v in records.items()}
+            for kind, records in kinds.items()
+        },
+    }
+    memory = [r["peak_memory"] for r in reports if r["peak_memory"] is not None]
+    if memory:
+        summary["peak_memory"] = max(memory)
+    return summary
+
+
+def run(config, root, repeat, jobs, trace_memory):
+    specs = generate_workspace(root, **config)
+    reports = {"cold": [], "warm": []}
+    for _ in range(repeat):
+        cache_file = os.path.join(root, "target", "scan-cache.json")
+        if os.path.exists(cache_file):
+            os.remove(cache_file)
+        reports["cold"].append(run_once(specs, False, jobs, trace_memory))
+        run_once(specs, True, jobs, False)
+        reports["warm"].append(run_once(specs, True, jobs, trace_memory))
+
+    return {
+        "mkmake": __version__,
+        "python": platform.python_version(),
+        "config": config,
+        "jobs": jobs,
+        "repeat": repeat,
+        "makefile_bytes": makefile_bytes(specs),
+        "summary": {
+            mode: summarize(specs, runs) for mode, runs in reports.items()
+        },
+        "runs": reports,
+    }
+
+
+def parse_args(argv=None):
+    parser = ArgumentParser()
+    for key, value in DEFAULTS.items():
+        flag = f"--{key.replace('_', '-')}"
+        if isinstance(value, bool):
+            parser.add_argument(flag, dest=key, action="store_true", default=value)
+            parser.add_argument(f"--no-{key.replace('_', '-')}", dest=key,
+                                action="store_false")
+        else:
+            parser.add_argument(flag, dest=key, type=int, default=value)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--jobs", type=int, default=1)
+    parser.add_argument("--trace-memory", action="store_true")
+    parser.add_argument("--root", default=None,
+                        help="workspace directory, a temporary one by default")
+    parser.add_argument("-o", "--output", default=None)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    config = {key: getattr(args, key) for key in DEFAULTS}
+    if args.root is None:
+        with tempfile.TemporaryDirectory() as root:
+            result = run(config, root, args.repeat, args.jobs, args.trace_memory)
+    else:
+        result = run(config, args.root, args.repeat, args.jobs, args.trace_memory)
+
+    text = json.dumps(result, indent=2, sort_keys=True)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, "w") as fout:
+            fout.write(text + "\n")
+    return result
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""
+Synthetic workspace generator for the generator benchmarks.
+
+Every project gets layered public and internal headers, sources that
+include a configurable number of them, and dependencies on earlier
+projects. Some projects are `YYProject`s with grammars, and the last one
+is a `TestProject` with `private_depends` on its first dependency.
+"""
+from typing import Dict, List
+import os.path as path
+import random
+from pathlib import Path
+
+from mkmake.projects import CProject, TestProject, YYProject
+
+
+DEFAULTS = {
+    "projects": 4,
+    "sources": 50,
+    "headers": 20,
+    "internals": 5,
+    "fan_in": 2,
+    "fan_out": 4,
+    "depth": 4,
+    "grammars": 1,
+    "yy_every": 3,
+    "private_depends": True,
+    "seed": 0,
+}
+
+
+def _write(file: Path, text: str) -> None:
+    file.parent.mkdir(parents=True, exist_ok=True)
+    file.write_text(text)
+
+
+def _include(headers: List[str]) -> str:
+    return "".join(f'#include "{h}"\n' for h in headers)
+
+
+def _layered(rng: random.Random, names: List[str], depth: int, fan_out: int):
+    """
+    Map each header to the headers it includes, only from deeper layers
+    """
+    layer = max(1, len(names) // max(1, depth))
+    edges = {}
+    for i, name in enumerate(names):
+        below = names[(i // layer + 1) * layer:]
+        edges[name] = rng.sample(below, min(fan_out, len(below)))
+    return edges
+
+
+def _closure(depends: Dict[str, List[str]], name: str) -> List[str]:
+    ret: List[str] = []
+    stack = list(depends[name])
+    while stack:
+        dep = stack.pop()
+        if dep not in ret:
+            ret.append(dep)
+            stack.extend(depends[dep])
+    return sorted(ret)
+
+
+def generate_workspace(root: str, **config) -> Dict[str, dict]:
+    """
+    Write a synthetic workspace under `root`
+
+    Returns the project specs, `make_workspace` turns them into fresh
+    project objects for every generation run.
+    """
+    config = {**DEFAULTS, **config}
+    rng = random.Random(config["seed"])
+    root_dir = Path(root)
+
+    specs: Dict[str, dict] = {}
+    depends: Dict[str, List[str]] = {}
+    exports: Dict[str, List[str]] = {}
+    count = config["projects"]
+    for i in range(count):
+        name = f"p{i}"
+        proj_root = root_dir / name
+        is_test = count > 1 and i == count - 1
+        is_yy = not is_test and config["yy_every"] and i % config["yy_every"] == 1
+
+        earlier = [f"p{j}" for j in range(i) if not specs[f"p{j}"]["test"]]
+        direct = rng.sample(earlier, min(config["fan_in"], len(earlier)))
+        depends[name] = direct
+        # dependencies must be listed transitively for headers to resolve
+        all_depends = _closure(depends, name)
+
+        headers = [f"{name}_h{j}.h" for j in range(config["headers"])]
+        internals = [f"{name}_i{j}.h" for j in range(config["internals"])]
+        for header, included in _layered(
+                rng, headers, config["depth"], config["fan_out"]).items():
+            _write(proj_root / "include" / header,
+                   "#pragma once\n" + _include(included))
+        for header in internals:
+            included = rng.sample(headers, min(config["fan_out"], len(headers)))
+            _write(proj_root / "src" / "include" / header,
+                   "#pragma once\n" + _include(included))
+
+        visible = headers + internals
+        for dep in all_depends:
+            visible += exports[dep]
+        private = []
+        if is_test and config["private_depends"] and direct:
+            private = [direct[0]]
+            visible += [
+                f"{direct[0]}_i{j}.h" for j in range(config["internals"])
+            ]
+
+        grammars = []
+        if is_yy:
+            for j in range(config["grammars"]):
+                grammar = f"{name}_g{j}"
+                grammars.append(f"{grammar}.tab.h")
+                _write(proj_root / "src" / "yy" / f"{grammar}.y",
+                       f'%{{\n#include "{headers[0]}"\n%}}\n%%\nstart : ;\n%%\n')
+                _write(proj_root / "src" / "yy" / f"{grammar}.l",
+                       f'%{{\n#include "{grammar}.tab.h"\n%}}\n%%\n%%\n')
+
+        for j in range(config["sources"]):
+            included = rng.sample(visible, min(config["fan_out"], len(visible)))
+            if grammars and j == 0:
+                included += grammars
+            sub = f"m{j % 5}"
+            _write(proj_root / "src" / sub / f"{name}_s{j}.c",
+                   _include(included) + f"int {name}_s{j}(void){{return {j};}}\n")
+
+        exports[name] = headers
+        specs[name] = {
+            "root": str(proj_root),
+            "depends": all_depends,
+            "private_depends": private,
+            "yy": bool(is_yy),
+            "test": is_test,
+        }
+    return specs
+
+
+def make_workspace(specs: Dict[str, dict]) -> Dict[str, CProject]:
+    projects: Dict[str, CProject] = {}
+    for name, spec in specs.items():
+        if spec["test"]:
+            projects[name] = TestProject(
+                spec["root"],
+                test_command="true",
+                depends=spec["depends"],
+                private_depends=spec["private_depends"],
+            )
+            continue
+        cls = YYProject if spec["yy"] else CProject
+        projects[name] = cls(
+            spec["root"],
+            output_name=f"lib{name}.a",
+            output_type=CProject.OutputType.STATIC,
+            depends=spec["depends"],
+        )
+    return projects
+
+
+def project_kind(specs: Dict[str, dict], name: str) -> str:
+    spec = specs[name]
+    if spec["test"]:
+        return "TestProject"
+    return "YYProject" if spec["yy"] else "CProject"
+
+
+def makefile_bytes(specs: Dict[str, dict]) -> int:
+    total = 0
+    for spec in specs.values():
+        makefile = path.join(spec["root"], "target", "Makefile")
+        if path.exists(makefile):
+            total += path.getsize(makefile)
+    return total
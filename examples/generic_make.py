@@ -17,8 +17,8 @@ def parse_args():
     return parser.parse_args()
 
 
-def main(args) -> None:
-    projects = {
+def projects():
+    return {
         "generic": CProject(
             "generic",
             output_name="libgeneric.a",
@@ -41,7 +41,10 @@ def main(args) -> None:
             private_depends=["generic"],
         ),
     }
-    make_projects(projects, debug=args.debug, test=args.test)
+
+
+def main(args) -> None:
+    make_projects(projects(), debug=args.debug, test=args.test)
 
 
 if __name__ == "__main__":
@@ -1,3 +1,5 @@
 from .metaproject import make_projects
+from .schedule import Schedule
+from .version import __version__
 
-__all__ = ["make_projects"]
+__all__ = ["make_projects", "Schedule", "__version__"]
@@ -0,0 +1,109 @@
+"""
+Backend-neutral build actions
+
+Projects describe their build as `Action`s, each running a `Rule` on
+its inputs. Commands use ninja variable syntax: `$in` and `$out` are the
+explicit inputs and outputs, `$name` or `${name}` an action variable or,
+failing that, a variable of the `ActionGraph` (namespaced per project),
+and `$$` a literal dollar.
+"""
+from typing import Dict, Iterable, List, Optional
+
+import re
+
+# default depth of the rule pools, compiles are only bounded by the job
+# count; `console` is the pool of actions that need the terminal
+DEFAULT_POOLS = {'link': 4, 'generate': 2}
+CONSOLE = 'console'
+
+VAR_RE = re.compile(r"\$(\$|\{([\w.-]+)\}|(\w+))")
+
+
+class Rule(object):
+    """
+    A command template shared by actions
+
+    Outputs of an `always` rule are names, not files, its actions run
+    whenever they are needed.
+    """
+
+    def __init__(
+        self, name: str, command: str, description: str,
+        depfile: Optional[str] = None, deps: Optional[str] = None,
+        pool: Optional[str] = None, restat: bool = False,
+        always: bool = False,
+    ):
+        self.name = name
+        self.command = command
+        self.description = description
+        self.depfile = depfile
+        self.deps = deps
+        self.pool = pool
+        self.restat = restat
+        self.always = always
+
+
+PHONY = Rule('phony', '', '')
+
+
+class Action(object):
+    """
+    `rule` producing `outputs` from `inputs`; `implicit` inputs are not
+    part of `$in` and `order_only` ones only have to be built first
+    """
+
+    def __init__(
+        self, rule: Rule, outputs: List[str], inputs: Iterable[str] = (),
+        implicit: Iterable[str] = (), order_only: Iterable[str] = (),
+        variables: Optional[Dict[str, str]] = None,
+    ):
+        self.rule = rule
+        self.outputs = outputs
+        self.inputs = list(inputs)
+        self.implicit = list(implicit)
+        self.order_only = list(order_only)
+        self.variables = variables or {}
+
+    def expand(self, text: str, scope: Dict[str, str]) -> str:
+        """
+        `text` with the variables of this action and `scope` expanded
+        """
+        def sub(mat):
+            if mat.group(1) == '$':
+                return '$'
+            name = mat.group(2) or mat.group(3)
+            if name == 'in':
+                return ' '.join(self.inputs)
+            if name == 'out':
+                return ' '.join(self.outputs)
+            if name in self.variables:
+                return self.expand(self.variables[name], scope)
+            return self.expand(scope.get(name, ''), scope)
+        return VAR_RE.sub(sub, text)
+
+    def command(self, scope: Dict[str, str]) -> str:
+        return self.expand(self.rule.command, scope)
+
+
+class ActionGraph(object):
+    """
+    The actions of a project and the variables they share
+    """
+
+    def __init__(self):
+        self.variables: Dict[str, str] = {}
+        self.actions: List[Action] = []
+
+    def variable(self, name: str, value: str):
+        self.variables[name] = value
+
+    def add(self, action: Action) -> Action:
+        self.actions.append(action)
+        return action
+
+    def rules(self) -> List[Rule]:
+        ret: Dict[str, Rule] = {}
+        for action in self.actions:
+            if action.rule is not PHONY:
+                ret.setdefault(action.rule.name, action.rule)
+        return list(ret.values())
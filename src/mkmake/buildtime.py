@@ -0,0 +1,36 @@
+"""
+Project build timer
+
+Wraps the build of a project: `python -m mkmake.buildtime <target_root>
+<name> command...` runs the command and, when it succeeds, records its
+seconds for project `name` in `<target_root>/project-times.json`, the
+weights of the next generation's schedule. `make_projects(...,
+record_times=True)` wraps every project build of `Projects.mk` this way.
+"""
+import subprocess
+import sys
+import time
+from argparse import REMAINDER, ArgumentParser
+
+from .schedule import record_time
+
+
+def main(argv=None):
+    parser = ArgumentParser(prog='python -m mkmake.buildtime')
+    parser.add_argument('target_root')
+    parser.add_argument('name')
+    parser.add_argument('command', nargs=REMAINDER)
+    args = parser.parse_args(argv)
+    if not args.command:
+        parser.error('missing build command')
+
+    start = time.monotonic()
+    # keep make's jobserver descriptors open for the nested make
+    ret = subprocess.call(args.command, close_fds=False)
+    if ret == 0:
+        record_time(args.target_root, args.name, time.monotonic() - start)
+    return ret
+
+
+if __name__ == '__main__':
+    sys.exit(main())
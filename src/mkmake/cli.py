@@ -0,0 +1,163 @@
+from typing import Dict
+
+import json
+import sys
+from argparse import ArgumentParser, ArgumentTypeError
+from importlib.util import module_from_spec, spec_from_file_location
+
+from .metaproject import make_projects
+from .projects import Project
+from .query import affected, write_affected_makefile
+from .watch import Watch
+
+
+def load_projects(script: str) -> Dict[str, Project]:
+    """
+    Load the projects of a workspace script
+
+    The script is imported (not run as `__main__`) and must define
+    `projects`, either the project dictionary or a function returning it.
+    """
+    spec = spec_from_file_location('mkmake_workspace', script)
+    if spec is None or spec.loader is None:
+        raise SystemExit(f"Cannot load workspace script '{script}'")
+    module = module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    projects = getattr(module, 'projects', None)
+    if callable(projects):
+        projects = projects()
+    if not isinstance(projects, dict):
+        raise SystemExit(f"'{script}' defines no `projects` dictionary")
+    return projects
+
+
+def add_generate_args(parser: ArgumentParser):
+    parser.add_argument('script', help='workspace script defining `projects`')
+    parser.add_argument('--debug', action='store_true', default=None)
+    parser.add_argument('--test', action='store_true', default=None)
+    parser.add_argument('-j', '--jobs', type=int, default=None)
+    parser.add_argument('--no-cache', dest='cache', action='store_false')
+    parser.add_argument('--flat', dest='recursive', action='store_false',
+                        help='one non-recursive Workspace.mk')
+    parser.add_argument('--ninja', dest='backend', action='store_const',
+                        const='ninja', default='make',
+                        help='one build.ninja instead of Makefiles')
+    parser.add_argument('-v', '--verbose', action='count', default=1)
+    parser.add_argument('-q', '--quiet', dest='verbose', action='store_const',
+                        const=0)
+
+
+def generate_kwargs(args):
+    return {
+        'debug': args.debug,
+        'test': args.test,
+        'jobs': args.jobs,
+        'cache': args.cache,
+        'recursive': args.recursive,
+        'backend': args.backend,
+    }
+
+
+def watch(args):
+    watcher = Watch(
+        load_projects(args.script),
+        make_args=args.make,
+        poll=args.poll,
+        interval=args.interval,
+        verbose=args.verbose,
+        **generate_kwargs(args),
+    )
+    watcher.run()
+    return 0
+
+
+def query_affected(args):
+    if args.makefile is not None and args.backend == 'ninja':
+        raise SystemExit("--makefile writes a meta Makefile, not with --ninja")
+    files = []
+    for file in args.files:
+        if file == '-':
+            files += [line.strip() for line in sys.stdin if line.strip()]
+        else:
+            files.append(file)
+
+    projects = load_projects(args.script)
+    kwargs = generate_kwargs(args)
+    # only scanned, the Makefiles of the checkout are left alone unless
+    # the meta Makefile needs them; logs stay off stdout, it holds the JSON
+    make_projects(
+        projects, verbose=max(args.verbose - 1, 0),
+        generate=args.makefile is not None, **kwargs)
+    result = affected(projects, files)
+    if args.makefile is not None:
+        write_affected_makefile(
+            projects, result, args.makefile, args.recursive)
+    print(json.dumps(result.to_dict(), indent=2))
+    return 0
+
+
+def build(args):
+    projects = load_projects(args.script)
+    try:
+        make_projects(
+            projects, verbose=args.verbose, execute=args.targets or ['all'],
+            pools=dict(args.pool) or None, **generate_kwargs(args))
+    except (RuntimeError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 1
+    return 0
+
+
+def pool_arg(text: str):
+    name, _, depth = text.partition('=')
+    if not name or not depth.isdigit() or int(depth) < 1:
+        raise ArgumentTypeError(f"expected NAME=DEPTH, got '{text}'")
+    return name, int(depth)
+
+
+def main(argv=None):
+    parser = ArgumentParser(prog='mkmake')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    watch_parser = commands.add_parser(
+        'watch', help='regenerate Makefiles on file changes')
+    add_generate_args(watch_parser)
+    watch_parser.add_argument(
+        '--make', nargs='*', default=None, metavar='TARGET',
+        help='run make (on TARGETs) after every change')
+    watch_parser.add_argument('--poll', action='store_true',
+                              help='poll instead of using inotify')
+    watch_parser.add_argument('--interval', type=float, default=0.5,
+                              help='polling interval in seconds')
+    watch_parser.set_defaults(func=watch)
+
+    affected_parser = commands.add_parser(
+        'affected', help='list the targets touched by changed files')
+    add_generate_args(affected_parser)
+    affected_parser.add_argument(
+        'files', nargs='*', metavar='FILE',
+        help="changed files, '-' reads them from stdin")
+    affected_parser.add_argument(
+        '--makefile', default=None, metavar='PATH',
+        help='also generate the workspace and write a meta Makefile '
+             'of the affected projects')
+    affected_parser.set_defaults(func=query_affected)
+
+    build_parser = commands.add_parser(
+        'build', help='generate and build in process')
+    add_generate_args(build_parser)
+    build_parser.add_argument(
+        'targets', nargs='*', metavar='TARGET',
+        help='phony targets of every project, default: all')
+    build_parser.add_argument(
+        '--pool', type=pool_arg, action='append', default=[],
+        metavar='NAME=DEPTH', help='depth of an action pool')
+    build_parser.set_defaults(func=build)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,319 @@
+"""
+Content-addressed compilation cache
+
+Wraps a compiler invocation: `python -m mkmake.compcache [options] cc
+-c ... -o out.o src.c`. The object is keyed on the preprocessed source,
+the compiler identity and the remaining command line, with
+`-ffile-prefix-map` style prefix maps applied first so entries can be
+shared between checkouts at different locations. Entries are written
+with atomic renames, so the cache directory can live on a shared network
+filesystem, and each of the 256 shards is trimmed to its share of
+`--max-size` by least recent use.
+"""
+from typing import Dict, List, Optional, Tuple
+
+import hashlib
+import json
+import os
+import os.path as path
+import shutil
+import socket
+import subprocess
+import sys
+import uuid
+from argparse import REMAINDER, ArgumentParser
+
+DEFAULT_DIR = path.join(path.expanduser('~'), '.cache', 'mkmake')
+ROOT_TOKEN = '@MKMAKE_ROOT@'
+
+PREFIX_MAP_FLAGS = (
+    '-ffile-prefix-map=', '-fdebug-prefix-map=', '-fmacro-prefix-map=')
+DEP_FLAGS = ('-MD', '-MMD', '-MP')
+DEP_FLAGS_WITH_ARG = ('-MF', '-MT', '-MQ')
+FLAGS_WITH_ARG = (
+    '-x', '-include', '-imacros', '-isystem', '-iquote', '-I', '-D', '-U')
+
+
+def parse_size(size: str) -> int:
+    units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+    size = size.strip().upper()
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+
+class Invocation(object):
+    """
+    A compiler command line split into the parts the cache cares about
+    """
+
+    def __init__(self, command: List[str]):
+        self.command = command
+        self.compiler = command[0]
+        self.output: Optional[str] = None
+        self.sources: List[str] = []
+        self.depfile: Optional[str] = None
+        self.prefix_maps: List[Tuple[str, str]] = []
+        self.compile_only = False
+        self.key_args: List[str] = []
+        self.preprocess_args: List[str] = []
+
+        writes_deps = False
+        args = command[1:]
+        i = 0
+        while i < len(args):
+            arg = args[i]
+            if arg == '-o' and i + 1 < len(args):
+                self.output = args[i + 1]
+                i += 2
+                continue
+            if arg in DEP_FLAGS_WITH_ARG and i + 1 < len(args):
+                if arg == '-MF':
+                    self.depfile = args[i + 1]
+                i += 2
+                continue
+            if arg in DEP_FLAGS:
+                writes_deps = writes_deps or arg != '-MP'
+                i += 1
+                continue
+            if arg == '-c':
+                self.compile_only = True
+                self.preprocess_args.append('-E')
+            else:
+                self.preprocess_args.append(arg)
+                if not arg.startswith('-') and (
+                        i == 0 or args[i - 1] not in FLAGS_WITH_ARG):
+                    self.sources.append(arg)
+            for flag in PREFIX_MAP_FLAGS:
+                if arg.startswith(flag) and '=' in arg[len(flag):]:
+                    old, new = arg[len(flag):].split('=', 1)
+                    self.prefix_maps.append((old, new))
+            self.key_args.append(arg)
+            i += 1
+
+        if writes_deps and self.depfile is None and self.output is not None:
+            self.depfile = path.splitext(self.output)[0] + '.d'
+        if not writes_deps:
+            self.depfile = None
+
+    def cacheable(self):
+        return (
+            self.compile_only
+            and self.output is not None
+            and self.output.endswith('.o')
+            and len(self.sources) == 1
+        )
+
+    def normalize(self, text: str):
+        for old, new in self.prefix_maps:
+            text = text.replace(old, new)
+        return text
+
+    def root(self):
+        return self.prefix_maps[0][0] if self.prefix_maps else None
+
+
+class CompileCache(object):
+    """
+    Cache directory: <dir>/<key[:2]>/<key>.o (+ .d), plus hit/miss logs
+    """
+
+    def __init__(self, cache_dir: str, max_size: Optional[int] = None):
+        self.cache_dir = path.abspath(cache_dir)
+        self.max_size = max_size
+        self.stats_dir = path.join(self.cache_dir, 'stats')
+
+    def entry(self, key: str):
+        return path.join(self.cache_dir, key[:2], key)
+
+    def compiler_identity(self, compiler: str):
+        """
+        Hash of the compiler's --version output, memoized by its stat
+        """
+        resolved = shutil.which(compiler) or compiler
+        resolved = path.realpath(resolved)
+        st = os.stat(resolved)
+        stamp = f"{resolved}:{st.st_mtime_ns}:{st.st_size}"
+        memo_path = path.join(
+            self.cache_dir, 'compilers',
+            hashlib.sha256(stamp.encode()).hexdigest())
+        try:
+            with open(memo_path, 'r') as fin:
+                return fin.read()
+        except OSError:
+            pass
+
+        version = subprocess.run(
+            [resolved, '--version'], stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL).stdout
+        identity = hashlib.sha256(
+            path.basename(resolved).encode() + b'\0' + version).hexdigest()
+        self.atomic_write(memo_path, identity.encode())
+        return identity
+
+    def atomic_write(self, file_path: str, data: bytes):
+        os.makedirs(path.dirname(file_path), exist_ok=True)
+        tmp_path = (
+            f"{file_path}.{socket.gethostname()}."
+            f"{os.getpid()}.{uuid.uuid4().hex}.tmp"
+        )
+        with open(tmp_path, 'wb') as fout:
+            fout.write(data)
+        os.replace(tmp_path, file_path)
+
+    def record(self, event: str):
+        os.makedirs(self.stats_dir, exist_ok=True)
+        fd = os.open(
+            path.join(self.stats_dir, event),
+            os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        try:
+            os.write(fd, b'.')
+        finally:
+            os.close(fd)
+
+    def stats(self):
+        ret: Dict[str, float] = {}
+        for event in ['hits', 'misses']:
+            try:
+                ret[event] = os.path.getsize(path.join(self.stats_dir, event))
+            except OSError:
+                ret[event] = 0
+        total = ret['hits'] + ret['misses']
+        ret['hit_rate'] = ret['hits'] / total if total else 0.0
+        size = entries = 0
+        for shard in self.shards():
+            for file in os.scandir(shard):
+                if file.name.endswith('.o'):
+                    entries += 1
+                size += file.stat().st_size
+        ret['entries'] = entries
+        ret['size'] = size
+        return ret
+
+    def shards(self):
+        if not path.isdir(self.cache_dir):
+            return
+        for shard in os.scandir(self.cache_dir):
+            if len(shard.name) == 2 and shard.is_dir():
+                yield shard.path
+
+    def key(self, inv: Invocation, preprocessed: bytes):
+        digest = hashlib.sha256()
+        digest.update(self.compiler_identity(inv.compiler).encode())
+        digest.update(b'\0')
+        digest.update(json.dumps(
+            [inv.normalize(arg) for arg in inv.key_args]).encode())
+        digest.update(b'\0')
+        digest.update(bool(inv.depfile).to_bytes(1, 'little'))
+        digest.update(
+            inv.normalize(preprocessed.decode('utf-8', 'surrogateescape'))
+            .encode('utf-8', 'surrogateescape'))
+        return digest.hexdigest()
+
+    def restore(self, inv: Invocation, entry: str):
+        try:
+            with open(f"{entry}.o", 'rb') as fin:
+                obj = fin.read()
+            depfile = None
+            if inv.depfile is not None:
+                with open(f"{entry}.d", 'r') as fin:
+                    depfile = fin.read()
+        except OSError:
+            return False
+
+        self.atomic_write(inv.output, obj)
+        if depfile is not None:
+            root = inv.root()
+            if root is not None:
+                depfile = depfile.replace(ROOT_TOKEN, root)
+            self.atomic_write(inv.depfile, depfile.encode())
+        # entry mtime is its last use, for LRU eviction
+        for suffix in ['.o', '.d']:
+            if path.exists(entry + suffix):
+                os.utime(entry + suffix)
+        return True
+
+    def store(self, inv: Invocation, entry: str):
+        with open(inv.output, 'rb') as fin:
+            self.atomic_write(f"{entry}.o", fin.read())
+        if inv.depfile is not None:
+            with open(inv.depfile, 'r') as fin:
+                depfile = fin.read()
+            root = inv.root()
+            if root is not None:
+                depfile = depfile.replace(root, ROOT_TOKEN)
+            self.atomic_write(f"{entry}.d", depfile.encode())
+        self.evict(path.dirname(entry))
+
+    def evict(self, shard: str):
+        if self.max_size is None:
+            return
+        limit = self.max_size // 256
+        files = []
+        total = 0
+        for file in os.scandir(shard):
+            if file.name.endswith('.tmp'):
+                continue
+            st = file.stat()
+            files.append((st.st_mtime_ns, st.st_size, file.path))
+            total += st.st_size
+        files.sort()
+        for _, size, file_path in files:
+            if total <= limit:
+                break
+            try:
+                os.remove(file_path)
+            except OSError:
+                pass
+            total -= size
+
+    def compile(self, command: List[str]) -> int:
+        inv = Invocation(command)
+        if not inv.cacheable():
+            return subprocess.call(command)
+
+        pre = subprocess.run(
+            [inv.compiler] + inv.preprocess_args,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        if pre.returncode != 0:
+            return subprocess.call(command)
+
+        entry = self.entry(self.key(inv, pre.stdout))
+        if self.restore(inv, entry):
+            self.record('hits')
+            return 0
+
+        ret = subprocess.call(command)
+        if ret == 0:
+            self.store(inv, entry)
+        self.record('misses')
+        return ret
+
+
+def main(argv=None):
+    parser = ArgumentParser(prog='python -m mkmake.compcache')
+    parser.add_argument('--dir', default=os.environ.get(
+        'MKMAKE_CACHE_DIR', DEFAULT_DIR))
+    parser.add_argument('--max-size', default=None,
+                        help='cache size bound, e.g. 500M or 5G')
+    parser.add_argument('--stats', action='store_true',
+                        help='print hit-rate statistics as JSON')
+    parser.add_argument('command', nargs=REMAINDER)
+    args = parser.parse_args(argv)
+
+    max_size = parse_size(args.max_size) if args.max_size else None
+    cache = CompileCache(args.dir, max_size)
+    if args.stats:
+        print(json.dumps(cache.stats(), indent=2, sort_keys=True))
+        return 0
+
+    command = args.command
+    if command and command[0] == '--':
+        command = command[1:]
+    if not command:
+        parser.error('missing compiler command')
+    return cache.compile(command)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,483 @@
+"""
+In-process build executor
+
+Runs the actions of a generated workspace (see `mkmake.actions`)
+directly, with one scheduler across all projects instead of a make per
+project. An action runs when an output is missing, an input or a
+dependency recorded from its depfile is newer than its outputs, or its
+command changed since the last build. Ready actions start by critical
+path, the longest chain of recorded durations they lead, within the job
+count, their rule's pool depth and the tokens of a GNU make jobserver.
+Durations, commands and depfile dependencies are kept in
+`target/build-log.json`, and the build seconds of each project in
+`target/project-times.json` for the generation schedule.
+"""
+from typing import Dict, List, Optional, Set, Tuple
+
+import hashlib
+import heapq
+import json
+import os
+import os.path as path
+import select
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from .actions import CONSOLE, DEFAULT_POOLS, PHONY, Action
+from .projects import Project
+from .schedule import load_times, save_times
+
+LOG_FILE = 'build-log.json'
+
+
+def _reopen(fd: int) -> int:
+    """
+    A non-blocking descriptor reading from `fd`, without changing the
+    blocking mode children see
+    """
+    try:
+        return os.open(f"/proc/self/fd/{fd}", os.O_RDONLY | os.O_NONBLOCK)
+    except OSError:
+        return fd
+
+
+class Jobserver(object):
+    """
+    GNU make jobserver tokens
+
+    Under make (`--jobserver-auth` in `MAKEFLAGS`), tokens come from the
+    parent's jobserver; otherwise `jobs - 1` tokens are served on a pipe
+    passed to every action, so nested makes share the job count. Each
+    running action but the first holds a token.
+    """
+
+    def __init__(self, jobs: int):
+        self.pass_fds: Tuple[int, ...] = ()
+        self.env = dict(os.environ)
+        auth = self.parent_auth()
+        if auth is None:
+            read_fd, write_fd = os.pipe()
+            os.write(write_fd, b'+' * (jobs - 1))
+            self.fds = (read_fd, write_fd)
+            self.pass_fds = self.fds
+            self.env['MAKEFLAGS'] = (
+                f" -j{jobs} --jobserver-auth={read_fd},{write_fd}")
+            self.reader = _reopen(read_fd)
+            self.writer = write_fd
+        elif auth.startswith('fifo:'):
+            fifo = auth[len('fifo:'):]
+            self.reader = os.open(fifo, os.O_RDONLY | os.O_NONBLOCK)
+            self.writer = os.open(fifo, os.O_WRONLY)
+            self.fds = (self.reader, self.writer)
+        else:
+            read_fd, write_fd = (int(fd) for fd in auth.split(','))
+            self.pass_fds = (read_fd, write_fd)
+            self.reader = _reopen(read_fd)
+            self.writer = write_fd
+            self.fds = ()
+
+    @staticmethod
+    def parent_auth() -> Optional[str]:
+        for flag in os.environ.get('MAKEFLAGS', '').split():
+            for prefix in ('--jobserver-auth=', '--jobserver-fds='):
+                if not flag.startswith(prefix):
+                    continue
+                auth = flag[len(prefix):]
+                if auth.startswith('fifo:'):
+                    return auth if path.exists(auth[len('fifo:'):]) else None
+                try:
+                    # make only passes the pipe to recipes it knows run make
+                    for fd in auth.split(','):
+                        os.fstat(int(fd))
+                except (OSError, ValueError):
+                    return None
+                return auth
+        return None
+
+    def acquire(self) -> Optional[bytes]:
+        if self.reader in self.pass_fds:
+            # no private non-blocking descriptor, check first
+            ready, _, _ = select.select([self.reader], [], [], 0)
+            if not ready:
+                return None
+        try:
+            token = os.read(self.reader, 1)
+        except (BlockingIOError, InterruptedError):
+            return None
+        return token or None
+
+    def release(self, token: bytes):
+        os.write(self.writer, token)
+
+    def close(self):
+        fds = set(self.fds)
+        if self.reader not in self.pass_fds:
+            fds.add(self.reader)
+        for fd in fds:
+            os.close(fd)
+
+
+class Node(object):
+    """
+    An action of a project, paths made absolute
+    """
+
+    def __init__(self, name: str, proj: Project, action: Action):
+        self.name = name
+        self.action = action
+        self.cwd = proj.path_root
+        self.scope = proj.actions.variables
+
+        def absolute(paths):
+            return [path.normpath(path.join(self.cwd, p)) for p in paths]
+        self.outputs = absolute(action.outputs)
+        self.inputs = absolute(action.inputs + action.implicit)
+        self.order_only = absolute(action.order_only)
+        self.key = self.outputs[0]
+        self.command = action.command(self.scope)
+        self.signature = hashlib.sha256(self.command.encode()).hexdigest()
+        self.deps: Set['Node'] = set()
+        self.dependents: Set['Node'] = set()
+        self.weight = 0.0
+        self.priority = 0.0
+
+    def description(self):
+        return self.action.expand(self.action.rule.description, self.scope)
+
+    def __lt__(self, other: 'Node'):
+        return self.key < other.key
+
+
+class Executor(object):
+    """
+    Build the actions of `projects`, planned by `make_projects`
+
+    Unless `record_times` is off, the build seconds of each project are
+    merged into `project-times.json` after every build.
+    """
+
+    def __init__(
+        self,
+        projects: List[Tuple[str, Project]],
+        target_root: str,
+        jobs: Optional[int] = None,
+        pools: Optional[Dict[str, int]] = None,
+        verbose: int = 1,
+        record_times: bool = True,
+    ):
+        self.projects = projects
+        self.record_times = record_times
+        self.target_root = target_root
+        self.jobs = jobs or os.cpu_count() or 1
+        self.pools = {**DEFAULT_POOLS, **(pools or {}), CONSOLE: 1}
+        self.verbose = verbose
+        self.log_path = path.join(target_root, LOG_FILE)
+        self.records = self.load()
+
+        self.nodes: List[Node] = []
+        self.producers: Dict[str, Node] = {}
+        for name, proj in projects:
+            for action in proj.actions.actions:
+                node = Node(name, proj, action)
+                self.nodes.append(node)
+                for output in node.outputs:
+                    if output in self.producers:
+                        raise ValueError(
+                            f"Output '{output}' of projects "
+                            f"'{self.producers[output].name}' and "
+                            f"'{name}'")
+                    self.producers[output] = node
+        for node in self.nodes:
+            for dep in node.inputs + node.order_only:
+                producer = self.producers.get(dep)
+                if producer is not None:
+                    node.deps.add(producer)
+                    producer.dependents.add(node)
+
+    def log(self, message: str, level: int = 1):
+        if self.verbose >= level:
+            print(message)
+            sys.stdout.flush()
+
+    def load(self) -> Dict[str, dict]:
+        try:
+            with open(self.log_path, 'r') as fin:
+                data = json.load(fin)
+        except (OSError, ValueError):
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    def save(self):
+        os.makedirs(self.target_root, exist_ok=True)
+        tmp_path = f"{self.log_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as fout:
+            json.dump(self.records, fout, sort_keys=True)
+        os.replace(tmp_path, self.log_path)
+
+        if self.record_times:
+            times = load_times(self.target_root)
+            times.update(self.project_seconds())
+            save_times(self.target_root, times)
+
+    def project_seconds(self) -> Dict[str, float]:
+        """
+        Recorded build seconds of each project's actions
+        """
+        ret = {}
+        for name, _ in self.projects:
+            seconds = [
+                self.records[node.key]['seconds'] for node in self.nodes
+                if node.name == name and node.key in self.records
+            ]
+            if seconds:
+                ret[name] = round(sum(seconds), 6)
+        return ret
+
+    def goals(self, words: List[str]) -> List[Node]:
+        ret = []
+        for word in words:
+            found = [
+                self.producers[key] for key in (
+                    path.normpath(path.join(proj.path_root, proj.phony(word)))
+                    for _, proj in self.projects)
+                if key in self.producers
+            ]
+            if not found:
+                raise ValueError(f"Unknown target '{word}'")
+            ret += found
+        return ret
+
+    def needed(self, goals: List[Node]) -> List[Node]:
+        """
+        Actions `goals` need, dependencies first
+        """
+        seen: Set[Node] = set()
+        stack = list(goals)
+        while stack:
+            node = stack.pop()
+            if node not in seen:
+                seen.add(node)
+                stack.extend(node.deps)
+
+        waiting = {node: len(node.deps) for node in seen}
+        ready = sorted(node for node in seen if not waiting[node])
+        ordered = []
+        while ready:
+            node = ready.pop()
+            ordered.append(node)
+            for dependent in node.dependents:
+                if dependent in waiting:
+                    waiting[dependent] -= 1
+                    if not waiting[dependent]:
+                        ready.append(dependent)
+        if len(ordered) != len(seen):
+            raise ValueError("Dependency cycle between build actions")
+        return ordered
+
+    def prioritize(self, ordered: List[Node]):
+        """
+        Critical-path priorities from the recorded durations; actions
+        never run are weighted by the average of their rule
+        """
+        totals: Dict[str, List[float]] = {}
+        for node in self.nodes:
+            record = self.records.get(node.key)
+            if record is not None:
+                totals.setdefault(node.action.rule.name, []).append(
+                    record['seconds'])
+        needed = set(ordered)
+        for node in reversed(ordered):
+            if node.action.rule is PHONY:
+                node.weight = 0.0
+            elif node.key in self.records:
+                node.weight = self.records[node.key]['seconds']
+            else:
+                seconds = totals.get(node.action.rule.name)
+                node.weight = sum(seconds) / len(seconds) if seconds else 1.0
+            node.priority = node.weight + max(
+                (d.priority for d in node.dependents if d in needed),
+                default=0.0)
+
+    def mtime(self, file_path: str) -> Optional[int]:
+        try:
+            return os.stat(file_path).st_mtime_ns
+        except OSError:
+            return None
+
+    def dirty(self, node: Node) -> bool:
+        if node.action.rule.always:
+            return True
+        record = self.records.get(node.key)
+        if record is None or record['command'] != node.signature:
+            return True
+        oldest = None
+        for output in node.outputs:
+            mtime = self.mtime(output)
+            if mtime is None:
+                return True
+            oldest = mtime if oldest is None else min(oldest, mtime)
+        # a `restat` run may leave its outputs untouched, the inputs it saw
+        # are up to date
+        oldest = max(oldest, record.get('restat', 0))
+        for dep in node.inputs + record.get('deps', []):
+            producer = self.producers.get(dep)
+            if producer is not None and producer.action.rule is PHONY:
+                continue
+            mtime = self.mtime(dep)
+            if mtime is None or mtime > oldest:
+                return True
+        return False
+
+    def depfile_deps(self, node: Node) -> List[str]:
+        rule = node.action.rule
+        if rule.depfile is None:
+            return []
+        depfile = path.join(node.cwd, node.action.expand(rule.depfile, node.scope))
+        try:
+            with open(depfile, 'r') as fin:
+                text = fin.read()
+        except OSError:
+            return []
+        # make syntax: `target: dep dep \` continued lines, `\ ` spaces
+        text = text.replace('\\\n', ' ').replace('\\ ', '\0')
+        deps = []
+        for line in text.splitlines():
+            if ':' not in line:
+                continue
+            for dep in line.split(':', 1)[1].split():
+                dep = path.normpath(path.join(node.cwd, dep.replace('\0', ' ')))
+                if dep not in deps:
+                    deps.append(dep)
+        return deps
+
+    def run(self, node: Node, jobserver: Jobserver):
+        for output in node.outputs:
+            os.makedirs(path.dirname(output), exist_ok=True)
+        console = node.action.rule.pool == CONSOLE
+        start = time.monotonic()
+        ret = subprocess.run(
+            node.command, shell=True, cwd=node.cwd, env=jobserver.env,
+            pass_fds=jobserver.pass_fds,
+            stdout=None if console else subprocess.PIPE,
+            stderr=None if console else subprocess.STDOUT)
+        output = '' if console else ret.stdout.decode('utf-8', 'replace')
+        return ret.returncode, output, time.monotonic() - start
+
+    def build(self, words: List[str]) -> dict:
+        """
+        Build the phony targets `words` (e.g. `all`, `test`) of every
+        project that has them, returns the counts of run and up-to-date
+        actions and the failed outputs
+        """
+        start = time.monotonic()
+        # other executors may have built since, e.g. other variants
+        self.records = self.load()
+        ordered = self.needed(self.goals(words))
+        self.prioritize(ordered)
+        total = sum(1 for node in ordered if node.action.rule is not PHONY)
+        waiting = {node: len(node.deps) for node in ordered}
+        ready = [
+            (-node.priority, node) for node in ordered if not waiting[node]]
+        heapq.heapify(ready)
+
+        jobserver = Jobserver(self.jobs)
+        running = {}
+        tokens: List[bytes] = []
+        used = {pool: 0 for pool in self.pools}
+        ran, skipped, failed = 0, 0, []
+        started = 0
+
+        def finish(node: Node):
+            for dependent in node.dependents:
+                if dependent in waiting:
+                    waiting[dependent] -= 1
+                    if not waiting[dependent]:
+                        heapq.heappush(ready, (-dependent.priority, dependent))
+
+        try:
+            with ThreadPoolExecutor(self.jobs) as pool:
+                while ready or running:
+                    starved = False
+                    deferred = []
+                    while ready and not failed:
+                        entry = heapq.heappop(ready)
+                        node = entry[1]
+                        if node.action.rule is PHONY or not self.dirty(node):
+                            if node.action.rule is not PHONY:
+                                skipped += 1
+                                total -= 1
+                            finish(node)
+                            continue
+                        rule_pool = node.action.rule.pool
+                        if rule_pool is not None and \
+                                used.get(rule_pool, 0) >= self.pools.get(rule_pool, 1):
+                            deferred.append(entry)
+                            continue
+                        if running:
+                            if len(running) >= self.jobs:
+                                deferred.append(entry)
+                                break
+                            token = jobserver.acquire()
+                            if token is None:
+                                starved = True
+                                deferred.append(entry)
+                                break
+                            tokens.append(token)
+                        if rule_pool is not None:
+                            used[rule_pool] = used.get(rule_pool, 0) + 1
+                        started += 1
+                        self.log(f"[{started}/{total}] {node.description()}")
+                        running[pool.submit(self.run, node, jobserver)] = node
+                    for entry in deferred:
+                        heapq.heappush(ready, entry)
+                    if not running:
+                        break
+
+                    done, _ = wait(
+                        running, timeout=0.05 if starved else None,
+                        return_when=FIRST_COMPLETED)
+                    for future in done:
+                        node = running.pop(future)
+                        rule_pool = node.action.rule.pool
+                        if rule_pool is not None:
+                            used[rule_pool] -= 1
+                        while len(tokens) > max(len(running) - 1, 0):
+                            jobserver.release(tokens.pop())
+
+                        ret, output, seconds = future.result()
+                        if output:
+                            self.log(output.rstrip('\n'), 0 if ret else 1)
+                        if ret != 0:
+                            self.log(f"FAILED: {' '.join(node.outputs)}", 0)
+                            failed.append(node.key)
+                            continue
+                        ran += 1
+                        record = {
+                            'command': node.signature,
+                            'seconds': round(seconds, 6),
+                            'deps': self.depfile_deps(node),
+                        }
+                        if node.action.rule.restat:
+                            record['restat'] = max(
+                                (self.mtime(dep) or 0 for dep in
+                                 node.inputs + record['deps']), default=0)
+                        self.records[node.key] = record
+                        finish(node)
+        finally:
+            for token in tokens:
+                jobserver.release(token)
+            jobserver.close()
+            self.save()
+
+        if not failed and any(waiting.values()):
+            pending = [node.key for node, count in waiting.items() if count]
+            raise ValueError(f"Unreachable build actions: {pending[:5]}")
+        return {
+            'ran': ran,
+            'up_to_date': skipped,
+            'failed': failed,
+            'seconds': time.monotonic() - start,
+            'projects': self.project_seconds(),
+        }
@@ -0,0 +1,102 @@
+from typing import Dict, Hashable, Iterable, List, Mapping, Optional, Sequence, TypeVar
+
+K = TypeVar('K', bound=Hashable)
+
+
+def _component_closure(
+    members: List[K],
+    edges: Mapping[K, Sequence[K]],
+    memo: Dict[K, List[K]],
+) -> List[K]:
+    member_set = set(members)
+    cyclic = len(members) > 1 or members[0] in edges.get(members[0], ())
+    if cyclic:
+        # members are ordered by key so the result does not depend on
+        # which member of the cycle was reached first
+        members = sorted(members)
+
+    result: List[K] = []
+    seen = set()
+    for member in members:
+        for dep in edges.get(member, ()):
+            if dep not in seen:
+                seen.add(dep)
+                result.append(dep)
+            if dep in member_set:
+                continue
+            for f in memo[dep]:
+                if f not in seen:
+                    seen.add(f)
+                    result.append(f)
+    return result
+
+
+def transitive_closure(
+    roots: Iterable[K],
+    edges: Mapping[K, Sequence[K]],
+    memo: Optional[Dict[K, List[K]]] = None,
+) -> Dict[K, List[K]]:
+    """
+    Compute the transitive closure of `roots` over `edges`
+
+    The graph is condensed into strongly connected components (iterative
+    Tarjan), and the closure of every component is computed once, after
+    the closures of everything it points to. All members of a component
+    share the same result list, so the lists must be treated as read-only.
+
+    Nodes already in `memo` are not traversed, their memoized closure is
+    used as is. `memo` is filled with every node visited, so passing the
+    same dict to later calls shares the work between them.
+
+    A node is in its own closure only when it sits on a cycle.
+    """
+    if memo is None:
+        memo = {}
+    roots = list(roots)
+
+    index: Dict[K, int] = {}
+    low: Dict[K, int] = {}
+    stack: List[K] = []
+    on_stack = set()
+
+    for root in roots:
+        if root in memo or root in index:
+            continue
+
+        index[root] = low[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(edges.get(root, ())))]
+        while work:
+            node, it = work[-1]
+            for succ in it:
+                if succ in memo:
+                    continue
+                if succ not in index:
+                    index[succ] = low[succ] = len(index)
+                    stack.append(succ)
+                    on_stack.add(succ)
+                    work.append((succ, iter(edges.get(succ, ()))))
+                    break
+                if succ in on_stack and index[succ] < low[node]:
+                    low[node] = index[succ]
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    if low[node] < low[parent]:
+                        low[parent] = low[node]
+                if low[node] == index[node]:
+                    members = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        members.append(member)
+                        if member == node:
+                            break
+                    members.reverse()
+                    closure = _component_closure(members, edges, memo)
+                    for member in members:
+                        memo[member] = closure
+
+    return {root: memo[root] for root in roots}
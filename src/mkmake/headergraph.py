@@ -0,0 +1,167 @@
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional, Tuple
+
+import collections.abc
+import threading
+
+# a table of the graph: (owner, kind)
+Token = Tuple[str, str]
+
+
+class HeaderGraph(object):
+    """
+    Header paths and closures of a whole workspace, stored once
+
+    Every project publishes its tables (own headers, exports, internals,
+    closures) under its root path; dependents do not copy them, they
+    read them through a `LayeredView`. Closures are stored as tuples,
+    one per include cycle, and handed out as is; `where` indexes which
+    tables hold a name, so a lookup does not walk every visible table.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self.tables: Dict[Token, Mapping] = {}
+        self.where: Dict[str, List[Token]] = {}
+        self.lock = threading.Lock()
+
+    def publish(self, token: Token, table: Mapping) -> Token:
+        """
+        Make `table` the table of `token`, replacing the previous one
+        """
+        with self.lock:
+            old = self.tables.get(token)
+            if old is not None:
+                self.unindex(token, old.keys())
+            self.tables[token] = table
+            self.index(token, table.keys())
+            self.version += 1
+        return token
+
+    def layer(self, owner: str) -> Token:
+        """
+        The emptied closure table of project `owner`, see `store`
+        """
+        return self.publish((owner, 'closures'), {})
+
+    def store(self, token: Token, closures: Mapping[str, Iterable[str]]):
+        table = self.tables[token]
+        # members of an include cycle share one closure
+        shared: Dict[int, Tuple[str, ...]] = {}
+        for key, closure in closures.items():
+            names = shared.get(id(closure))
+            if names is None:
+                names = shared[id(closure)] = tuple(closure)
+            table[key] = names
+        with self.lock:
+            self.index(token, closures.keys())
+            self.version += 1
+
+    def index(self, token: Token, keys: Iterable[str]):
+        where = self.where
+        for key in keys:
+            owners = where.get(key)
+            if owners is None:
+                where[key] = [token]
+            elif token not in owners:
+                owners.append(token)
+
+    def unindex(self, token: Token, keys: Iterable[str]):
+        where = self.where
+        for key in keys:
+            owners = where.get(key)
+            if owners is not None and token in owners:
+                owners.remove(token)
+                if not owners:
+                    del where[key]
+
+
+class LayeredView(collections.abc.Mapping):
+    """
+    Read-only view over tables of one or more graphs
+
+    Tables are searched in order, so a project's own table shadows the
+    tables of its dependencies, and earlier dependencies shadow later
+    ones. Tables of the first graph are found through its `where` index,
+    those of other graphs are searched one by one.
+    """
+
+    def __init__(self, layers: Iterable[Tuple[HeaderGraph, Token]] = ()):
+        self.layers: List[Tuple[HeaderGraph, Token]] = []
+        self.graph: Optional[HeaderGraph] = None
+        self.rank: Dict[Token, int] = {}
+        self.foreign: List[Tuple[int, HeaderGraph, Token]] = []
+        self.counted: Optional[List[Tuple[int, int]]] = None
+        self.size = 0
+        for graph, token in layers:
+            self.append(graph, token)
+
+    def append(self, graph: HeaderGraph, token: Token):
+        i = len(self.layers)
+        self.layers.append((graph, token))
+        if self.graph is None:
+            self.graph = graph
+        if graph is self.graph:
+            self.rank.setdefault(token, i)
+        else:
+            self.foreign.append((i, graph, token))
+
+    def lookup(self, key: str):
+        best = len(self.layers)
+        if self.graph is not None:
+            rank = self.rank
+            for token in self.graph.where.get(key, ()):
+                i = rank.get(token, best)
+                if i < best:
+                    best = i
+        for i, graph, token in self.foreign:
+            if i >= best:
+                break
+            table = graph.tables[token]
+            if key in table:
+                return table[key]
+        if best < len(self.layers):
+            graph, token = self.layers[best]
+            return graph.tables[token][key]
+        return None
+
+    def __getitem__(self, key: str):
+        found = self.lookup(key)
+        if found is None:
+            raise KeyError(key)
+        return found
+
+    def get(self, key: str, default=None):
+        found = self.lookup(key)
+        if found is None:
+            return default
+        return found
+
+    def __contains__(self, key: object) -> bool:
+        return self.lookup(key) is not None
+
+    def items(self) -> Iterator[Tuple[str, object]]:
+        seen = set()
+        for graph, token in self.layers:
+            for key, value in graph.tables[token].items():
+                if key not in seen:
+                    seen.add(key)
+                    yield key, value
+
+    def __iter__(self) -> Iterator[str]:
+        seen = set()
+        for graph, token in self.layers:
+            for key in graph.tables[token]:
+                if key not in seen:
+                    seen.add(key)
+                    yield key
+
+    def __len__(self) -> int:
+        # the union is only counted again after one of its tables changed
+        state = [
+            (graph.version, len(graph.tables[token]))
+            for graph, token in self.layers
+        ]
+        if state != self.counted:
+            self.size = sum(1 for _ in self)
+            self.counted = state
+        return self.size
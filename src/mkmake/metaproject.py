@@ -1,90 +1,475 @@
-from typing import Dict, List, Set
+from typing import Dict, List, Optional, Set, Tuple, Union
+import io
 import os
 import os.path as path
+import sys
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
+from .actions import DEFAULT_POOLS
+from .executor import Executor
+from .headergraph import HeaderGraph
+from .ninja import write_ninja
 from .projects import CProject
+from .report import Report
+from .scancache import ScanCache
+from .schedule import Schedule, load_times, save_times
 
 
-def _sort_projects(
-    name: str,
-    projects: Dict[str, CProject],
-    ordered: List[str],
-    visiting: Set[str],
-    visited: Set[str],
+def _report_name(name: str, proj: CProject) -> str:
+    if proj.variant is None:
+        return name
+    return f"{proj.variant}/{name}"
+
+
+def _scan_sources(report: Report, name: str, proj: CProject) -> None:
+    report.run(
+        _report_name(name, proj), "scan_sources", proj.scan_sources,
+        lambda: len(proj.all_sources))
+
+
+def _scan_state(ordered_projects: List[Tuple[str, CProject]]):
+    return [
+        tuple(getattr(proj, key, None) for key in CProject.SCAN_ATTRS)
+        for _, proj in ordered_projects
+    ]
+
+
+def _scan_deps(
+    report: Report, name: str, proj: CProject, projects: Dict[str, CProject],
+    scan: bool = True,
+) -> None:
+    name = _report_name(name, proj)
+    report.run(
+        name, "inject_depends", lambda: proj.inject_depends(projects),
+        lambda: len(proj.depends))
+    if scan:
+        report.run(
+            name, "scan_deps", proj.scan_deps,
+            lambda: len(proj.all_sources))
+
+
+def _write_makefile(report: Report, name: str, proj: CProject) -> None:
+    report.run(
+        _report_name(name, proj), "write_makefile", proj.make,
+        lambda: len(proj.objs))
+
+
+def _scan_all_sources(
+    ordered_projects: List[Tuple[str, CProject]], report: Report, jobs: int
 ) -> None:
-    if name in visited:
+    if jobs <= 1:
+        for name, proj in ordered_projects:
+            _scan_sources(report, name, proj)
         return
-    if name in visiting:
-        raise ValueError(f"Dependency cycle detected at project '{name}'")
-    if name not in projects:
-        raise ValueError(f"Unknown project dependency '{name}'")
 
-    visiting.add(name)
-    proj = projects[name]
-    for child in proj.depends:
-        _sort_projects(child, projects, ordered, visiting, visited)
-    visiting.remove(name)
+    with ThreadPoolExecutor(jobs) as project_pool:
+        for future in [
+            project_pool.submit(_scan_sources, report, name, proj)
+            for name, proj in ordered_projects
+        ]:
+            future.result()
+
+
+def _check_exports(ordered: List[Tuple[str, CProject]]) -> None:
+    """
+    Report headers exported by more than one project into the merged
+    include tree, they would overwrite each other
+    """
+    owners: Dict[str, str] = {}
+    for name, proj in ordered:
+        if proj.export_mode != CProject.ExportMode.MERGED:
+            continue
+        for key in proj.exports:
+            owner = owners.setdefault(key, name)
+            if owner != name:
+                raise ValueError(
+                    f"Conflicting exported header '{key}' "
+                    f"of projects '{owner}' and '{name}'")
+
+
+def _schedule(projects: Dict[str, CProject], target_root: str) -> Schedule:
+    """
+    Schedule weighted by recorded build times when every project has
+    one, by source count otherwise
+    """
+    times = load_times(target_root)
+    if all(name in times for name in projects):
+        return Schedule(projects, times)
+    return Schedule(projects, {
+        name: len(proj.all_sources) for name, proj in projects.items()
+    })
+
+
+def _make_serial(
+    ordered_projects: List[Tuple[str, CProject]],
+    projects: Dict[str, CProject],
+    report: Report,
+    scan: bool = True,
+    write: bool = True,
+) -> None:
+    for name, proj in ordered_projects:
+        _scan_deps(report, name, proj, projects, scan)
+
+    if write:
+        for name, proj in ordered_projects:
+            _write_makefile(report, name, proj)
+
+
+def _make_parallel(
+    ordered_projects: List[Tuple[str, CProject]],
+    projects: Dict[str, CProject],
+    report: Report,
+    jobs: int,
+    scan: bool = True,
+    write: bool = True,
+) -> None:
+    def process(name: str, proj: CProject) -> None:
+        _scan_deps(report, name, proj, projects, scan)
+        if write:
+            _write_makefile(report, name, proj)
+
+    # Projects and files get separate pools, a project task blocks on
+    # its file scans and must not starve them of workers.
+    with ThreadPoolExecutor(jobs) as file_pool, \
+            ThreadPoolExecutor(jobs) as project_pool:
+        for _, proj in ordered_projects:
+            proj.executor = file_pool
+
+        try:
+            # ordered by priority, ready projects on the critical path
+            # are submitted first
+            pending = [name for name, _ in ordered_projects]
+            running = {}
+            done: Set[str] = set()
+            while pending or running:
+                for name in list(pending):
+                    proj = projects[name]
+                    if all(dep in done for dep in proj.depends):
+                        pending.remove(name)
+                        running[project_pool.submit(process, name, proj)] = name
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    future.result()
+                    done.add(running.pop(future))
+        finally:
+            for _, proj in ordered_projects:
+                proj.executor = None
+
+
+def _write_meta_makefile(
+    meta_makefile: str,
+    ordered_projects: List[Tuple[str, CProject]],
+    schedule: Schedule,
+    record_root: Optional[str] = None,
+) -> None:
+    """
+    With `record_root`, project builds are timed into the
+    `project-times.json` there
+    """
+    names = [name for name, _ in ordered_projects]
+    fout = io.StringIO()
+    phonies = ["default", "all-all", "clean-all", "rebuild-all"]
+    fout.write("default : all-all\n")
+    for name, proj in ordered_projects:
+        timer = ""
+        if record_root is not None:
+            timer = (
+                f"{sys.executable} -m mkmake.buildtime {record_root} {name} ")
+        fout.write(
+            f"############ Project {name} ############\n"
+            f"{name} : {' '.join(schedule.rank(proj.depends))}\n"
+            f"\t@echo Project {name}\n"
+            f"\t{timer}$(MAKE) -C {proj.root_path} -f {proj.makefile}\n\n"
+        )
+        phonies.append(name)
+
+        for word in proj.phonies:
+            target = f"{word}-{name}"
+            fout.write(
+                f"{target} : \n"
+                f"\t@echo Project {name} {word}\n"
+                f"\t$(MAKE) -C {proj.root_path} -f {proj.makefile} {word}\n\n"
+            )
+            phonies.append(target)
+
+    fout.write(
+        f"all-all : {' '.join(names)}\n"
+        f"clean-all : {' '.join(f'clean-{name}' for name in names)}\n"
+        "rebuild-all : clean-all all-all\n"
+    )
+    fout.write(f".PHONY : {' '.join(phonies)}\n")
+
+    CProject.write_if_changed(meta_makefile, fout.getvalue())
+
+
+def _write_workspace_makefile(
+    workspace_makefile: str,
+    ordered_projects: List[Tuple[str, CProject]],
+    common_root: str,
+) -> None:
+    names = [name for name, _ in ordered_projects]
+    fout = io.StringIO()
+    phonies = ["default", "all-all", "clean-all", "rebuild-all"]
+    fout.write(
+        f"# Run from {common_root}\n"
+        "default : all-all\n\n"
+    )
+    for name, proj in ordered_projects:
+        fout.write(
+            f"############ Project {name} ############\n"
+            f"include {proj.get_path(proj.makefile)}\n"
+            f"{name} : all-{name}\n\n"
+        )
+        phonies.append(name)
+
+    fout.write(
+        f"all-all : {' '.join(f'all-{name}' for name in names)}\n"
+        f"clean-all : {' '.join(f'clean-{name}' for name in names)}\n"
+        "rebuild-all : clean-all all-all\n"
+    )
+    fout.write(f".PHONY : {' '.join(phonies)}\n")
+
+    CProject.write_if_changed(workspace_makefile, fout.getvalue())
+
+
+def _executor(
+    ordered_projects: List[Tuple[str, CProject]],
+    target_root: str,
+    jobs: int,
+    pools: Optional[Dict[str, int]],
+    verbose: int,
+) -> Executor:
+    """
+    Executor of the variant just generated, its actions come from the
+    plan the Makefiles were written with
+    """
+    for _, proj in ordered_projects:
+        proj.plan_actions()
+    # one log for every variant, their outputs are distinct; project
+    # times are merged across variants by `_execute`
+    return Executor(
+        ordered_projects, target_root, jobs, pools, verbose,
+        record_times=False)
+
+
+def _execute(
+    executors: Dict[Optional[str], Executor],
+    target_root: str,
+    execute: Union[bool, List[str]],
+) -> dict:
+    """
+    Build every variant in turn, up to the first failure; returns the
+    build result, per variant with variants
+    """
+    words = ['all'] if execute is True else list(execute)
+    builds = {}
+    for variant, executor in executors.items():
+        builds[variant] = executor.build(words)
+        if builds[variant]['failed']:
+            break
+
+    # projects build in every variant, weigh them by their mean time
+    seconds: Dict[str, List[float]] = {}
+    for result in builds.values():
+        for name, value in result['projects'].items():
+            seconds.setdefault(name, []).append(value)
+    times = load_times(target_root)
+    times.update({
+        name: round(sum(values) / len(values), 6)
+        for name, values in seconds.items()
+    })
+    save_times(target_root, times)
+
+    if list(builds) == [None]:
+        return builds[None]
+    return builds
 
-    visited.add(name)
-    ordered.append(name)
 
+def make_projects(
+    projects: Dict[str, CProject],
+    cache: bool = True,
+    jobs: Optional[int] = None,
+    recursive: bool = True,
+    verbose: int = 1,
+    trace_memory: bool = False,
+    record_times: bool = False,
+    variants: Optional[Dict[str, Dict[str, object]]] = None,
+    backend: str = "make",
+    pools: Optional[Dict[str, int]] = None,
+    execute: Union[bool, List[str]] = False,
+    generate: bool = True,
+    **kwargs
+) -> dict:
+    """
+    Generate the Makefiles of `projects` and their meta Makefile
+
+    With `variants`, a mapping of variant names to project attributes
+    (e.g. `{'debug': {'debug': True}, 'release': {}}`), the workspace is
+    scanned once and every variant is generated into its own
+    `target/<variant>` trees, meta Makefile included.
+
+    With `backend="ninja"` a single `target/build.ninja`, run from the
+    common root, replaces the Makefiles; `pools` maps the `link` and
+    `generate` pools to their depth.
+
+    With `execute=True` (or a list of phony targets, default `['all']`)
+    the generated workspace is also built in process by
+    `mkmake.executor`, `jobs` actions at a time, every variant in turn;
+    a failed build raises `RuntimeError`.
+
+    With `generate=False` the projects are only scanned, for queries
+    like `mkmake.query.affected`: no Makefile, build.ninja or meta
+    Makefile is written (unity sources and the scan cache still are).
 
-def make_projects(projects: Dict[str, CProject], **kwargs) -> None:
+    Returns the generation report: per-project, per-phase wall time and
+    file counts, scan cache statistics and, with `trace_memory`, the
+    peak traced memory in bytes. With `record_times`, `Projects.mk`
+    records the build seconds of each project for the next schedule.
+    """
+    if backend not in ("make", "ninja"):
+        raise ValueError(f"Unknown backend '{backend}'")
+    report = Report(trace_memory)
     if not projects:
-        return
+        return report.to_dict()
+    report.start()
 
     common_root = path.commonpath([proj.root_path for proj in projects.values()])
     target_root = path.join(common_root, "target")
     os.makedirs(target_root, exist_ok=True)
 
-    ordered_names: List[str] = []
-    visiting: Set[str] = set()
-    visited: Set[str] = set()
-    for name in projects:
-        _sort_projects(name, projects, ordered_names, visiting, visited)
-
-    ordered_projects = [(name, projects[name]) for name in ordered_names]
+    schedule = Schedule(projects)
+    ordered_projects = [(name, projects[name]) for name in schedule.order]
 
     for _, proj in ordered_projects:
+        proj.workspace_root = common_root
+        proj.verbose = verbose
         for key, value in kwargs.items():
             if value is not None:
                 setattr(proj, key, value)
 
-    for _, proj in ordered_projects:
-        proj.scan_sources()
+    if not recursive or backend == "ninja":
+        # one namespaced fragment per project, included by a single
+        # workspace Makefile (or build.ninja) run from the common root
+        for name, proj in ordered_projects:
+            proj.namespace = name
+            proj.path_root = common_root
+            proj.makefile_name = "Project.mk"
+            proj.backend = backend
 
+    graph = HeaderGraph()
+    paths = {}
     for _, proj in ordered_projects:
-        proj.inject_depends(projects)
-        proj.scan_deps()
+        proj.graph = graph
+        proj.paths = paths
 
-    for _, proj in ordered_projects:
-        proj.make()
+    scan_cache = None
+    if cache:
+        # cached includes depend on the scanner settings
+        preambles = sorted({
+            str(proj.scan_preamble_lines) for _, proj in ordered_projects
+        })
+        scan_cache = ScanCache(
+            path.join(target_root, "scan-cache.json"),
+            f"{CProject.INCLUDE_RE.pattern.decode()}|{','.join(preambles)}",
+        )
+        for _, proj in ordered_projects:
+            proj.scan_cache = scan_cache
+        cached_preambles = {
+            name: proj.scan_preamble_lines for name, proj in ordered_projects
+        }
+
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    _scan_all_sources(ordered_projects, report, jobs)
+    _check_exports(ordered_projects)
 
-    meta_makefile = path.join(target_root, "Projects.mk")
-    with open(meta_makefile, "w") as fout:
-        phonies = ["default", "all-all", "clean-all", "rebuild-all"]
-        fout.write("default : all-all\n")
+    schedule = _schedule(projects, target_root)
+    ordered_projects = [(name, projects[name]) for name in schedule.order]
+    report.schedule = schedule.to_dict()
+    if variants is None:
+        variants = {None: {}}
+    executors: Dict[Optional[str], Executor] = {}
+    # attributes a variant leaves unset keep their common value
+    defaults = {
+        name: {
+            key: getattr(proj, key, None)
+            for settings in variants.values() for key in settings
+        }
+        for name, proj in ordered_projects
+    }
+    # closures only depend on the scan settings, variants sharing them
+    # share one scan
+    sources_state = _scan_state(ordered_projects)
+    deps_state = None
+    for variant, settings in variants.items():
         for name, proj in ordered_projects:
-            fout.write(
-                f"############ Project {name} ############\n"
-                f"{name} : {' '.join(proj.depends)}\n"
-                f"\t@echo Project {name}\n"
-                f"\t$(MAKE) -C {proj.root_path} -f {proj.makefile}\n\n"
-            )
-            phonies.append(name)
+            for key, value in {**defaults[name], **settings}.items():
+                setattr(proj, key, value)
+            proj.set_variant(variant)
+        state = _scan_state(ordered_projects)
+        if state != sources_state:
+            if scan_cache is not None:
+                # cached includes only hold for the cached preamble
+                for name, proj in ordered_projects:
+                    proj.scan_cache = scan_cache \
+                        if proj.scan_preamble_lines == cached_preambles[name] \
+                        else None
+            _scan_all_sources(ordered_projects, report, jobs)
+            _check_exports(ordered_projects)
+            sources_state = state
+            deps_state = None
+        scan = state != deps_state
+        deps_state = state
+        if jobs > 1:
+            _make_parallel(
+                ordered_projects, projects, report, jobs, scan, generate)
+        else:
+            _make_serial(ordered_projects, projects, report, scan, generate)
+        if not generate:
+            # planned again from this scan, as `make` would
+            for _, proj in ordered_projects:
+                proj.planned = {}
+            continue
 
-            for word in proj.phonies:
-                target = f"{word}-{name}"
-                fout.write(
-                    f"{target} : \n"
-                    f"\t@echo Project {name} {word}\n"
-                    f"\t$(MAKE) -C {proj.root_path} -f {proj.makefile} {word}\n\n"
-                )
-                phonies.append(target)
+        variant_root = target_root
+        if variant is not None:
+            variant_root = path.join(target_root, variant)
+        if backend == "ninja":
+            write_ninja(
+                path.join(variant_root, "build.ninja"), ordered_projects,
+                {**DEFAULT_POOLS, **(pools or {})}, common_root)
+        elif recursive:
+            _write_meta_makefile(
+                path.join(variant_root, "Projects.mk"),
+                ordered_projects, schedule,
+                target_root if record_times else None)
+        else:
+            _write_workspace_makefile(
+                path.join(variant_root, "Workspace.mk"),
+                ordered_projects, common_root)
+        if execute:
+            executors[variant] = _executor(
+                ordered_projects, target_root, jobs, pools, verbose)
 
-        fout.write(
-            f"all-all : {' '.join(ordered_names)}\n"
-            f"clean-all : {' '.join(f'clean-{name}' for name in ordered_names)}\n"
-            "rebuild-all : clean-all all-all\n"
-        )
-        fout.write(f".PHONY : {' '.join(phonies)}\n")
+    if scan_cache is not None:
+        report.cache = scan_cache.stats()
+        if verbose >= 1:
+            print(f"Scan cache: {scan_cache.hits} hits, "
+                  f"{scan_cache.misses} misses.")
+        scan_cache.save()
+
+    report.stop()
+    if verbose >= 1:
+        print(f"{'Generated' if generate else 'Scanned'} "
+              f"{len(ordered_projects)} projects "
+              f"in {report.total_seconds:.3f}s.")
+    if executors:
+        # timed on its own, in `report.build`
+        report.build = _execute(executors, target_root, execute)
+        results = [report.build] if None in executors \
+            else list(report.build.values())
+        failed = [key for result in results for key in result['failed']]
+        if failed:
+            raise RuntimeError(f"Build failed: {', '.join(failed)}")
+    return report.to_dict()
@@ -0,0 +1,116 @@
+"""
+Ninja backend: one `build.ninja` for the actions of a workspace
+"""
+from typing import Dict, List, Tuple
+
+import io
+import os.path as path
+
+from .actions import CONSOLE, PHONY, Action, Rule
+from .projects import Project, TestProject
+
+
+def escape_path(word: str) -> str:
+    return word.replace('$', '$$').replace(' ', '$ ').replace(':', '$:')
+
+
+class NinjaWriter(object):
+    """
+    Ninja syntax for rules, pools, variables and actions
+    """
+
+    def __init__(self):
+        self.fout = io.StringIO()
+
+    def comment(self, text: str):
+        self.fout.write(f"# {text}\n")
+
+    def newline(self):
+        self.fout.write("\n")
+
+    def variable(self, name: str, value: str, indent: int = 0):
+        self.fout.write(f"{'  ' * indent}{name} = {value}\n")
+
+    def pool(self, name: str, depth: int):
+        self.fout.write(f"pool {name}\n")
+        self.variable('depth', str(depth), 1)
+
+    def rule(self, rule: Rule):
+        self.fout.write(f"rule {rule.name}\n")
+        self.variable('command', rule.command, 1)
+        self.variable('description', rule.description, 1)
+        if rule.depfile is not None:
+            self.variable('depfile', rule.depfile, 1)
+        if rule.deps is not None:
+            self.variable('deps', rule.deps, 1)
+        if rule.pool is not None:
+            self.variable('pool', rule.pool, 1)
+        if rule.restat:
+            self.variable('restat', '1', 1)
+
+    def action(self, action: Action):
+        words = [' '.join(escape_path(p) for p in action.outputs) + ':',
+                 action.rule.name]
+        words += [escape_path(p) for p in action.inputs]
+        if action.implicit:
+            words += ['|'] + [escape_path(p) for p in action.implicit]
+        if action.order_only:
+            words += ['||'] + [escape_path(p) for p in action.order_only]
+        self.fout.write(f"build {' '.join(words)}\n")
+        for name, value in action.variables.items():
+            self.variable(name, value, 1)
+
+    def getvalue(self):
+        return self.fout.getvalue()
+
+
+def write_ninja(
+    ninja_file: str,
+    ordered_projects: List[Tuple[str, Project]],
+    pools: Dict[str, int],
+    common_root: str,
+) -> None:
+    """
+    Write the actions of `ordered_projects` into `ninja_file`, run from
+    `common_root`
+    """
+    writer = NinjaWriter()
+    writer.comment(f"Run from {common_root}")
+    writer.variable('ninja_required_version', '1.7')
+    writer.variable('builddir', path.relpath(
+        path.dirname(ninja_file), common_root).replace(path.sep, '/'))
+    writer.newline()
+
+    rules: Dict[str, Rule] = {}
+    for _, proj in ordered_projects:
+        for rule in proj.actions.rules():
+            known = rules.setdefault(rule.name, rule)
+            if known is not rule:
+                raise ValueError(f"Conflicting definitions of rule '{rule.name}'")
+    used = {rule.pool for rule in rules.values()} - {None, CONSOLE}
+    for name in sorted(used):
+        writer.pool(name, pools.get(name, 1))
+    writer.newline()
+    for rule in rules.values():
+        writer.rule(rule)
+    writer.newline()
+
+    alls = []
+    tests = []
+    for name, proj in ordered_projects:
+        writer.comment(f"Project {name}")
+        for var, value in proj.actions.variables.items():
+            writer.variable(var, value)
+        for action in proj.actions.actions:
+            writer.action(action)
+        writer.newline()
+        alls.append(proj.phony('all'))
+        if isinstance(proj, TestProject):
+            tests.append(proj.phony('test'))
+
+    writer.action(Action(PHONY, ['all'], alls))
+    if tests:
+        writer.action(Action(PHONY, ['test'], tests))
+    writer.fout.write("default all\n")
+
+    Project.write_if_changed(ninja_file, writer.getvalue())
@@ -1,15 +1,22 @@
-from typing import Dict, List, Optional, TextIO
+from typing import Dict, Iterable, List, Optional, TextIO, Tuple
 
+import itertools
 import re
 import sys
+import os
 import os.path as path
 from enum import Enum, auto
+from fnmatch import fnmatch
 
+from ..actions import PHONY, Action, ActionGraph, Rule
+from ..graph import transitive_closure
+from ..headergraph import HeaderGraph, LayeredView
+from ..scanner import INCLUDE_RE, scan_includes
 from .project import Project
 
 
 class CProject(Project):
-    INCLUDE_RE = re.compile(r"#include\s*\"(.*)\"")
+    INCLUDE_RE = INCLUDE_RE
     SUFFIX_RE = re.compile(r"\.[^.]+$")
     LIB_RE = re.compile(r"lib(.*)\.(a|so)")
 
@@ -19,27 +26,85 @@ class CProject(Project):
         "\tcp $< $@\n"
     )
 
+    H_LINK_RULE = (
+        "\t@echo Link $@\n"
+        "\tmkdir -p $(dir $@)\n"
+        "\tln -f $< $@ 2>/dev/null || cp $< $@\n"
+    )
+
+    H_SYMLINK_RULE = (
+        "\t@echo Link $@\n"
+        "\tmkdir -p $(dir $@)\n"
+        "\tln -sf $(abspath $<) $@\n"
+    )
+
     C_CXX_RULE = (
         "\t@echo {0} $<\n"
         "\tmkdir -p $(dir $@)\n"
-        "\t$({0}) -c $({1}) -o $@ $<\n"
+        "\t$({0}) -c {1} -o $@ $<\n"
+    )
+
+    C_RULE = C_CXX_RULE.format('CC', '$(CFLAGS)')
+
+    PCH_RULE = (
+        "\t@echo PCH $@\n"
+        "\tmkdir -p $(dir $@)\n"
+        "\t$({0}) -x c-header -c $({1}) -o $@ $<\n"
+    )
+
+    # attributes the scanned sources and closures depend on, variants
+    # changing them are scanned again
+    SCAN_ATTRS = (
+        'exclude', 'scan_preamble_lines', 'compiler_deps', 'test',
+        'private_depends',
     )
 
-    C_RULE = C_CXX_RULE.format('CC', 'CFLAGS')
+    # backend-neutral rules, see mkmake.actions
+    CC_ACTION = Rule(
+        'cc', '$cc -MMD -MF $out.d $cflags -c $in -o $out', 'CC $in',
+        depfile='$out.d', deps='gcc')
+    PCH_ACTION = Rule(
+        'pch', '$cc -MMD -MF $out.d $cflags -x c-header -c $in -o $out',
+        'PCH $out', depfile='$out.d', deps='gcc')
+    # unchanged exports keep their mtime
+    COPY_ACTION = Rule(
+        'export_copy', 'cmp -s $in $out || cp $in $out', 'Copy $out',
+        restat=True)
+    LINK_ACTION = Rule(
+        'export_link', 'ln -f $in $out 2>/dev/null || cp $in $out',
+        'Link $out')
+    SYMLINK_ACTION = Rule('export_symlink', 'ln -sf $source $out', 'Link $out')
+    AR_ACTION = Rule(
+        'ar', 'rm -f $out && $ar $arflags -rcs$thin $out $in', 'AR $out',
+        pool='link')
+    LD_ACTION = Rule(
+        'ld', '$ld $ldflags -o $out $in $ldlibs', 'LD $out', pool='link')
 
     class OutputType(Enum):
         BINARY = auto()
         STATIC = auto()
         SHARED = auto()
 
+    class ArchiveMode(Enum):
+        FULL = auto()
+        # replace only the changed members
+        INCREMENTAL = auto()
+        # reference the objects in place
+        THIN = auto()
+
+    class ExportMode(Enum):
+        COPY = auto()
+        HARDLINK = auto()
+        SYMLINK = auto()
+        # copies into one include tree shared by the workspace
+        MERGED = auto()
+
     def __init__(self, root_path: str, **kwargs):
         super().__init__(root_path, **kwargs)
 
         self.source_path = path.join(self.root_path, 'src')
         self.include_path = path.join(self.root_path, 'include')
         self.internal_path = path.join(self.source_path, 'include')
-        self.obj_path = path.join(self.build_root, 'obj')
-        self.export_path = path.join(self.build_root, 'include')
 
         self.output_name = kwargs['output_name']
         self.output_type = kwargs['output_type']
@@ -49,91 +114,190 @@ class CProject(Project):
         self.lib_paths = kwargs.get('lib_paths', [])
         self.libs = kwargs.get('libs', [])
         self.std = kwargs.get('std', None)
+        self.compiler_deps = kwargs.get('compiler_deps', False)
+        self.export_mode = kwargs.get('export_mode', CProject.ExportMode.COPY)
+        self.flag_stamps = kwargs.get('flag_stamps', True)
+        self.object_stamps = kwargs.get('object_stamps', False)
+        self.pch = kwargs.get('pch', False)
+        self.pch_threshold = kwargs.get('pch_threshold', 0.5)
+        self.unity = kwargs.get('unity', False)
+        self.unity_batch_size = kwargs.get('unity_batch_size', 8)
+        self.unity_exclude = kwargs.get('unity_exclude', [])
+        self.compile_cache = kwargs.get('compile_cache', None)
+        self.compile_cache_size = kwargs.get('compile_cache_size', None)
+        self.scan_cache = kwargs.get('scan_cache', None)
+        self.graph = kwargs.get('graph', None)
+        self.scan_preamble_lines = kwargs.get('scan_preamble_lines', None)
+        self.executor = None
 
         self.cc = kwargs.get('cc', 'gcc')
         if self.output_type == CProject.OutputType.STATIC:
             self.ar = kwargs.get('ar', 'ar')
+            self.archive_mode = kwargs.get(
+                'archive_mode', CProject.ArchiveMode.FULL)
         else:
             self.ld = kwargs.get('ld', 'gcc')
 
-        self.all_includes = [self.include_path, self.internal_path]
+        self.own_includes = [self.include_path, self.internal_path]
+        self.all_includes = list(self.own_includes)
 
         self.source_suffix = ['c']
         self.header_suffix = ['h']
 
-    def scan_sources(self):
-        print("Scan sources and headers...")
-
-        self.sources = self.scan_files([self.source_path], self.source_suffix)
-        self.headers = self.scan_files([self.include_path], self.header_suffix)
+    def build_paths(self):
+        super().build_paths()
+        self.obj_path = path.join(self.build_root, 'obj')
+        self.export_path = path.join(self.build_root, 'include')
+        self.pch_path = path.join(self.build_root, 'pch')
+        self.unity_path = path.join(self.build_root, 'unity')
+        self.unity_obj_path = path.join(self.obj_path, 'unity')
+        self.flags_path = path.join(self.build_root, 'flags')
+
+    def set_variant(self, variant: Optional[str]):
+        super().set_variant(variant)
+        if hasattr(self, 'headers'):
+            # scanned already, only the export paths move
+            self.export_headers()
+
+    def export_headers(self):
+        """
+        Map the public headers to their exported paths
+        """
+        if self.export_mode == CProject.ExportMode.MERGED:
+            # <workspace>/target[/<variant>]/include
+            self.export_path = path.join(
+                self.workspace_root,
+                path.relpath(self.build_root, self.root_path), 'include')
+        else:
+            self.export_path = path.join(self.build_root, 'include')
         self.exports = {
             key: path.join(self.export_path, key)
             for key in self.headers.keys()
         }
-        self.internals = self.scan_files([self.internal_path], self.header_suffix)
+        self.export_table = self.graph.publish(
+            (self.root_path, 'exports'), self.exports)
+
+    def source_buckets(self):
+        return {
+            'sources': (self.source_path, self.source_suffix),
+            'headers': (self.include_path, self.header_suffix),
+            'internals': (self.internal_path, self.header_suffix),
+        }
+
+    def scan_sources(self):
+        self.log("Scan sources and headers...", 2)
+
+        self.scanned = self.scan_buckets(self.source_buckets())
+        self.sources = self.scanned['sources']
+        self.headers = self.scanned['headers']
+        self.internals = self.scanned['internals']
 
         self.all_sources = self.sources.copy()
         self.safe_update(self.all_sources, self.headers)
         self.safe_update(self.all_sources, self.internals)
-        self.all_deps = self.all_sources.copy()
-        self.deps = {}
-        print(f"Found {len(self.sources)} sources, "
-              f"{len(self.headers)} headers, "
-              f"{len(self.internals)} internal headers.")
+        # dependency headers and closures are layered on in inject_depends
+        self.own_deps = self.all_deps = self.all_sources.copy()
+        if self.graph is None:
+            self.graph = HeaderGraph()
+        self.export_headers()
+        self.internal_table = self.graph.publish(
+            (self.root_path, 'internals'), self.internals)
+        self.closures = self.graph.layer(self.root_path)
+        self.deps = LayeredView([(self.graph, self.closures)])
+        self.rendered: Dict[str, str] = {}
+        self.log(f"Found {len(self.sources)} sources, "
+                 f"{len(self.headers)} headers, "
+                 f"{len(self.internals)} internal headers.")
+
+    def scan_includes_file(self, source: str):
+        return scan_includes(source, self.scan_preamble_lines)
+
+    def includes_file(self, source: str):
+        if self.scan_cache is not None:
+            return self.scan_cache.get(source, self.scan_includes_file)
+        return self.scan_includes_file(source)
 
     def scan_deps_file(self, source: Optional[str]):
-        ret: List[str] = []
-        with open(source, 'r') as fin:
-            for line in fin:
-                mat = CProject.INCLUDE_RE.match(line.strip())
-                if mat is not None:
-                    header = mat.group(1)
-                    if header in self.all_deps:
-                        ret.append(mat.group(1))
-        return ret
-
-    def expand_deps(self, key: str):
-        deps = self.deps[key]
-        i = 0
-        while i < len(deps):
-            dep = deps[i]
-            if dep in self.deps:
-                for f in self.deps[dep]:
-                    if f not in deps:
-                        deps.append(f)
-            i += 1
-
-    def scan_source_dependency(self):
-        self.deps.update({
-            key: self.scan_deps_file(source)
-            for key, source in self.all_sources.items()
-        })
+        return [
+            header for header in self.includes_file(source)
+            if header in self.all_deps
+        ]
+
+    def expand_deps(self, edges: Dict[str, List[str]]):
+        # closures of dependency headers are already expanded, only the
+        # ones included here are looked up
+        injected = set()
+        for includes in edges.values():
+            injected.update(includes)
+        injected.difference_update(self.all_sources)
+        memo = {}
+        for dep in injected:
+            closure = self.deps.get(dep)
+            if closure is not None:
+                memo[dep] = closure
+        self.graph.store(self.closures, transitive_closure(
+            edges.keys(), edges, memo))
+
+    def scan_source_dependency(
+        self, files: Optional[Dict[str, str]] = None,
+    ) -> Dict[str, List[str]]:
+        if files is None:
+            files = self.all_sources
+        if self.executor is not None:
+            includes = dict(zip(
+                files.keys(), self.executor.map(
+                    self.includes_file, files.values())
+            ))
+        else:
+            includes = {
+                key: self.includes_file(source)
+                for key, source in files.items()
+            }
+
+        # resolve each distinct name once against the layered headers
+        names = set()
+        for headers in includes.values():
+            names.update(headers)
+        visible = {name for name in names if name in self.all_deps}
+        return {
+            key: [header for header in headers if header in visible]
+            for key, headers in includes.items()
+        }
 
     def scan_deps(self):
-        print("Scan deps...")
-        self.scan_source_dependency()
-        for key in self.all_sources.keys():
-            self.expand_deps(key)
-        print("Deps processed.")
-        print(f"all_sources={self.all_sources}")
-        print(f"all_deps={self.all_deps}")
-        print(f"deps={self.deps}")
+        if self.compiler_deps:
+            # sources are left to the compiler, dependents still need the
+            # closures of the headers
+            self.log("Scan header deps...", 2)
+            headers = self.headers.copy()
+            headers.update(self.internals)
+            self.expand_deps(self.scan_source_dependency(headers))
+            self.log("Source deps left to the compiler.", 2)
+            return
+        self.log("Scan deps...", 2)
+        self.expand_deps(self.scan_source_dependency())
+        self.log("Deps processed.", 2)
 
     def inject_depends(self, projects: Dict[str, Project]):
         super().inject_depends(projects)
 
-        libs = []
+        # rebuilt from scratch, a project may be injected again
+        self.all_includes = list(self.own_includes)
+        self.dep_libs = []
+        self.dep_lib_paths = []
         self.lib_depends = []
+        # views, not copies: own entries first, then each dependency's
+        self.all_deps = LayeredView([(self.graph, self.graph.publish(
+            (self.root_path, 'sources'), self.own_deps))])
+        layers = [(self.graph, self.closures)]
         for proj in self.depends_proj.values():
             assert isinstance(proj, CProject), "Depends not a CProject"
 
-            self.all_includes.append(proj.export_path)
-            for key, value in proj.exports.items():
-                if key not in self.all_deps:
-                    self.all_deps[key] = value
-            for key, value in proj.deps.items():
-                if key not in self.deps:
-                    self.deps[key] = value
+            # a merged include tree needs a single -I
+            if proj.export_path not in self.all_includes:
+                self.all_includes.append(proj.export_path)
+            self.all_deps.append(proj.graph, proj.export_table)
+            layers.append((proj.graph, proj.closures))
 
             lib = proj.output_name
             lib_path = path.join(proj.build_root, lib)
@@ -142,14 +306,15 @@ class CProject(Project):
             mat = CProject.LIB_RE.match(lib)
             if mat is not None:
                 lib = mat.group(1)
-            libs.append(lib)
-            self.lib_paths.append(proj.build_root)
-
-        self.libs = libs + self.libs
-
-    def write_prelude(self, fout: TextIO):
-        print("Write C/CPP prelude")
-
+            self.dep_libs.append(lib)
+            self.dep_lib_paths.append(proj.build_root)
+        self.deps = LayeredView(layers)
+        self.rendered = {}
+
+    def plan_flags(self):
+        """
+        Compile, archive and link flags, shared by every backend
+        """
         self.c_flags = ['-Wall']
         if self.debug:
             self.c_flags += ['-g', '-O0']
@@ -161,39 +326,69 @@ class CProject(Project):
             self.c_flags += ['-fPIC', '-fvisibility=hidden']
         if self.std is not None:
             self.c_flags += [f'-std={self.std}']
+        if self.compiler_deps:
+            self.c_flags += ['-MMD', '-MP']
+        if self.compile_cache is not None:
+            # reproducible objects, cache hits survive checkout moves
+            self.c_flags += [f'-ffile-prefix-map={self.workspace_root}=.']
         for inc in self.all_includes + self.lib_includes:
             inc = path.abspath(inc)
-            if path.commonprefix([self.root_path, inc]) == self.root_path:
-                inc = path.relpath(inc, self.root_path)
+            if path.commonprefix([self.path_root, inc]) == self.path_root:
+                inc = path.relpath(inc, self.path_root)
             self.c_flags.append(f"-I{inc}")
 
         if self.output_type == CProject.OutputType.STATIC:
             self.ar_flags = []
+            self.link_signature = ' '.join([self.ar] + self.ar_flags)
         else:
             self.ld_flags = []
             if self.output_type == CProject.OutputType.SHARED:
                 self.ld_flags += ['-shared']
-            for lib_path in self.lib_paths:
+            for lib_path in self.lib_paths + self.dep_lib_paths:
                 self.ld_flags.append(f"-L{lib_path}")
 
             self.ld_libs = []
-            for lib in self.libs:
+            for lib in self.dep_libs + self.libs:
                 self.ld_libs.append(f"-l{lib}")
+            self.link_signature = ' '.join(
+                [self.ld] + self.ld_flags + self.ld_libs)
+
+        self.launcher = []
+        if self.compile_cache is not None:
+            self.launcher = [sys.executable, '-m', 'mkmake.compcache']
+            if self.compile_cache is not True:
+                self.launcher += ['--dir', path.abspath(self.compile_cache)]
+            if self.compile_cache_size is not None:
+                self.launcher += [
+                    '--max-size', str(self.compile_cache_size)]
+        self.compile_signature = ' '.join(
+            self.launcher + [self.cc] + self.c_flags)
 
+    def write_prelude(self, fout: TextIO):
+        self.log("Write C/CPP prelude", 2)
+        self.plan_flags()
+
+        cc = self.cc
+        if self.launcher:
+            fout.write(f"{self.var('CCACHE')}={' '.join(self.launcher)}\n")
+            cc = f"$({self.var('CCACHE')}) {cc}"
         fout.write(
-            f"CC={self.cc}\n"
-            f"CFLAGS={' '.join(self.c_flags)}\n\n"
+            f"{self.var('CC')}={cc}\n"
+            f"{self.var('CFLAGS')}={' '.join(self.c_flags)}\n"
         )
+        if self.pch:
+            fout.write(f"{self.var('PCHFLAGS')}=\n")
+        fout.write("\n")
         if self.output_type == CProject.OutputType.STATIC:
             fout.write(
-                f"AR={self.ar}\n"
-                f"ARFLAGS={' '.join(self.ar_flags)}\n\n"
+                f"{self.var('AR')}={self.ar}\n"
+                f"{self.var('ARFLAGS')}={' '.join(self.ar_flags)}\n\n"
             )
         else:
             fout.write(
-                f"LD={self.ld}\n"
-                f"LDFLAGS={' '.join(self.ld_flags)}\n"
-                f"LDLIBS={' '.join(self.ld_libs)}\n\n"
+                f"{self.var('LD')}={self.ld}\n"
+                f"{self.var('LDFLAGS')}={' '.join(self.ld_flags)}\n"
+                f"{self.var('LDLIBS')}={' '.join(self.ld_libs)}\n\n"
             )
 
     def write_rule(self, fout: TextIO, source: str, target: str, rule: str):
@@ -202,68 +397,586 @@ class CProject(Project):
         fout.write(f"{target} : {source}\n")
         fout.write(f"{rule}\n")
 
+    def c_rule(self):
+        flags = [f"$({self.var('CFLAGS')})"]
+        if self.pch:
+            flags.append(f"$({self.var('PCHFLAGS')})")
+        return CProject.C_CXX_RULE.format(self.var('CC'), ' '.join(flags))
+
+    def header_cost(self, key: str):
+        """
+        Rough parse cost of header `key`: bytes of it and its closure
+        """
+        cost = 0
+        for dep in [key] + list(self.deps.get(key, ())):
+            if dep in self.all_deps and path.exists(self.all_deps[dep]):
+                cost += path.getsize(self.all_deps[dep])
+        return cost
+
+    def select_pch(self):
+        """
+        Choose the precompiled headers and the sources compiled with them
+
+        Headers in the closure of at least `pch_threshold` of the sources
+        are candidates; only those not already pulled in by another
+        candidate go into the PCH, ranked by total parse cost. Sources
+        whose closure covers every candidate use the PCH.
+        """
+        self.pch_headers = []
+        self.pch_sources = []
+        if not self.sources:
+            return
+
+        counts: Dict[str, int] = {}
+        for key in self.sources:
+            for dep in self.deps.get(key, ()):
+                counts[dep] = counts.get(dep, 0) + 1
+
+        limit = max(2, self.pch_threshold * len(self.sources))
+        candidates = {dep for dep, count in counts.items() if count >= limit}
+        if not candidates:
+            return
+
+        nested = set()
+        for dep in candidates:
+            nested.update(d for d in self.deps.get(dep, ()) if d != dep)
+        headers = [dep for dep in candidates if dep not in nested]
+        headers.sort(key=lambda dep: (-counts[dep] * self.header_cost(dep), dep))
+
+        sources = [
+            key for key in self.sources
+            if candidates.issubset(self.deps.get(key, ()))
+        ]
+        if len(sources) < 2:
+            return
+        self.pch_headers = headers
+        self.pch_sources = sources
+
+    def plan_pch(self):
+        """
+        Select the precompiled headers and write `pch.h`, sets the PCH
+        target, its inputs and flags; once per generation
+        """
+        if 'pch' in self.planned:
+            return
+        self.planned['pch'] = True
+        self.select_pch()
+        if not self.pch_headers:
+            return
+
+        pch_header = path.join(self.pch_path, 'pch.h')
+        self.write_if_changed(pch_header, "".join(
+            f'#include "{key}"\n' for key in self.pch_headers))
+
+        inputs = []
+        for key in self.pch_headers:
+            for dep in [key] + list(self.deps.get(key, ())):
+                dep = self.dep_path(dep)
+                if dep not in inputs:
+                    inputs.append(dep)
+
+        self.pch_source = self.get_path(pch_header)
+        self.pch_inputs = inputs
+        self.pch_flags = f"-include {self.pch_source}"
+        self.pch_target = self.get_path(f"{pch_header}.gch")
+
+    def write_pch(self, fout: TextIO):
+        self.plan_pch()
+        if not self.pch_headers:
+            return
+
+        fout.write(
+            f"{self.pch_target} : "
+            f"{self.pch_source} {' '.join(self.pch_inputs)}\n"
+            f"{CProject.PCH_RULE.format(self.var('CC'), self.var('CFLAGS'))}\n"
+        )
+
     def write_rules(self, fout: TextIO):
-        print("Write C rules")
+        self.log("Write C rules", 2)
         self.write_rule(
             fout, f"{self.source_path}/%.c",
-            f"{self.obj_path}/%.o", CProject.C_RULE
+            f"{self.obj_path}/%.o", self.c_rule()
         )
-        self.write_rule(
-            fout, f"{self.include_path}/%.h",
-            f"{self.export_path}/%.h", CProject.H_RULE
+        self.write_export_rule(fout)
+        if self.pch:
+            self.write_pch(fout)
+        if self.unity:
+            self.write_rule(
+                fout, f"{self.unity_path}/%.c",
+                f"{self.unity_obj_path}/%.o", self.c_rule()
+            )
+
+    def write_export_rule(self, fout: TextIO):
+        mode = self.export_mode
+        if mode == CProject.ExportMode.HARDLINK:
+            rule = CProject.H_LINK_RULE
+        elif mode == CProject.ExportMode.SYMLINK:
+            rule = CProject.H_SYMLINK_RULE
+        else:
+            rule = CProject.H_RULE
+        if mode != CProject.ExportMode.MERGED:
+            self.write_rule(
+                fout, f"{self.include_path}/%.h",
+                f"{self.export_path}/%.h", rule
+            )
+            return
+        if not self.exports:
+            return
+
+        # the shared tree has a rule per project, limited to its headers
+        exports = [self.get_path(p) for p in self.exports.values()]
+        source = self.get_path(f"{self.include_path}/%.h")
+        target = self.get_path(f"{self.export_path}/%.h")
+        fout.write(f"{' '.join(exports)} : {target} : {source}\n")
+        fout.write(f"{rule}\n")
+
+    def dep_path(self, dep: str):
+        """
+        Makefile path of visible header `dep`, memoized per project
+        """
+        ret = self.rendered.get(dep)
+        if ret is None:
+            ret = self.rendered[dep] = self.get_path(self.all_deps[dep])
+        return ret
+
+    def closure_name(self, key: str) -> Optional[str]:
+        """
+        Closure variable of header `key`: its name, '' if the closure is
+        too small to share (or being written, for include cycles), None
+        if it is still to be written
+        """
+        name = self.closure_keys.get(key)
+        if name is not None:
+            return name
+        closure = self.deps.get(key, ())
+        if len(closure) < 2:
+            self.closure_keys[key] = ''
+            return ''
+        # one variable per distinct closure, members of an include
+        # cycle share theirs
+        closure = tuple(closure)
+        if closure not in self.closure_vars:
+            return None
+        name = self.closure_vars[closure]
+        if name:
+            self.closure_keys[key] = name
+        return name
+
+    def cover(self, fout: TextIO, closure: Iterable[str]) -> List[str]:
+        """
+        Makefile words listing `closure`, using the closure variable of
+        each header instead of repeating its own closure
+
+        Variables are written to `fout` before their first use, nested
+        ones first; iterative, so long include chains do not recurse.
+        """
+        # frames: header, its closure, remaining deps, words, covered
+        stack = [[None, None, iter(closure), [], set()]]
+        while True:
+            frame = stack[-1]
+            deps, words, covered = frame[2:]
+            for dep in deps:
+                if dep in covered:
+                    continue
+                name = self.closure_name(dep)
+                if name is None:
+                    # write the variable of `dep` first, then retry it
+                    nested = tuple(self.deps[dep])
+                    self.closure_vars[nested] = ''
+                    frame[2] = itertools.chain([dep], deps)
+                    stack.append([dep, nested, iter(nested), [], set()])
+                    break
+                covered.add(dep)
+                words.append(self.dep_path(dep))
+                if name:
+                    words.append(f"$({name})")
+                    covered.update(self.closure_sets[name])
+            else:
+                stack.pop()
+                key, nested = frame[:2]
+                if key is None:
+                    return words
+                name = self.var(f"CLOSURE_{len(self.closure_sets)}")
+                self.closure_sets[name] = nested
+                fout.write(f"{name} := {' '.join(words)}\n")
+                self.closure_vars[nested] = self.closure_keys[key] = name
+
+    def write_unit(self, fout: TextIO, target: str,
+                   sources: List[str], keys: List[str]):
+        closure = [dep for key in keys for dep in self.deps.get(key, ())]
+        if self.dep_fragments:
+            # fragments stand alone, so they keep stable contents
+            deps = list(dict.fromkeys(self.dep_path(dep) for dep in closure))
+        else:
+            deps = self.cover(fout, closure)
+        sources = [self.get_path(source) for source in sources]
+        rule = f"{self.get_path(target)} : {' '.join(sources + deps)}\n"
+
+        self.objs.append(self.get_path(target))
+        self.units[self.get_path(target)] = keys
+        self.write_dep_rule(fout, target, rule)
+
+    def unity_batches(self):
+        """
+        Group mergeable sources into batches of similar header closures
+
+        Each batch is seeded with the first remaining source (by key) and
+        greedily grown with the source whose closure is most similar
+        (Jaccard) to the batch's. Sources matching `unity_exclude` and
+        batches of a single source are compiled on their own.
+        """
+        remaining = sorted(
+            key for key in self.sources
+            if not any(fnmatch(key, pattern) for pattern in self.unity_exclude)
         )
+        closures = {
+            key: frozenset(self.deps.get(key, ())) for key in remaining
+        }
 
-    def write_deps(self, fout: TextIO):
-        print("Write dependancies")
+        batches: List[List[str]] = []
+        while remaining:
+            batch = [remaining.pop(0)]
+            closure = set(closures[batch[0]])
+            while remaining and len(batch) < self.unity_batch_size:
+                best, best_score = 0, -1.0
+                for i, key in enumerate(remaining):
+                    union = len(closure | closures[key])
+                    score = len(closure & closures[key]) / union if union else 1.0
+                    if score > best_score:
+                        best, best_score = i, score
+                key = remaining.pop(best)
+                batch.append(key)
+                closure |= closures[key]
+            if len(batch) > 1:
+                batches.append(batch)
+        return batches
+
+    def unity_units(self):
+        """
+        Write the unity sources, returns their units
+        """
+        units = []
+        written = set()
+        for i, batch in enumerate(self.unity_batches()):
+            unity_source = path.join(self.unity_path, f"unity_{i}.c")
+            self.write_if_changed(unity_source, "".join(
+                f'#include "{path.relpath(self.sources[key], self.unity_path)}"\n'
+                .replace(path.sep, '/')
+                for key in batch
+            ))
+            written.add(unity_source)
+
+            target = path.join(self.unity_obj_path, f"unity_{i}.o")
+            units.append((
+                target,
+                [unity_source] + [self.sources[key] for key in batch], batch))
+
+        if path.isdir(self.unity_path):
+            for file in os.listdir(self.unity_path):
+                if path.join(self.unity_path, file) not in written:
+                    os.remove(path.join(self.unity_path, file))
+        return units
+
+    def plan_units(self) -> List[Tuple[str, List[str], List[str]]]:
+        """
+        Compiled units, shared by every backend: the object, its sources
+        (the compiled one first) and the keys of the sources whose
+        closures it depends on
+        """
+        units = self.unity_units() if self.unity else []
+        batched = {key for _, _, keys in units for key in keys}
         for key, source in self.sources.items():
+            if key in batched:
+                continue
             target = path.join(
                 self.obj_path, CProject.SUFFIX_RE.sub('.o', key))
-            target = self.get_path(target)
+            units.append((target, [source], [key]))
+        return units
+
+    def planned_units(self) -> List[Tuple[str, List[str], List[str]]]:
+        """
+        `plan_units` once per generation, unity sources are written once
+        """
+        if 'units' not in self.planned:
+            self.planned['units'] = self.plan_units()
+        return self.planned['units']
 
-            source = self.get_path(source)
+    def write_deps(self, fout: TextIO):
+        self.log("Write dependancies", 2)
+        self.units: Dict[str, List[str]] = {}
+        self.closure_vars: Dict[Tuple[str, ...], str] = {}
+        self.closure_sets: Dict[str, Tuple[str, ...]] = {}
+        self.closure_keys: Dict[str, str] = {}
+        self.pch_objs: List[str] = []
+        for target, sources, keys in self.planned_units():
+            self.write_unit(fout, target, sources, keys)
+
+    def write_pch_objects(self, fout: TextIO):
+        pch_sources = set(self.pch_sources)
+        objs = [
+            obj for obj, keys in self.units.items()
+            if pch_sources.issuperset(keys)
+        ]
+        self.pch_objs = objs
+        if objs:
+            fout.write(
+                f"{' '.join(objs)} : {self.var('PCHFLAGS')} = {self.pch_flags}\n"
+                f"{' '.join(objs)} : {self.pch_target}\n"
+            )
 
-            deps = self.deps[key]
-            deps = [
-                self.get_path(self.all_deps[key])
-                for key in deps
-            ]
+    def write_dep_includes(self, fout: TextIO):
+        super().write_dep_includes(fout)
+        if self.pch and self.pch_headers:
+            self.write_pch_objects(fout)
 
-            self.objs.append(target)
-            fout.write(f"{target} : {source} {' '.join(deps)}\n")
+        if not self.compiler_deps or not self.objs:
+            return
+
+        # Headers that are not sources of this project (dependency
+        # exports, generated headers) may not exist before the first
+        # build, when there are no depfiles yet to order them.
+        order = [
+            self.get_path(value)
+            for key, value in self.all_deps.items()
+            if key not in self.all_sources
+        ]
+        if order:
+            fout.write(f"{' '.join(self.objs)} : | {' '.join(order)}\n")
+
+        depfiles = [CProject.SUFFIX_RE.sub('.d', obj) for obj in self.objs]
+        fout.write(f"-include {' '.join(depfiles)}\n")
 
     def clean_targets(self):
         yield self.obj_path
-        yield self.export_path
+        if self.export_mode == CProject.ExportMode.MERGED:
+            # the shared tree also holds other projects' headers
+            yield from self.exports.values()
+        else:
+            yield self.export_path
+        # dep fragments, like flag stamps and member lists, are written
+        # at generation time and outlive a clean
+        if self.pch and self.pch_headers:
+            # pch.h itself is written at generation time
+            yield self.pch_target
         yield self.target
 
-    def write_target(self, fout: TextIO):
-        print("Write C targets")
-
-        self.target = path.join(self.build_root, self.output_name)
-        self.target = self.get_path(self.target)
-
-        if self.output_type == CProject.OutputType.STATIC:
+    def write_archive(self, fout: TextIO):
+        ar = f"$({self.var('AR')}) $({self.var('ARFLAGS')})"
+        mode = self.archive_mode
+        if mode == CProject.ArchiveMode.FULL:
             fout.write(
                 f"{self.target} : {' '.join(self.objs)}\n"
                 "\t@echo AR $@\n"
                 "\tmkdir -p $(dir $@)\n"
-                "\t$(AR) $(ARFLAGS) -rcs $@ $^\n"
+                f"\t{ar} -rcs $@ $(filter-out %.sig,$^)\n"
             )
+            return
+
+        # the member list is a prerequisite, so deleted sources rebuild
+        # the archive instead of leaving stale members behind
+        members = path.join(self.build_root, f"{self.output_name}.members")
+        self.write_if_changed(members, "".join(f"{obj}\n" for obj in self.objs))
+        members = self.get_path(members)
+        fout.write(
+            f"{self.target} : {' '.join(self.objs)} {members}\n"
+            "\t@echo AR $@\n"
+            "\tmkdir -p $(dir $@)\n"
+        )
+
+        basenames = {path.basename(obj) for obj in self.objs}
+        if mode == CProject.ArchiveMode.INCREMENTAL and \
+                len(basenames) < len(self.objs):
+            # ar replaces members by basename
+            self.log("Object basenames collide, archive is rebuilt.")
+        elif mode == CProject.ArchiveMode.INCREMENTAL:
+            # new members or flags rebuild the whole archive
+            rebuild = "$(filter %.members %.sig,$?)"
+            fout.write(
+                f"\t$(if {rebuild},rm -f $@)\n"
+                f"\t{ar} -rcs $@ "
+                f"$(filter-out %.members %.sig,$(if {rebuild},$^,$?))\n"
+            )
+            return
+
+        thin = 'T' if mode == CProject.ArchiveMode.THIN else ''
+        fout.write(
+            "\trm -f $@\n"
+            f"\t{ar} -rcs{thin} $@ $(filter-out %.members %.sig,$^)\n"
+        )
+
+    def write_flag_stamps(self, fout: TextIO):
+        """
+        Make the objects and the output depend on signatures of their
+        command lines, files rewritten only when the flags change
+        """
+        link_stamp = path.join(self.flags_path, 'link.sig')
+        self.write_if_changed(link_stamp, f"{self.link_signature}\n")
+        fout.write(f"{self.target} : {self.get_path(link_stamp)}\n")
+
+        compiled = list(self.objs)
+        if self.pch and self.pch_headers:
+            compiled.append(self.pch_target)
+        if not self.object_stamps:
+            compile_stamp = path.join(self.flags_path, 'compile.sig')
+            self.write_if_changed(
+                compile_stamp, f"{self.compile_signature}\n")
+            if compiled:
+                fout.write(
+                    f"{' '.join(compiled)} : "
+                    f"{self.get_path(compile_stamp)}\n")
+            return
+
+        # per object, so a changed PCH selection only rebuilds the
+        # objects whose flags it changes
+        pch_objs = set(self.pch_objs)
+        stamps = {link_stamp}
+        for obj in compiled:
+            signature = self.compile_signature
+            if obj in pch_objs:
+                signature += f" {self.pch_flags}"
+            stamp = path.relpath(
+                path.join(self.path_root, obj), self.build_root)
+            stamp = path.join(self.flags_path, f"{stamp}.sig")
+            self.write_if_changed(stamp, f"{signature}\n")
+            stamps.add(stamp)
+            fout.write(f"{obj} : {self.get_path(stamp)}\n")
+
+        for root, _, files in os.walk(self.flags_path):
+            for file in files:
+                stamp = path.join(root, file)
+                if stamp not in stamps:
+                    os.remove(stamp)
+
+    def plan_target(self):
+        self.target = path.join(self.build_root, self.output_name)
+        self.target = self.get_path(self.target)
+
+    def write_target(self, fout: TextIO):
+        self.log("Write C targets", 2)
+        self.plan_target()
+
+        if self.output_type == CProject.OutputType.STATIC:
+            self.write_archive(fout)
         else:
             fout.write(
                 f"{self.target} : {' '.join(self.objs + self.lib_depends)}\n"
                 "\t@echo LD $@\n"
                 "\tmkdir -p $(dir $@)\n"
-                "\t$(LD) $(LDFLAGS) -o $@ $^ $(LDLIBS)\n"
+                f"\t$({self.var('LD')}) $({self.var('LDFLAGS')}) "
+                f"-o $@ $(filter-out %.sig,$^) $({self.var('LDLIBS')})\n"
             )
+        if self.flag_stamps:
+            self.write_flag_stamps(fout)
 
         exports = [self.get_path(p) for p in self.exports.values()]
 
         fout.write(
-            f"\nheaders : {' '.join(exports)}\n\n"
-            "clean :\n"
+            f"\n{self.phony('headers')} : {' '.join(exports)}\n\n"
+            f"{self.phony('clean')} :\n"
             f"\trm -fr {' '.join(self.clean_targets())}\n\n"
-            f"all : {self.target} headers\n"
-            "rebuild : clean all\n"
+            f"{self.phony('all')} : {self.target} {self.phony('headers')}\n"
+            f"{self.phony('rebuild')} : "
+            f"{self.phony('clean')} {self.phony('all')}\n"
         )
         self.phonies += ['headers', 'clean', 'rebuild']
+
+    def header_actions(self, graph: ActionGraph) -> List[str]:
+        """
+        Export actions, returns the headers compiles are ordered after
+        """
+        mode = self.export_mode
+        exports = []
+        for key, source in self.headers.items():
+            export = self.get_path(self.exports[key])
+            variables = None
+            if mode == CProject.ExportMode.HARDLINK:
+                rule = CProject.LINK_ACTION
+            elif mode == CProject.ExportMode.SYMLINK:
+                rule = CProject.SYMLINK_ACTION
+                variables = {'source': path.abspath(source)}
+            else:
+                rule = CProject.COPY_ACTION
+            graph.add(Action(
+                rule, [export], [self.get_path(source)], variables=variables))
+            exports.append(export)
+
+        # dependency headers include the exports of their own dependencies
+        graph.add(Action(PHONY, [self.phony('headers')], exports + [
+            self.get_path(path.join(proj.path_root, proj.phony('headers')))
+            for proj in self.depends_proj.values()
+        ]))
+        return [self.phony('headers')]
+
+    def write_actions(self, graph: ActionGraph):
+        """
+        The build as backend-neutral actions, from the same plan as the
+        Makefile; depfiles replace the scanned closures
+        """
+        self.log("Write C actions", 2)
+        self.plan_flags()
+        graph.variable(self.var('CC'), ' '.join(self.launcher + [self.cc]))
+        graph.variable(self.var('CFLAGS'), ' '.join(
+            flag for flag in self.c_flags if flag not in ('-MMD', '-MP')))
+        compile_vars = {
+            'cc': f"${{{self.var('CC')}}}",
+            'cflags': f"${{{self.var('CFLAGS')}}}",
+        }
+        order = self.header_actions(graph)
+
+        pch_sources = set()
+        if self.pch:
+            self.plan_pch()
+            if self.pch_headers:
+                pch_sources = set(self.pch_sources)
+                graph.add(Action(
+                    CProject.PCH_ACTION, [self.pch_target],
+                    [self.pch_source], self.pch_inputs, order,
+                    variables=compile_vars))
+
+        objs = []
+        units = {}
+        for target, sources, keys in self.planned_units():
+            target = self.get_path(target)
+            sources = [self.get_path(source) for source in sources]
+            variables = compile_vars
+            implicit = sources[1:]
+            if pch_sources and pch_sources.issuperset(keys):
+                variables = dict(
+                    compile_vars,
+                    cflags=f"{compile_vars['cflags']} {self.pch_flags}")
+                implicit.append(self.pch_target)
+            graph.add(Action(
+                CProject.CC_ACTION, [target], sources[:1], implicit, order,
+                variables=variables))
+            objs.append(target)
+            units[target] = keys
+        if self.backend == 'ninja':
+            # the Makefile sets them otherwise, from the same plan
+            self.objs = objs
+            self.units = units
+
+        self.plan_target()
+        if self.output_type == CProject.OutputType.STATIC:
+            graph.variable(self.var('AR'), self.ar)
+            graph.variable(self.var('ARFLAGS'), ' '.join(self.ar_flags))
+            thin = 'T' if self.archive_mode == CProject.ArchiveMode.THIN else ''
+            graph.add(Action(
+                CProject.AR_ACTION, [self.target], objs, variables={
+                    'ar': f"${{{self.var('AR')}}}",
+                    'arflags': f"${{{self.var('ARFLAGS')}}}",
+                    'thin': thin,
+                }))
+        else:
+            graph.variable(self.var('LD'), self.ld)
+            graph.variable(self.var('LDFLAGS'), ' '.join(self.ld_flags))
+            graph.variable(self.var('LDLIBS'), ' '.join(self.ld_libs))
+            graph.add(Action(
+                CProject.LD_ACTION, [self.target], objs,
+                self.lib_depends, variables={
+                    'ld': f"${{{self.var('LD')}}}",
+                    'ldflags': f"${{{self.var('LDFLAGS')}}}",
+                    'ldlibs': f"${{{self.var('LDLIBS')}}}",
+                }))
+        graph.add(Action(
+            PHONY, [self.phony('all')],
+            [self.target, self.phony('headers')]))
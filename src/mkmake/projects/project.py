@@ -1,9 +1,12 @@
-from typing import Iterable, Dict, TextIO
+from typing import Iterable, Dict, Optional, TextIO, Tuple
 
-import itertools
+import io
 import os
 import os.path as path
-from glob import glob
+import sys
+from fnmatch import fnmatch
+
+from ..actions import ActionGraph
 
 
 class Project(object):
@@ -13,9 +16,48 @@ class Project(object):
 
     def __init__(self, root_path: str, **kwargs):
         self.root_path = path.abspath(root_path)
-        self.build_root = path.join(self.root_path, 'target')
+        self.target_root = path.join(self.root_path, 'target')
+        self.variant: Optional[str] = None
+        self.build_root = self.target_root
+        self.path_root = self.root_path
+        self.workspace_root = self.root_path
+        self.namespace = None
+        self.makefile_name = 'Makefile'
+        # 'make' writes a Makefile, 'ninja' only plans `actions`
+        self.backend = 'make'
+        # plans shared by the backends, computed once per generation
+        self.planned: Dict[str, object] = {}
 
         self.depends = kwargs.get('depends', [])
+        self.dep_fragments = kwargs.get('dep_fragments', False)
+        self.exclude = kwargs.get('exclude', [])
+        self.verbose = kwargs.get('verbose', 1)
+        self.paths: Dict[Tuple[str, str], str] = {}
+        self.build_paths()
+
+    def build_paths(self):
+        """
+        Set the paths below `build_root`, again when the variant changes
+        """
+        self.deps_path = path.join(self.build_root, 'deps')
+
+    def set_variant(self, variant: Optional[str]):
+        """
+        Build into `target/<variant>`, or `target` without a variant
+        """
+        self.variant = variant
+        self.build_root = self.target_root
+        if variant is not None:
+            self.build_root = path.join(self.target_root, variant)
+        self.build_paths()
+
+    def log(self, message: str, level: int = 1):
+        """
+        Print `message` if the verbosity is at least `level`
+        """
+        if self.verbose >= level:
+            # a single write, projects log from concurrent workers
+            sys.stdout.write(message + '\n')
 
     @staticmethod
     def safe_update(dict1: dict, dict2: dict):
@@ -25,20 +67,125 @@ class Project(object):
         assert dict1.keys().isdisjoint(dict2.keys())
         dict1.update(dict2)
 
+    @staticmethod
+    def write_if_changed(file_path: str, content: str) -> bool:
+        """
+        Write `content` to `file_path` unless it already holds it,
+        so that unchanged files keep their mtime
+        """
+        try:
+            with open(file_path, 'r') as fin:
+                if fin.read() == content:
+                    return False
+        except OSError:
+            pass
+        os.makedirs(path.dirname(file_path), exist_ok=True)
+        with open(file_path, 'w') as fout:
+            fout.write(content)
+        return True
+
+    def is_excluded(self, file_path: str, name: str):
+        if not self.exclude:
+            return False
+        rel = path.relpath(file_path, self.root_path).replace(path.sep, '/')
+        return any(
+            fnmatch(rel, pattern) or fnmatch(name, pattern)
+            for pattern in self.exclude
+        )
+
+    def scan_buckets(self, buckets: Dict[str, Tuple[str, Iterable[str]]]):
+        """
+        Sort files under the bucket prefixes into buckets in one pass
+
+        `buckets` maps a bucket name to a (prefix, suffixes) pair; each
+        bucket collects the files below its prefix with one of the
+        suffixes, keyed by their path relative to the prefix. Hidden
+        entries and entries matching `exclude` are skipped, and only
+        directories on the way to or below a prefix are visited.
+        """
+        ret: Dict[str, Dict[str, str]] = {name: {} for name in buckets}
+        specs = [
+            (name, path.abspath(prefix), tuple(f".{s}" for s in suffixes))
+            for name, (prefix, suffixes) in buckets.items()
+        ]
+        if not specs:
+            return ret
+
+        def inside(dir_path: str, prefix: str):
+            return dir_path == prefix or dir_path.startswith(prefix + path.sep)
+
+        stack = [path.commonpath([prefix for _, prefix, _ in specs])]
+        while stack:
+            dir_path = stack.pop()
+            active = [spec for spec in specs if inside(dir_path, spec[1])]
+            try:
+                with os.scandir(dir_path) as it:
+                    entries = sorted(it, key=lambda entry: entry.name)
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+
+            subdirs = []
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    continue
+                if self.is_excluded(entry.path, entry.name):
+                    continue
+                if entry.is_dir():
+                    if any(
+                        inside(entry.path, prefix) or inside(prefix, entry.path)
+                        for _, prefix, _ in specs
+                    ):
+                        subdirs.append(entry.path)
+                    continue
+                for name, prefix, suffixes in active:
+                    if entry.name.endswith(suffixes):
+                        key = path.relpath(entry.path, prefix)
+                        ret[name][key] = entry.path
+            stack.extend(reversed(subdirs))
+        return ret
+
     def scan_files(self, prefixes: Iterable[str], suffixes: Iterable[str]):
+        suffixes = list(suffixes)
+        prefixes = list(prefixes)
+        buckets = self.scan_buckets({
+            str(i): (prefix, suffixes) for i, prefix in enumerate(prefixes)
+        })
         ret: Dict[str, str] = {}
-        for prefix, suffix in itertools.product(prefixes, suffixes):
-            glob_path = f"{prefix}/**/*.{suffix}".replace(os.sep, '/')
-            paths = glob(glob_path, recursive=True)
-            ret.update((path.relpath(p, prefix), p) for p in paths)
+        for i in range(len(prefixes)):
+            ret.update(buckets[str(i)])
         return ret
 
     def get_path(self, source: str):
-        source = path.abspath(source)
-        if self.root_path == path.commonpath([source, self.root_path]):
-            source = path.relpath(source, self.root_path)
-        source = source.replace(path.sep, '/')
-        return source
+        # memoized, the same headers are listed by many objects (and
+        # projects, make_projects shares one memo across the workspace)
+        key = (self.path_root, source)
+        ret = self.paths.get(key)
+        if ret is None:
+            ret = path.abspath(source)
+            prefix = path.join(self.path_root, '')
+            if ret == self.path_root:
+                ret = '.'
+            elif ret.startswith(prefix):
+                ret = ret[len(prefix):]
+            ret = ret.replace(path.sep, '/')
+            self.paths[key] = ret
+        return ret
+
+    def var(self, name: str):
+        """
+        Name of make variable `name`, prefixed in a namespaced Makefile
+        """
+        if self.namespace is None:
+            return name
+        return f"{self.namespace}_{name}"
+
+    def phony(self, word: str):
+        """
+        Name of phony target `word`, suffixed in a namespaced Makefile
+        """
+        if self.namespace is None:
+            return word
+        return f"{word}-{self.namespace}"
 
     def scan_sources(self):
         raise NotImplementedError()
@@ -47,7 +194,7 @@ class Project(object):
         raise NotImplementedError()
 
     def inject_depends(self, projects: Dict[str, 'Project']):
-        print(f"Inject {len(self.depends)} dependant projects")
+        self.log(f"Inject {len(self.depends)} dependant projects", 2)
         self.depends_proj = {name: projects[name] for name in self.depends}
 
     def write_prelude(fout: TextIO):
@@ -62,28 +209,84 @@ class Project(object):
     def write_target(fout: TextIO):
         raise NotImplementedError()
 
+    def write_actions(self, graph: ActionGraph):
+        raise NotImplementedError()
+
+    def write_dep_rule(self, fout: TextIO, target: str, rule: str):
+        """
+        Write the dependency `rule` of `target`, either inline or into
+        its own fragment under `deps_path`
+        """
+        if not self.dep_fragments:
+            fout.write(rule)
+            return
+
+        fragment = path.relpath(path.abspath(target), self.build_root)
+        fragment = path.splitext(fragment)[0] + '.d'
+        fragment = path.join(self.deps_path, fragment)
+        self.write_if_changed(fragment, rule)
+        self.fragments.add(fragment)
+
+    def write_fragments(self, fout: TextIO):
+        for root, _, files in os.walk(self.deps_path):
+            for file in files:
+                fragment = path.join(root, file)
+                if fragment not in self.fragments:
+                    os.remove(fragment)
+
+        fragments = [self.get_path(p) for p in sorted(self.fragments)]
+        fout.write(f"-include {' '.join(fragments)}\n")
+
+    def write_dep_includes(self, fout: TextIO):
+        if self.dep_fragments:
+            self.write_fragments(fout)
+
     def write_makefile(self):
-        print("Write makefile...")
-        self.makefile = path.join(self.build_root, 'Makefile')
-        os.makedirs(self.build_root, exist_ok=True)
-        with open(self.makefile, 'w') as fout:
-            fout.write("\n############# Prelude ############\n")
-            self.write_prelude(fout)
+        self.log("Write makefile...", 2)
+        self.makefile = path.join(self.build_root, self.makefile_name)
+        fout = io.StringIO()
+
+        fout.write("\n############# Prelude ############\n")
+        self.write_prelude(fout)
+        if self.namespace is None:
             fout.write("\ndefault : all\n")
 
-            fout.write("\n############## Rules #############\n")
-            self.write_rules(fout)
+        fout.write("\n############## Rules #############\n")
+        self.write_rules(fout)
+
+        fout.write("\n############## Deps ##############\n")
+        self.objs = []
+        self.fragments = set()
+        self.write_deps(fout)
+        self.write_dep_includes(fout)
+
+        self.phonies = ['default', 'all']
+        fout.write("\n############# Targets ############\n")
+        self.write_target(fout)
+        phonies = [self.phony(word) for word in self.phonies]
+        if self.namespace is not None:
+            phonies.remove(self.phony('default'))
+        fout.write(f"\n.PHONY : {' '.join(phonies)}\n")
 
-            fout.write("\n############## Deps ##############\n")
-            self.objs = []
-            self.write_deps(fout)
+        if not self.write_if_changed(self.makefile, fout.getvalue()):
+            self.log("Makefile unchanged.", 2)
 
-            self.phonies = ['default', 'all']
-            fout.write("\n############# Targets ############\n")
-            self.write_target(fout)
-            fout.write(f"\n.PHONY : {' '.join(self.phonies)}\n")
+    def plan_actions(self) -> ActionGraph:
+        """
+        The build as actions, from the plan of the last `make`
+        """
+        if 'actions' not in self.planned:
+            self.actions = ActionGraph()
+            self.write_actions(self.actions)
+            self.planned['actions'] = self.actions
+        return self.planned['actions']
 
     def make(self):
-        print(f"Begin make project {self.root_path}")
-        self.write_makefile()
-        print(f"Done!")
+        self.log(f"Begin make project {self.root_path}")
+        self.planned = {}
+        if self.backend == 'ninja':
+            # written into the workspace build.ninja by make_projects
+            self.plan_actions()
+        else:
+            self.write_makefile()
+        self.log("Done!", 2)
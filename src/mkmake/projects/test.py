@@ -1,12 +1,18 @@
 import os.path as path
+import shlex
+import sys
 from typing import TextIO
 
+from ..actions import CONSOLE, Action, ActionGraph, Rule
 from .c import CProject
 
 
 class TestProject(CProject):
     __test__ = False
 
+    TEST_ACTION = Rule(
+        'test', '$command', 'RUN test', pool=CONSOLE, always=True)
+
     def __init__(self, root_path: str, **kwargs):
         super().__init__(
             root_path,
@@ -16,6 +22,14 @@ class TestProject(CProject):
         self.test_command = kwargs['test_command']
         self.test_files = kwargs.get('test_files', [])
         self.private_depends = kwargs.get('private_depends', [])
+        # run through mkmake.testrun: cached, sharded by test case
+        self.test_runner = kwargs.get('test_runner', False)
+        self.test_list_command = kwargs.get('test_list_command', None)
+        self.test_jobs = kwargs.get('test_jobs', None)
+        self.test_env = kwargs.get('test_env', None)
+
+    def build_paths(self):
+        super().build_paths()
         self.test_path = path.join(self.build_root, 'tests')
         self.test_output = path.join(self.test_path, 'summary.out')
 
@@ -32,22 +46,75 @@ class TestProject(CProject):
             assert isinstance(dep, CProject), "Depends not a CProject"
 
             self.all_includes.append(dep.internal_path)
-            for key, value in dep.internals.items():
-                if key not in self.all_deps:
-                    self.all_deps[key] = value
+            self.all_deps.append(dep.graph, dep.internal_table)
 
-    def write_target(self, fout: TextIO):
-        super().write_target(fout)
+    def test_recipe(self):
+        """
+        Shell command running the tests, from the project root
+        """
+        # `{case}` is left for the test runner
+        relative = [
+            path.relpath(path.join(self.root_path, file), self.root_path)
+            .replace(path.sep, '/')
+            for file in self.test_files
+        ]
+        command = self.test_command.format(*relative, case='{case}')
+        if self.test_runner:
+            command = self.runner_command(command, relative)
+        if self.path_root != self.root_path:
+            command = f"cd {self.get_path(self.root_path)} && {command}"
+        return command
 
-        files = [
+    def test_inputs(self):
+        return [
             self.get_path(path.join(self.root_path, file))
             for file in self.test_files
         ]
 
+    def write_target(self, fout: TextIO):
+        super().write_target(fout)
+
         fout.write(
-            f"\ntest: all {' '.join(files)}\n"
+            f"\n{self.phony('test')}: {self.phony('all')} "
+            f"{' '.join(self.test_inputs())}\n"
             f"\t@echo RUN test\n"
-            f"\trm -fr {self.test_path}\n"
-            f"\t{self.test_command.format(*files)}\n"
         )
+        if not self.test_runner:
+            fout.write(f"\trm -fr {self.test_path}\n")
+        fout.write(f"\t{self.test_recipe()}\n")
         self.phonies.append('test')
+
+    def write_actions(self, graph: ActionGraph):
+        super().write_actions(graph)
+
+        command = self.test_recipe()
+        if not self.test_runner:
+            command = f"rm -fr {self.test_path} && {command}"
+        graph.add(Action(
+            TestProject.TEST_ACTION, [self.phony('test')],
+            implicit=[self.phony('all')] + self.test_inputs(),
+            variables={'command': command.replace('$', '$$')}))
+
+    def runner_command(self, command: str, relative):
+        """
+        `command` run through mkmake.testrun, which skips it when the
+        test binary, dependency libraries, test files and environment
+        are unchanged
+        """
+        args = [
+            sys.executable, '-m', 'mkmake.testrun',
+            '--dir', self.test_path,
+            '--binary', path.join(self.build_root, self.output_name),
+        ]
+        # a rebuilt shared library may leave the test binary unchanged
+        for proj in self.depends_proj.values():
+            args += ['--input', path.join(proj.build_root, proj.output_name)]
+        for file in relative:
+            args += ['--input', file]
+        if self.test_list_command is not None:
+            args += ['--list', self.test_list_command.format(*relative)]
+        if self.test_jobs is not None:
+            args += ['--jobs', str(self.test_jobs)]
+        for name in self.test_env or []:
+            args += ['--env', name]
+        return ' '.join(shlex.quote(arg) for arg in args + ['--', command])
@@ -1,6 +1,7 @@
-from typing import Iterable, TextIO
+from typing import Iterable, List, TextIO
 import os.path as path
 
+from ..actions import Action, ActionGraph, Rule
 from .c import CProject
 
 
@@ -8,49 +9,80 @@ class YYProject(CProject):
     LEX_RULE = (
         "\t@echo LEX $<\n"
         "\tmkdir -p $(dir $@)\n"
-        "\t$(LEX) $(LEXFLAGS) -o $@ $<\n"
+        "\t$({0}) $({1}) -o $@ $<\n"
     )
 
+    LEX_ACTION = Rule(
+        'lex', '$lex $lexflags -o $out $in', 'LEX $in', pool='generate')
+    # an unchanged header keeps its mtime, so its includers are not
+    # rebuilt when only the parser changed
+    YACC_ACTION = Rule(
+        'yacc',
+        'cp -p $header $header.old 2>/dev/null; '
+        '$yacc $yaccflags --defines=$header -o $source $in; ret=$$?; '
+        'cmp -s $header $header.old && touch -r $header.old $header; '
+        'rm -f $header.old; exit $$ret',
+        'YACC $in', pool='generate', restat=True)
+
     def __init__(self, root_path: str, **kwargs):
         super().__init__(root_path, **kwargs)
         self.grammar_path = path.join(self.source_path, 'yy')
+        self.lex = kwargs.get('lex', 'flex')
+        self.yacc = kwargs.get('yacc', 'bison')
+
+        self.own_includes.append(self.generated_path)
+        self.all_includes = list(self.own_includes)
+
+    def build_paths(self):
+        super().build_paths()
+        old_path = getattr(self, 'generated_path', None)
         self.generated_path = path.join(self.build_root, 'generated-src')
         self.generated_obj_path = path.join(self.obj_path, 'generated')
-
-        self.all_includes.append(self.generated_path)
+        if old_path is not None and old_path != self.generated_path:
+            self.own_includes[self.own_includes.index(old_path)] = \
+                self.generated_path
+            if hasattr(self, 'yy_files'):
+                self.own_deps.update(self.generated_headers())
+
+    def generated_headers(self):
+        return {
+            key: path.join(self.generated_path, key)
+            for key in self.generate_key(self.yy_files, '.y', '.tab.h')
+        }
 
     def generate_key(self, keys: Iterable[str], suffix: str, new_suffix: str):
         for key in keys:
             yield key.replace(suffix, new_suffix)
 
+    def source_buckets(self):
+        buckets = super().source_buckets()
+        buckets['lex_files'] = (self.grammar_path, ['l'])
+        buckets['yy_files'] = (self.grammar_path, ['y'])
+        return buckets
+
     def scan_sources(self):
         super().scan_sources()
 
         self.generated_srcs = {}
 
-        print("Scan lex files...")
-        self.lex_files = self.scan_files([self.grammar_path], ['l'])
+        self.lex_files = self.scanned['lex_files']
 
         lex_sources = {
             key.replace('.l', '.yy.c'): key
             for key in self.lex_files.keys()
         }
 
-        print(f"Found {len(self.lex_files)} lex files.")
+        self.log(f"Found {len(self.lex_files)} lex files.")
 
-        print("Scan yacc files...")
-        self.yy_files = self.scan_files([self.grammar_path], ['y'])
+        self.yy_files = self.scanned['yy_files']
 
         yy_sources = {
             key.replace('.y', '.tab.c'): key
             for key in self.yy_files.keys()
         }
-        yy_headers = {
-            key: path.join(self.generated_path, key)
-            for key in self.generate_key(self.yy_files, '.y', '.tab.h')
-        }
+        yy_headers = self.generated_headers()
 
-        print(f"Found {len(self.yy_files)} yacc files.")
+        self.log(f"Found {len(self.yy_files)} yacc files.")
 
         self.safe_update(self.all_deps, yy_headers)
         self.safe_update(self.all_sources, self.lex_files)
@@ -61,12 +93,12 @@ class YYProject(CProject):
     def write_prelude(self, fout: TextIO):
         super().write_prelude(fout)
 
-        print("Write yy prelude")
+        self.log("Write yy prelude", 2)
         fout.write(
-            f"LEX=flex\n"
-            f"LEXFLAGS=\n\n"
-            f"YACC=bison\n"
-            f"YACCFLAGS=-v\n\n"
+            f"{self.var('LEX')}={self.lex}\n"
+            f"{self.var('LEXFLAGS')}=\n\n"
+            f"{self.var('YACC')}={self.yacc}\n"
+            f"{self.var('YACCFLAGS')}=-v\n\n"
         )
 
     def write_rules(self, fout: TextIO):
@@ -76,7 +108,7 @@ class YYProject(CProject):
             fout,
             f"{self.grammar_path}/%.l",
             f"{self.generated_path}/%.yy.c",
-            YYProject.LEX_RULE
+            YYProject.LEX_RULE.format(self.var('LEX'), self.var('LEXFLAGS'))
         )
 
         for key, source in self.yy_files.items():
@@ -93,36 +125,59 @@ class YYProject(CProject):
                 f"{c_source} {c_header} &: {source}\n"
                 "\t@echo YACC $<\n"
                 "\tmkdir -p $(dir $@)\n"
-                f"\t$(YACC) $(YACCFLAGS) --defines={c_header} -o {c_source} $<\n\n"
+                f"\t$({self.var('YACC')}) $({self.var('YACCFLAGS')}) "
+                f"--defines={c_header} -o {c_source} $<\n\n"
             )
 
         self.write_rule(
             fout,
             f"{self.generated_path}/%.c",
             f"{self.generated_obj_path}/%.o",
-            CProject.C_RULE
+            self.c_rule()
         )
 
-    def write_deps(self, fout: TextIO):
-        super().write_deps(fout)
-
-        print(f"generated_srcs={self.generated_srcs}")
+    def plan_units(self):
+        units = super().plan_units()
         for generated_key, key in self.generated_srcs.items():
             target = CProject.SUFFIX_RE.sub('.o', generated_key)
             target = path.join(self.generated_obj_path, target)
-            target = self.get_path(target)
 
             source = path.join(self.generated_path, generated_key)
-            source = self.get_path(source)
+            units.append((target, [source], [key]))
+        return units
+
+    def header_actions(self, graph: ActionGraph) -> List[str]:
+        order = super().header_actions(graph)
+        graph.variable(self.var('LEX'), self.lex)
+        graph.variable(self.var('LEXFLAGS'), '')
+        graph.variable(self.var('YACC'), self.yacc)
+        graph.variable(self.var('YACCFLAGS'), '-v')
 
-            deps = self.deps[key]
-            deps = [
-                self.get_path(self.all_deps[key])
-                for key in deps
-            ]
+        for key, source in self.lex_files.items():
+            c_source = path.join(
+                self.generated_path, key.replace('.l', '.yy.c'))
+            graph.add(Action(
+                YYProject.LEX_ACTION, [self.get_path(c_source)],
+                [self.get_path(source)], variables={
+                    'lex': f"${{{self.var('LEX')}}}",
+                    'lexflags': f"${{{self.var('LEXFLAGS')}}}",
+                }))
 
-            self.objs.append(target)
-            fout.write(f"{target} : {source} {' '.join(deps)}\n")
+        for key, source in self.yy_files.items():
+            c_source = self.get_path(path.join(
+                self.generated_path, key.replace('.y', '.tab.c')))
+            c_header = self.get_path(path.join(
+                self.generated_path, key.replace('.y', '.tab.h')))
+            graph.add(Action(
+                YYProject.YACC_ACTION, [c_source, c_header],
+                [self.get_path(source)], variables={
+                    'yacc': f"${{{self.var('YACC')}}}",
+                    'yaccflags': f"${{{self.var('YACCFLAGS')}}}",
+                    'source': c_source,
+                    'header': c_header,
+                }))
+            order.append(c_header)
+        return order
 
     def clean_targets(self):
         yield from super().clean_targets()
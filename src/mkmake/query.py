@@ -0,0 +1,163 @@
+from typing import Dict, Iterable, List, Set
+
+import os.path as path
+
+from .metaproject import _write_meta_makefile, _write_workspace_makefile
+from .projects import CProject, TestProject, YYProject
+from .schedule import Schedule
+
+
+def _inside(file_path: str, dir_path: str):
+    return file_path == dir_path or file_path.startswith(dir_path + path.sep)
+
+
+class Affected(object):
+    """
+    What a set of changed files touches in a generated workspace
+
+    `objects` maps project names to the objects that recompile,
+    `libraries` lists the library outputs that are rebuilt, `projects`
+    the projects to rebuild or retest (in schedule order) and `tests`
+    the `TestProject`s among them.
+    """
+
+    def __init__(self):
+        self.objects: Dict[str, List[str]] = {}
+        self.libraries: List[str] = []
+        self.projects: List[str] = []
+        self.tests: List[str] = []
+
+    def to_dict(self):
+        return {
+            'objects': self.objects,
+            'libraries': self.libraries,
+            'projects': self.projects,
+            'tests': self.tests,
+        }
+
+
+def _changed_paths(projects: Dict[str, CProject], files: Set[str]):
+    """
+    `files` plus the paths derived from them: exported copies of public
+    headers and headers generated from grammars
+    """
+    changed = set(files)
+    for proj in projects.values():
+        public = [key for key, p in proj.headers.items() if p in files]
+        changed.update(proj.exports[key] for key in public)
+        if isinstance(proj, YYProject):
+            changed.update(
+                path.join(proj.generated_path, key.replace('.y', '.tab.h'))
+                for key, p in proj.yy_files.items() if p in files)
+    return changed
+
+
+def _touched(proj: CProject, files: Set[str]):
+    """
+    Whether `files` add, remove or change a file of `proj`
+    """
+    known = set(proj.all_sources.values())
+    for file_path in files:
+        if not _inside(file_path, proj.root_path) or \
+                _inside(file_path, proj.target_root):
+            continue
+        if file_path in known:
+            return True
+        for prefix, suffixes in proj.source_buckets().values():
+            if _inside(file_path, path.abspath(prefix)) and \
+                    file_path.endswith(tuple(f".{s}" for s in suffixes)):
+                return True
+    return False
+
+
+def _objects(proj: CProject, changed: Set[str]):
+    keys = {key for key, p in proj.all_deps.items() if p in changed}
+    keys.update(key for key, p in proj.all_sources.items() if p in changed)
+    if not keys:
+        return []
+    return [
+        path.normpath(obj)
+        for obj, _, units in proj.planned_units()
+        # no closures at generation time, any visible change counts
+        if proj.compiler_deps or any(
+            key in keys or not keys.isdisjoint(proj.deps.get(key, ()))
+            for key in units)
+    ]
+
+
+def affected(projects: Dict[str, CProject], files: Iterable[str]) -> Affected:
+    """
+    Query the targets `files` affect, after `make_projects(projects)`
+    (`generate=False` is enough, the query only needs the scan)
+
+    An object is affected when its sources or a header in their closure
+    changed; grammars count through their generated sources and headers,
+    public headers through their exported copies. A project is rebuilt
+    when one of its objects is, when its files were added or removed, or,
+    for linked outputs, when a dependency is rebuilt. Dependents of
+    rebuilt projects and `TestProject`s whose `test_files` changed are
+    affected as well.
+    """
+    files = {path.abspath(file) for file in files}
+    changed = _changed_paths(projects, files)
+    schedule = Schedule(projects)
+    ret = Affected()
+
+    rebuilt: Set[str] = set()
+    affected_names: Set[str] = set()
+    for name in schedule.order:
+        proj = projects[name]
+        objs = _objects(proj, changed)
+        if objs:
+            ret.objects[name] = objs
+        linked = proj.output_type != CProject.OutputType.STATIC
+        if objs or _touched(proj, files) or (linked and any(
+                dep in rebuilt for dep in proj.depends)):
+            rebuilt.add(name)
+            if proj.output_type != CProject.OutputType.BINARY:
+                ret.libraries.append(
+                    path.join(proj.build_root, proj.output_name))
+        if name in rebuilt or any(
+                dep in affected_names for dep in proj.depends):
+            affected_names.add(name)
+        if isinstance(proj, TestProject) and any(
+                path.normpath(path.join(proj.root_path, file)) in files
+                for file in proj.test_files):
+            affected_names.add(name)
+
+    for name in schedule.order:
+        if name in affected_names:
+            ret.projects.append(name)
+            if isinstance(projects[name], TestProject):
+                ret.tests.append(name)
+    return ret
+
+
+def write_affected_makefile(
+    projects: Dict[str, CProject], result: Affected, meta_makefile: str,
+    recursive: bool = True,
+) -> List[str]:
+    """
+    Write a meta Makefile restricted to the affected projects and the
+    dependencies they need, returns the included project names
+
+    Like `make_projects`, `recursive=False` writes a workspace Makefile
+    including the project fragments instead.
+    """
+    needed: Set[str] = set()
+    stack = list(result.projects)
+    while stack:
+        name = stack.pop()
+        if name not in needed:
+            needed.add(name)
+            stack.extend(projects[name].depends)
+
+    subset = {name: proj for name, proj in projects.items() if name in needed}
+    schedule = Schedule(subset)
+    ordered = [(name, subset[name]) for name in schedule.order]
+    if recursive:
+        _write_meta_makefile(meta_makefile, ordered, schedule)
+    elif ordered:
+        _write_workspace_makefile(
+            meta_makefile, ordered, ordered[0][1].workspace_root)
+    return [name for name, _ in ordered]
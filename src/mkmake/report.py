@@ -0,0 +1,75 @@
+from typing import Callable, Dict, Optional
+
+import threading
+import time
+import tracemalloc
+
+
+class Report(object):
+    """
+    Timing and statistics collected while generating a workspace
+
+    Every phase of every project records its wall time and the number of
+    files it handled; `to_dict` returns the whole report as plain data.
+    """
+
+    PHASES = ['scan_sources', 'inject_depends', 'scan_deps', 'write_makefile']
+
+    def __init__(self, trace_memory: bool = False):
+        self.projects: Dict[str, Dict[str, dict]] = {}
+        self.cache: Optional[Dict[str, int]] = None
+        self.schedule: Optional[dict] = None
+        self.build: Optional[dict] = None
+        self.trace_memory = trace_memory
+        self.peak_memory: Optional[int] = None
+        self.lock = threading.Lock()
+        self.started = False
+        self.start_time = 0.0
+        self.total_seconds = 0.0
+
+    def start(self):
+        self.start_time = time.perf_counter()
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started = True
+
+    def stop(self):
+        self.total_seconds = time.perf_counter() - self.start_time
+        if self.trace_memory and tracemalloc.is_tracing():
+            self.peak_memory = tracemalloc.get_traced_memory()[1]
+            if self.started:
+                tracemalloc.stop()
+                self.started = False
+
+    def run(self, name: str, phase: str,
+            fn: Callable[[], None], files: Callable[[], int]):
+        """
+        Run `fn` as `phase` of project `name`, recording its wall time
+        and the file count returned by `files` afterwards
+        """
+        start = time.perf_counter()
+        fn()
+        seconds = time.perf_counter() - start
+        with self.lock:
+            self.projects.setdefault(name, {})[phase] = {
+                'seconds': seconds,
+                'files': files(),
+            }
+
+    def phase_totals(self):
+        totals = {phase: 0.0 for phase in Report.PHASES}
+        for phases in self.projects.values():
+            for phase, record in phases.items():
+                totals[phase] = totals.get(phase, 0.0) + record['seconds']
+        return totals
+
+    def to_dict(self):
+        return {
+            'total_seconds': self.total_seconds,
+            'phases': self.phase_totals(),
+            'projects': self.projects,
+            'cache': self.cache,
+            'schedule': self.schedule,
+            'build': self.build,
+            'peak_memory': self.peak_memory,
+        }
@@ -0,0 +1,93 @@
+from typing import Callable, Dict, List, Optional
+
+import json
+import os
+import os.path as path
+import threading
+
+from .version import __version__
+
+
+class ScanCache(object):
+    """
+    Persistent cache of the direct include list of each scanned file
+
+    Entries are keyed by path and validated against the file's mtime_ns,
+    size and inode, so only files whose stat changed are rescanned. The
+    whole cache is dropped when the scanner signature or the mkmake
+    version differs from the one it was written with.
+    """
+
+    FORMAT = 1
+
+    def __init__(self, cache_path: str, signature: str):
+        self.cache_path = cache_path
+        self.signature = signature
+        self.entries: Dict[str, list] = {}
+        self.used = set()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.load()
+
+    def header(self):
+        return {
+            'format': ScanCache.FORMAT,
+            'version': __version__,
+            'signature': self.signature,
+        }
+
+    def load(self):
+        try:
+            with open(self.cache_path, 'r') as fin:
+                data = json.load(fin)
+        except (OSError, ValueError):
+            return
+        if not isinstance(data, dict) or data.get('header') != self.header():
+            return
+        entries = data.get('entries')
+        if isinstance(entries, dict):
+            self.entries = entries
+
+    def save(self):
+        entries = {
+            key: value
+            for key, value in self.entries.items()
+            if key in self.used
+        }
+        os.makedirs(path.dirname(self.cache_path), exist_ok=True)
+        tmp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as fout:
+            json.dump(
+                {'header': self.header(), 'entries': entries},
+                fout, separators=(',', ':'))
+        os.replace(tmp_path, self.cache_path)
+
+    @staticmethod
+    def stat_key(source: str):
+        st = os.stat(source)
+        return [st.st_mtime_ns, st.st_size, st.st_ino]
+
+    def get(self, source: str,
+            scanner: Callable[[str], List[str]]) -> List[str]:
+        """
+        Return the includes of `source`, calling `scanner` on a miss
+        """
+        key = path.abspath(source)
+        stat = ScanCache.stat_key(key)
+        self.used.add(key)
+
+        entry: Optional[list] = self.entries.get(key)
+        if entry is not None and entry[:3] == stat:
+            with self.lock:
+                self.hits += 1
+            return entry[3]
+
+        includes = scanner(source)
+        with self.lock:
+            self.misses += 1
+            self.entries[key] = stat + [includes]
+        return includes
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
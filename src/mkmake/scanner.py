@@ -0,0 +1,64 @@
+from typing import List, Optional, Union
+
+import mmap
+import os
+import re
+
+INCLUDE_RE = re.compile(rb'^[ \t]*#[ \t]*include[ \t]*"([^"\r\n]*)"', re.M)
+DIRECTIVE_RE = re.compile(
+    rb'^[ \t]*#[ \t]*(?:include[ \t]*"([^"\r\n]*)")?', re.M)
+NEWLINE = b'\n'
+
+# smaller files are cheaper to read() than to map
+MMAP_THRESHOLD = 1 << 16
+
+Buffer = Union[bytes, mmap.mmap]
+
+
+def scan_buffer(buf: Buffer, preamble_lines: Optional[int] = None):
+    """
+    Quoted include names in `buf`
+
+    With `preamble_lines`, scanning stops at the first run of more than
+    that many lines without a preprocessor directive.
+    """
+    if preamble_lines is None:
+        return [os.fsdecode(name) for name in INCLUDE_RE.findall(buf)]
+
+    ret: List[str] = []
+    pos = 0
+    while True:
+        # end of the window: `preamble_lines` more lines after `pos`
+        end = pos
+        for _ in range(preamble_lines + 1):
+            end = buf.find(NEWLINE, end) + 1
+            if end == 0:
+                end = len(buf)
+                break
+        mat = DIRECTIVE_RE.search(buf, pos, end)
+        if mat is None:
+            return ret
+        if mat.group(1) is not None:
+            ret.append(os.fsdecode(mat.group(1)))
+        pos = buf.find(NEWLINE, mat.end()) + 1
+        if pos == 0:
+            return ret
+
+
+def scan_includes(file_path: str, preamble_lines: Optional[int] = None):
+    """
+    Quoted include names of `file_path`, see `scan_buffer`
+
+    Works on raw bytes, so CRLF line ends and invalid UTF-8 are fine;
+    large files are memory-mapped instead of read.
+    """
+    with open(file_path, 'rb') as fin:
+        size = os.fstat(fin.fileno()).st_size
+        if size < MMAP_THRESHOLD:
+            return scan_buffer(fin.read(), preamble_lines)
+        try:
+            buf = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return scan_buffer(fin.read(), preamble_lines)
+    with buf:
+        return scan_buffer(buf, preamble_lines)
@@ -0,0 +1,189 @@
+from typing import Dict, List, Mapping, Optional
+
+import fcntl
+import heapq
+import json
+import os
+import os.path as path
+
+from .projects import Project
+
+TIMES_FILE = 'project-times.json'
+
+
+def load_times(target_root: str) -> Dict[str, float]:
+    """
+    Recorded build seconds per project, from `target/project-times.json`
+
+    Generation only reads the file. It is written by the in-process
+    build (`mkmake.executor`), by `Projects.mk` through
+    `mkmake.buildtime` or by other build wrappers through `save_times`;
+    without it, projects are weighted by source count.
+    """
+    try:
+        with open(path.join(target_root, TIMES_FILE), 'r') as fin:
+            data = json.load(fin)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(data, dict):
+        return {}
+    return {
+        name: float(seconds) for name, seconds in data.items()
+        if isinstance(seconds, (int, float))
+    }
+
+
+def save_times(target_root: str, times: Mapping[str, float]):
+    """
+    Record build seconds per project for `load_times`, for build
+    wrappers timing their own builds
+    """
+    os.makedirs(target_root, exist_ok=True)
+    tmp_path = path.join(target_root, f"{TIMES_FILE}.{os.getpid()}.tmp")
+    with open(tmp_path, 'w') as fout:
+        json.dump(dict(times), fout, indent=2, sort_keys=True)
+    os.replace(tmp_path, path.join(target_root, TIMES_FILE))
+
+
+def record_time(target_root: str, name: str, seconds: float):
+    """
+    Merge the build seconds of project `name` into `project-times.json`,
+    locked against the projects make builds in parallel
+    """
+    os.makedirs(target_root, exist_ok=True)
+    with open(path.join(target_root, f"{TIMES_FILE}.lock"), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        times = load_times(target_root)
+        times[name] = round(seconds, 6)
+        save_times(target_root, times)
+
+
+class Schedule(object):
+    """
+    Dependency levels and critical-path priorities of a workspace
+
+    Level 0 holds the projects without dependencies, level n those whose
+    deepest dependency is on level n - 1. The priority of a project is
+    its weight plus the highest priority among its dependents, the total
+    weight of the longest chain it starts. `order` is a topological
+    order that always takes the ready project with the highest priority
+    (declaration order breaks ties), so the critical path starts first.
+    """
+
+    def __init__(
+        self,
+        projects: Mapping[str, Project],
+        weights: Optional[Mapping[str, float]] = None,
+    ):
+        self.names = list(projects)
+        self.depends = {
+            name: list(proj.depends) for name, proj in projects.items()
+        }
+        weights = weights or {}
+        self.weights = {
+            name: float(weights.get(name, 1.0)) for name in self.names
+        }
+
+        self.sorted = self.sort()
+        self.dependents: Dict[str, List[str]] = {name: [] for name in self.names}
+        for name in self.sorted:
+            for dep in self.depends[name]:
+                self.dependents[dep].append(name)
+
+        self.level: Dict[str, int] = {}
+        for name in self.sorted:
+            self.level[name] = max(
+                (self.level[dep] + 1 for dep in self.depends[name]), default=0)
+        self.levels: List[List[str]] = [
+            [] for _ in range(max(self.level.values(), default=-1) + 1)
+        ]
+        for name in self.names:
+            self.levels[self.level[name]].append(name)
+
+        self.priority: Dict[str, float] = {}
+        for name in reversed(self.sorted):
+            self.priority[name] = self.weights[name] + max(
+                (self.priority[dep] for dep in self.dependents[name]),
+                default=0.0)
+
+        self.order = self.prioritized()
+
+    def sort(self) -> List[str]:
+        """
+        Depth-first topological order, dependencies first
+
+        Iterative, so long dependency chains do not hit the recursion
+        limit; a cycle is reported with its full path.
+        """
+        visiting, visited = 1, 2
+        state: Dict[str, int] = {}
+        ordered: List[str] = []
+        for root in self.names:
+            if root in state:
+                continue
+            state[root] = visiting
+            stack = [(root, iter(self.depends[root]))]
+            while stack:
+                name, children = stack[-1]
+                for child in children:
+                    if child not in self.depends:
+                        raise ValueError(
+                            f"Unknown project dependency '{child}' "
+                            f"of project '{name}'")
+                    if state.get(child) == visiting:
+                        cycle = [entry[0] for entry in stack]
+                        cycle = cycle[cycle.index(child):] + [child]
+                        raise ValueError(
+                            f"Dependency cycle detected: {' -> '.join(cycle)}")
+                    if child not in state:
+                        state[child] = visiting
+                        stack.append((child, iter(self.depends[child])))
+                        break
+                else:
+                    stack.pop()
+                    state[name] = visited
+                    ordered.append(name)
+        return ordered
+
+    def prioritized(self) -> List[str]:
+        index = {name: i for i, name in enumerate(self.names)}
+        waiting = {name: len(set(self.depends[name])) for name in self.names}
+        ready = [
+            (-self.priority[name], index[name], name)
+            for name in self.names if not waiting[name]
+        ]
+        heapq.heapify(ready)
+        ordered: List[str] = []
+        while ready:
+            _, _, name = heapq.heappop(ready)
+            ordered.append(name)
+            for dep in set(self.dependents[name]):
+                waiting[dep] -= 1
+                if not waiting[dep]:
+                    heapq.heappush(ready, (-self.priority[dep], index[dep], dep))
+        return ordered
+
+    def rank(self, names):
+        """
+        `names` sorted by scheduling order
+        """
+        index = {name: i for i, name in enumerate(self.order)}
+        return sorted(names, key=lambda name: index[name])
+
+    def critical_path(self) -> List[str]:
+        if not self.names:
+            return []
+        name = max(self.levels[0], key=lambda name: self.priority[name])
+        ret = [name]
+        while self.dependents[name]:
+            name = max(self.dependents[name], key=lambda dep: self.priority[dep])
+            ret.append(name)
+        return ret
+
+    def to_dict(self):
+        return {
+            'levels': self.levels,
+            'weights': self.weights,
+            'priority': self.priority,
+            'critical_path': self.critical_path(),
+        }
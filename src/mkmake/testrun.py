@@ -0,0 +1,248 @@
+"""
+Cached, sharded test runner
+
+Runs a test suite: `python -m mkmake.testrun --dir <dir> [options] --
+'<command>'`. With `--list '<command>'` the suite is split into the
+cases that command prints, one per line, and each case runs as its own
+process with `{case}` in the test command (and `$MKMAKE_TEST_CASE`) set
+to its name, up to `--jobs` at a time, slowest first by the durations
+recorded in earlier runs. Passing cases are cached under a key hashing
+the test binary, the `--input` files, the commands and the environment,
+so an unchanged suite is not run again and only failed cases rerun.
+Case outputs are merged into `<dir>/summary.out`.
+"""
+from typing import Dict, List, Optional, Tuple
+
+import hashlib
+import json
+import os
+import os.path as path
+import shlex
+import subprocess
+import sys
+import time
+from argparse import REMAINDER, ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+
+# set by make or the shell, they do not change what a test does
+VOLATILE_ENV = {
+    'MAKEFLAGS', 'MFLAGS', 'MAKELEVEL', 'MAKEOVERRIDES', 'MAKE_TERMOUT',
+    'MAKE_TERMERR', 'PWD', 'OLDPWD', 'SHLVL', '_',
+}
+SUITE = 'test'
+
+
+def schedule(cases: List[str], durations: Dict[str, float]) -> List[str]:
+    """
+    Slowest cases first, cases without a recorded duration before all
+    """
+    return sorted(
+        cases, key=lambda case: -durations.get(case, float('inf')))
+
+
+class TestRunner(object):
+    """
+    State directory: <dir>/state.json (key, passed cases, durations and
+    file digests memoized by stat) and <dir>/summary.out
+    """
+    __test__ = False
+
+    def __init__(
+        self, state_dir: str, command: str,
+        binary: Optional[str] = None, inputs: List[str] = [],
+        list_command: Optional[str] = None,
+        env: Optional[List[str]] = None, jobs: Optional[int] = None,
+    ):
+        self.state_dir = path.abspath(state_dir)
+        self.state_path = path.join(self.state_dir, 'state.json')
+        self.summary_path = path.join(self.state_dir, 'summary.out')
+        self.command = command
+        self.binary = binary
+        self.inputs = inputs
+        self.list_command = list_command
+        self.env = env
+        self.jobs = jobs or os.cpu_count() or 1
+        self.state = self.load()
+
+    def load(self) -> dict:
+        try:
+            with open(self.state_path, 'r') as fin:
+                state = json.load(fin)
+        except (OSError, ValueError):
+            state = {}
+        state.setdefault('key', None)
+        state.setdefault('passed', [])
+        state.setdefault('durations', {})
+        state.setdefault('digests', {})
+        return state
+
+    def save(self):
+        os.makedirs(self.state_dir, exist_ok=True)
+        tmp_path = f"{self.state_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as fout:
+            json.dump(self.state, fout, sort_keys=True)
+        os.replace(tmp_path, self.state_path)
+
+    def digest(self, file_path: str) -> str:
+        """
+        Hash of a file's content, memoized by its stat
+        """
+        file_path = path.abspath(file_path)
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            return 'missing'
+        stamp = f"{st.st_mtime_ns}:{st.st_size}"
+        memo = self.state['digests'].get(file_path)
+        if memo is not None and memo[0] == stamp:
+            return memo[1]
+
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as fin:
+            for chunk in iter(lambda: fin.read(1 << 20), b''):
+                digest.update(chunk)
+        self.state['digests'][file_path] = [stamp, digest.hexdigest()]
+        return digest.hexdigest()
+
+    def environment(self) -> List[Tuple[str, str]]:
+        if self.env is not None:
+            return [(name, os.environ.get(name, '')) for name in self.env]
+        return sorted(
+            (name, value) for name, value in os.environ.items()
+            if name not in VOLATILE_ENV)
+
+    def key(self) -> str:
+        files = [self.binary] if self.binary is not None else []
+        digest = hashlib.sha256()
+        digest.update(json.dumps([
+            self.command,
+            self.list_command,
+            [(file, self.digest(file)) for file in files + self.inputs],
+            self.environment(),
+        ]).encode())
+        return digest.hexdigest()
+
+    def cases(self) -> List[str]:
+        if self.list_command is None:
+            return [SUITE]
+        listed = subprocess.run(
+            self.list_command, shell=True, check=True,
+            stdout=subprocess.PIPE, universal_newlines=True)
+        cases = []
+        for line in listed.stdout.splitlines():
+            line = line.strip()
+            if line and line not in cases:
+                cases.append(line)
+        return cases
+
+    def run_case(self, case: str) -> Tuple[str, int, float, str]:
+        command = self.command
+        env = None
+        if self.list_command is not None:
+            command = command.replace('{case}', shlex.quote(case))
+            env = dict(os.environ, MKMAKE_TEST_CASE=case)
+        start = time.monotonic()
+        ret = subprocess.run(
+            command, shell=True, env=env,
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        seconds = time.monotonic() - start
+        output = ret.stdout.decode('utf-8', 'replace')
+        return case, ret.returncode, seconds, output
+
+    def run(self) -> int:
+        start = time.monotonic()
+        key = self.key()
+        if key == self.state['key'] and path.exists(self.summary_path) \
+                and self.state.get('failed') == []:
+            print(f"Tests unchanged, {len(self.state['passed'])} "
+                  f"cached passes, see {self.summary_path}")
+            self.save()
+            return 0
+
+        passed = set(self.state['passed'] if key == self.state['key'] else [])
+        try:
+            cases = self.cases()
+        except subprocess.CalledProcessError as e:
+            print(f"Listing test cases failed: {self.list_command}",
+                  file=sys.stderr)
+            return e.returncode or 1
+        durations = self.state['durations']
+        todo = [case for case in schedule(cases, durations)
+                if case not in passed]
+
+        results: Dict[str, Tuple[int, float, str]] = {}
+        with ThreadPoolExecutor(min(self.jobs, max(len(todo), 1))) as pool:
+            for case, ret, seconds, output in pool.map(self.run_case, todo):
+                results[case] = (ret, seconds, output)
+                durations[case] = round(seconds, 6)
+                if ret != 0:
+                    print(f"FAIL {case} (exit {ret})", file=sys.stderr)
+
+        failed = []
+        summary = []
+        for case in cases:
+            if case not in results:
+                summary.append(f"==== {case}: PASS (cached)\n")
+                continue
+            ret, seconds, output = results[case]
+            if ret == 0:
+                passed.add(case)
+                status = 'PASS'
+            else:
+                passed.discard(case)
+                failed.append(case)
+                status = f"FAIL (exit {ret})"
+            summary.append(f"==== {case}: {status} {seconds:.3f}s\n{output}")
+            if output and not output.endswith('\n'):
+                summary.append('\n')
+        total = (
+            f"{len(cases) - len(failed)} passed, {len(failed)} failed, "
+            f"{len(cases) - len(results)} cached, "
+            f"in {time.monotonic() - start:.3f}s\n")
+        summary.append(total)
+
+        os.makedirs(self.state_dir, exist_ok=True)
+        with open(self.summary_path, 'w') as fout:
+            fout.write(''.join(summary))
+        self.state['key'] = key
+        self.state['passed'] = sorted(passed & set(cases))
+        self.state['failed'] = failed
+        self.save()
+
+        for case in failed:
+            sys.stderr.write(
+                f"==== {case}\n{results[case][2]}")
+        print(total, end='')
+        return 1 if failed else 0
+
+
+def main(argv=None):
+    parser = ArgumentParser(prog='python -m mkmake.testrun')
+    parser.add_argument('--dir', required=True,
+                        help='state directory, gets summary.out')
+    parser.add_argument('--binary', default=None,
+                        help='test binary, part of the cache key')
+    parser.add_argument('--input', action='append', default=[],
+                        help='test file, part of the cache key')
+    parser.add_argument('--list', default=None,
+                        help='command printing the test cases')
+    parser.add_argument('--env', action='append', default=None,
+                        help='environment variable in the cache key '
+                             '(default: the whole environment)')
+    parser.add_argument('--jobs', type=int, default=None)
+    parser.add_argument('command', nargs=REMAINDER)
+    args = parser.parse_args(argv)
+
+    command = args.command
+    if command and command[0] == '--':
+        command = command[1:]
+    if not command:
+        parser.error('missing test command')
+    runner = TestRunner(
+        args.dir, ' '.join(command), args.binary, args.input, args.list,
+        args.env, args.jobs)
+    return runner.run()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,481 @@
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+import ctypes
+import ctypes.util
+import os
+import os.path as path
+import select
+import struct
+import subprocess
+import sys
+import time
+
+from .actions import DEFAULT_POOLS
+from .metaproject import _scan_deps, _scan_sources, _write_makefile, make_projects
+from .ninja import write_ninja
+from .projects import CProject
+from .report import Report
+from .schedule import Schedule
+
+CREATED = 'created'
+MODIFIED = 'modified'
+DELETED = 'deleted'
+OVERFLOW = 'overflow'
+
+Event = Tuple[Optional[str], str]
+
+
+def _inside(file_path: str, dir_path: str):
+    return file_path == dir_path or file_path.startswith(dir_path + path.sep)
+
+
+def _skipped(proj: CProject, file_path: str):
+    name = path.basename(file_path)
+    return (
+        name.startswith('.')
+        or _inside(file_path, proj.target_root)
+        or proj.is_excluded(file_path, name)
+    )
+
+
+def _walk_dirs(proj: CProject, root: str) -> Iterator[str]:
+    """
+    Directories under `root` that may hold files of `proj`
+    """
+    stack = [root]
+    while stack:
+        dir_path = stack.pop()
+        yield dir_path
+        try:
+            with os.scandir(dir_path) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False) and \
+                            not _skipped(proj, entry.path):
+                        stack.append(entry.path)
+        except OSError:
+            continue
+
+
+class InotifyWatcher(object):
+    """
+    File events from Linux inotify, with one watch per directory
+    """
+
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ISDIR = 0x40000000
+    MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+    EVENT = struct.Struct('iIII')
+
+    @staticmethod
+    def available():
+        if not sys.platform.startswith('linux'):
+            return False
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        except OSError:
+            return False
+        return hasattr(libc, 'inotify_init1')
+
+    def __init__(self, projects: List[CProject]):
+        self.projects = projects
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self.dirs: Dict[int, str] = {}
+        for proj in projects:
+            self.add_tree(proj, proj.root_path)
+
+    def add_tree(self, proj: CProject, root: str):
+        added = []
+        for dir_path in _walk_dirs(proj, root):
+            wd = self.libc.inotify_add_watch(
+                self.fd, os.fsencode(dir_path), InotifyWatcher.MASK)
+            if wd < 0:
+                errno = ctypes.get_errno()
+                if errno == 28:
+                    raise OSError(
+                        errno, "inotify watch limit reached, raise "
+                        "fs.inotify.max_user_watches or watch by polling")
+                continue
+            self.dirs[wd] = dir_path
+            added.append(dir_path)
+        return added
+
+    def add_dir(self, dir_path: str) -> List[Event]:
+        """
+        Watch a new directory, returns events for the files created in it
+        before its watch was in place
+        """
+        events: List[Event] = []
+        for proj in self.projects:
+            if not _inside(dir_path, proj.root_path) or \
+                    _skipped(proj, dir_path):
+                continue
+            for added in self.add_tree(proj, dir_path):
+                try:
+                    with os.scandir(added) as it:
+                        events.extend(
+                            (entry.path, CREATED) for entry in it
+                            if not entry.is_dir(follow_symlinks=False))
+                except OSError:
+                    continue
+        return events
+
+    def remove_dir(self, dir_path: str):
+        for wd, watched in list(self.dirs.items()):
+            if _inside(watched, dir_path):
+                self.libc.inotify_rm_watch(self.fd, wd)
+                del self.dirs[wd]
+
+    def read(self, timeout: Optional[float]) -> List[Event]:
+        """
+        Wait up to `timeout` seconds (forever if None) for events
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return []
+
+        events: List[Event] = []
+        offset = 0
+        size = InotifyWatcher.EVENT.size
+        while offset + size <= len(data):
+            wd, mask, _, length = InotifyWatcher.EVENT.unpack_from(data, offset)
+            name = data[offset + size:offset + size + length].rstrip(b'\0')
+            offset += size + length
+
+            if mask & InotifyWatcher.IN_Q_OVERFLOW:
+                events.append((None, OVERFLOW))
+                continue
+            if mask & InotifyWatcher.IN_IGNORED:
+                self.dirs.pop(wd, None)
+                continue
+            dir_path = self.dirs.get(wd)
+            if dir_path is None:
+                continue
+
+            file_path = path.join(dir_path, os.fsdecode(name))
+            is_dir = mask & InotifyWatcher.IN_ISDIR
+            if mask & (InotifyWatcher.IN_CREATE | InotifyWatcher.IN_MOVED_TO):
+                events.append((file_path, CREATED))
+                if is_dir:
+                    events += self.add_dir(file_path)
+            elif mask & (InotifyWatcher.IN_DELETE | InotifyWatcher.IN_MOVED_FROM):
+                if is_dir:
+                    self.remove_dir(file_path)
+                events.append((file_path, DELETED))
+            elif mask & InotifyWatcher.IN_CLOSE_WRITE:
+                events.append((file_path, MODIFIED))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollWatcher(object):
+    """
+    Portable fallback: diff stat snapshots of the project trees
+    """
+
+    def __init__(self, projects: List[CProject], interval: float = 0.5):
+        self.projects = projects
+        self.interval = interval
+        self.snapshot = self.take()
+
+    def take(self):
+        ret: Dict[str, Tuple[int, int]] = {}
+        for proj in self.projects:
+            for dir_path in _walk_dirs(proj, proj.root_path):
+                try:
+                    with os.scandir(dir_path) as it:
+                        for entry in it:
+                            st = entry.stat(follow_symlinks=False)
+                            ret[entry.path] = (st.st_mtime_ns, st.st_size)
+                except OSError:
+                    continue
+        return ret
+
+    def diff(self):
+        snapshot = self.take()
+        events: List[Event] = []
+        for file_path, stat in snapshot.items():
+            old = self.snapshot.get(file_path)
+            if old is None:
+                events.append((file_path, CREATED))
+            elif old != stat and not path.isdir(file_path):
+                events.append((file_path, MODIFIED))
+        for file_path in self.snapshot.keys() - snapshot.keys():
+            events.append((file_path, DELETED))
+        self.snapshot = snapshot
+        return events
+
+    def read(self, timeout: Optional[float]) -> List[Event]:
+        while True:
+            time.sleep(self.interval if timeout is None else timeout)
+            events = self.diff()
+            if events or timeout is not None:
+                return events
+
+    def close(self):
+        pass
+
+
+class Watch(object):
+    """
+    Keep a generated workspace in memory and regenerate it on changes
+
+    `start` generates every project like `make_projects(projects,
+    **kwargs)`. The projects keep their scanned files and header
+    closures, and the scan cache the direct includes of every file, so a
+    batch of file events only regenerates the projects whose files were
+    added, removed or changed their includes. Dependents follow only
+    when one of their files includes a header whose closure (or
+    existence) changed. With `make_args` (a possibly empty list of
+    targets), make runs after every batch.
+    """
+
+    def __init__(
+        self,
+        projects: Dict[str, CProject],
+        make_args: Optional[List[str]] = None,
+        poll: bool = False,
+        interval: float = 0.5,
+        debounce: float = 0.05,
+        verbose: int = 1,
+        **kwargs
+    ):
+        self.projects = projects
+        self.make_args = make_args
+        self.poll = poll
+        self.interval = interval
+        self.debounce = debounce
+        self.verbose = verbose
+        self.kwargs = kwargs
+        self.files: Dict[str, Set[str]] = {}
+        self.includes: Dict[str, Optional[Set[str]]] = {}
+
+    def log(self, message: str, level: int = 1):
+        if self.verbose >= level:
+            print(message)
+
+    def start(self) -> dict:
+        report = make_projects(self.projects, verbose=self.verbose, **self.kwargs)
+
+        self.ordered = [
+            (name, self.projects[name])
+            for name in Schedule(self.projects).order
+        ]
+        self.common_root = path.commonpath(
+            [proj.root_path for proj in self.projects.values()])
+        for name, proj in self.ordered:
+            self.index(name, proj)
+        return report
+
+    def index(self, name: str, proj: CProject):
+        """
+        Record the files of `proj` and every name they include
+        """
+        self.files[name] = set(proj.all_sources.values())
+        includes: Optional[Set[str]] = set()
+        for file_path in self.files[name]:
+            entry = None
+            if proj.scan_cache is not None:
+                entry = proj.scan_cache.entries.get(file_path)
+            if entry is None:
+                # not scanned, assume it may include anything
+                includes = None
+                break
+            includes.update(entry[3])
+        self.includes[name] = includes
+
+    def public(self, proj: CProject):
+        """
+        Closures of the headers `proj` shows to its dependents
+        """
+        return {
+            key: proj.deps.get(key)
+            for key in list(proj.headers) + list(proj.internals)
+        }
+
+    def owners(self, file_path: str):
+        for name, proj in self.ordered:
+            if _inside(file_path, proj.root_path) and \
+                    not _skipped(proj, file_path):
+                yield name
+
+    def includes_changed(self, proj: CProject, file_path: str):
+        if proj.compiler_deps and file_path in proj.sources.values():
+            # only header closures are scanned
+            return False
+        if proj.scan_cache is None or proj.pch:
+            return True
+        old = proj.scan_cache.entries.get(file_path)
+        try:
+            includes = proj.scan_cache.get(file_path, proj.scan_includes_file)
+        except OSError:
+            return True
+        return old is None or old[3] != includes
+
+    def relevant(self, name: str, file_path: str, kind: str):
+        """
+        Whether an event changes the Makefile of project `name`
+        """
+        proj = self.projects[name]
+        files = self.files[name]
+        if kind == MODIFIED:
+            return file_path in files and self.includes_changed(proj, file_path)
+        if kind == DELETED:
+            return any(_inside(known, file_path) for known in files)
+
+        is_dir = path.isdir(file_path)
+        for prefix, suffixes in proj.source_buckets().values():
+            prefix = path.abspath(prefix)
+            if _inside(file_path, prefix):
+                if is_dir or file_path.endswith(
+                        tuple(f".{s}" for s in suffixes)):
+                    return True
+            elif is_dir and _inside(prefix, file_path):
+                return True
+        return False
+
+    def changed(self, events: List[Event]):
+        """
+        Projects whose own files changed, and the projects `events` touch
+        """
+        changed: Set[str] = set()
+        touched: Set[str] = set()
+        for file_path, kind in events:
+            if kind == OVERFLOW:
+                return set(self.projects), set(self.projects)
+            for name in self.owners(file_path):
+                touched.add(name)
+                if name not in changed and self.relevant(name, file_path, kind):
+                    changed.add(name)
+        return changed, touched
+
+    def stale(self, name: str, proj: CProject, headers: Dict[str, Set[str]]):
+        """
+        Whether `proj` sees one of the changed dependency `headers`
+        """
+        includes = self.includes[name]
+        for dep in proj.depends:
+            changed = headers.get(dep)
+            if not changed:
+                continue
+            # exports are order-only prerequisites with compiler deps
+            if proj.pch or proj.compiler_deps or includes is None:
+                return True
+            if not changed.isdisjoint(includes):
+                return True
+        return False
+
+    def regenerate(self, changed: Set[str]):
+        """
+        Regenerate the `changed` projects and the dependents that see
+        their header changes, returns the regenerated project names
+        """
+        report = Report()
+        report.start()
+        regenerated: Set[str] = set()
+        headers: Dict[str, Set[str]] = {}
+        for name, proj in self.ordered:
+            if name not in changed and not self.stale(name, proj, headers):
+                continue
+            before = self.public(proj)
+            _scan_sources(report, name, proj)
+            _scan_deps(report, name, proj, self.projects)
+            _write_makefile(report, name, proj)
+            self.index(name, proj)
+            regenerated.add(name)
+
+            after = self.public(proj)
+            headers[name] = {
+                key for key in before.keys() | after.keys()
+                if before.get(key) != after.get(key)
+                or (key in before) != (key in after)
+            }
+        if regenerated and self.kwargs.get('backend') == 'ninja':
+            # the actions of every project share one build.ninja
+            write_ninja(
+                path.join(self.common_root, 'target', 'build.ninja'),
+                self.ordered,
+                {**DEFAULT_POOLS, **(self.kwargs.get('pools') or {})},
+                self.common_root)
+        report.stop()
+        self.log(f"Regenerated {', '.join(sorted(regenerated))} "
+                 f"in {report.total_seconds * 1000:.1f}ms.")
+        return regenerated
+
+    def handle(self, events: List[Event]):
+        """
+        Apply a batch of events, returns the regenerated and the touched
+        project names
+        """
+        changed, touched = self.changed(events)
+        regenerated: Set[str] = set()
+        if changed:
+            regenerated = self.regenerate(changed)
+        return regenerated, touched
+
+    def save(self):
+        caches = {id(proj.scan_cache): proj.scan_cache for _, proj in self.ordered}
+        for scan_cache in caches.values():
+            if scan_cache is not None:
+                scan_cache.save()
+
+    def build(self):
+        if self.make_args is None:
+            return None
+        makefile = 'Projects.mk'
+        if not self.kwargs.get('recursive', True):
+            makefile = 'Workspace.mk'
+        command = ['make', '-f', path.join('target', makefile)] + self.make_args
+        if self.kwargs.get('backend') == 'ninja':
+            command = ['ninja', '-f', path.join('target', 'build.ninja')] + \
+                self.make_args
+        self.log(' '.join(command))
+        return subprocess.call(command, cwd=self.common_root)
+
+    def watcher(self):
+        projects = [proj for _, proj in self.ordered]
+        if not self.poll and InotifyWatcher.available():
+            return InotifyWatcher(projects)
+        return PollWatcher(projects, self.interval)
+
+    def run(self):
+        """
+        Generate, then regenerate on every change until interrupted
+        """
+        self.start()
+        self.build()
+        watcher = self.watcher()
+        self.log(f"Watching {len(self.projects)} projects...")
+        try:
+            while True:
+                events = watcher.read(None)
+                while True:
+                    more = watcher.read(self.debounce)
+                    if not more:
+                        break
+                    events += more
+                _, touched = self.handle(events)
+                if touched:
+                    self.build()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            watcher.close()
+            # the cache is only read back by the next run
+            self.save()
@@ -0,0 +1,71 @@
+import pytest
+
+from mkmake.projects import CProject, TestProject, YYProject
+
+
+@pytest.fixture
+def workspace(tmp_path):
+    """
+    Factory of a small workspace under `tmp_path`: a `core` library with
+    public and private headers, a `parser` grammar library, an `app`
+    binary and a `tests` project
+
+    `workspace("core", "app")` only writes and returns the named projects,
+    dependencies on the others are dropped.
+    """
+
+    def make(*names):
+        names = names or ("core", "parser", "app", "tests")
+        core = tmp_path / "core"
+        parser = tmp_path / "parser"
+        app = tmp_path / "app"
+        tests = tmp_path / "tests"
+        for name in names:
+            (tmp_path / name / "src" / "include").mkdir(parents=True)
+            (tmp_path / name / "include").mkdir()
+
+        if "core" in names:
+            (core / "include" / "core.h").write_text("#pragma once\n")
+            (core / "include" / "util.h").write_text("#pragma once\n")
+            (core / "src" / "include" / "core_priv.h").write_text(
+                '#include "core.h"\n')
+            (core / "src" / "core.c").write_text('#include "core_priv.h"\n')
+            (core / "src" / "util.c").write_text('#include "util.h"\n')
+        if "parser" in names:
+            (parser / "src" / "yy").mkdir()
+            (parser / "src" / "yy" / "grammar.y").write_text(
+                '%{\n#include "core.h"\n%}\n%%\nstart: ;\n%%\n')
+            (parser / "src" / "parse.c").write_text(
+                '#include "grammar.tab.h"\n')
+            (parser / "src" / "other.c").write_text("int other;\n")
+        if "app" in names:
+            (app / "src" / "main.c").write_text(
+                '#include "util.h"\nint main(void){return 0;}\n')
+        if "tests" in names:
+            (tests / "src" / "test.c").write_text(
+                '#include "core_priv.h"\nint main(void){return 0;}\n')
+            (tests / "run.py").write_text("print('ok')\n")
+
+        def depends(*deps):
+            return [dep for dep in deps if dep in names]
+
+        projects = {
+            "core": lambda: CProject(
+                str(core), output_name="libcore.a",
+                output_type=CProject.OutputType.STATIC),
+            "parser": lambda: YYProject(
+                str(parser), output_name="libparser.a",
+                output_type=CProject.OutputType.STATIC,
+                depends=depends("core")),
+            "app": lambda: CProject(
+                str(app), output_name="app",
+                output_type=CProject.OutputType.BINARY,
+                depends=depends("parser", "core")),
+            "tests": lambda: TestProject(
+                str(tests), test_command="python3 {0}",
+                test_files=["run.py"], depends=depends("core"),
+                private_depends=depends("core")),
+        }
+        return {name: projects[name]() for name in names}
+
+    return make
@@ -0,0 +1,36 @@
+import json
+from importlib.util import module_from_spec, spec_from_file_location
+from pathlib import Path
+
+
+def load_benchmark_module(name):
+    path = Path(__file__).resolve().parents[1] / "benchmarks" / f"{name}.py"
+    spec = spec_from_file_location(f"benchmark_{name}", path)
+    module = module_from_spec(spec)
+    assert spec is not None
+    assert spec.loader is not None
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_benchmark_run_writes_comparable_json(tmp_path):
+    run = load_benchmark_module("run")
+    compare = load_benchmark_module("compare")
+
+    output = tmp_path / "bench.json"
+    run.main([
+        "--projects", "4", "--sources", "6", "--headers", "4",
+        "--repeat", "1", "--root", str(tmp_path / "ws"), "-o", str(output),
+    ])
+
+    result = json.loads(output.read_text())
+    assert set(result["summary"]) == {"cold", "warm"}
+    kinds = result["summary"]["cold"]["kinds"]
+    assert set(kinds) == {"CProject", "YYProject", "TestProject"}
+    assert set(kinds["TestProject"]) == {
+        "scan_sources", "inject_depends", "scan_deps", "write_makefile"
+    }
+    assert result["runs"]["warm"][0]["cache"]["misses"] == 0
+    assert result["makefile_bytes"] > 0
+
+    assert compare.main([str(output), str(output)]) == 0
@@ -1,3 +1,9 @@
+import os
+import shutil
+import subprocess
+
+import pytest
+
 from mkmake.projects import CProject
 from mkmake import make_projects
 
@@ -73,3 +79,413 @@ def test_lib_includes_are_appended_after_project_and_dependency_includes(tmp_pat
 
     indices = [cflags.index(flag) for flag in expected]
     assert indices == sorted(indices)
+
+
+def test_unchanged_makefiles_keep_their_mtime(tmp_path):
+    root = tmp_path / "generic"
+    (root / "src").mkdir(parents=True)
+    (root / "include").mkdir(parents=True)
+    (root / "src" / "x.c").write_text('#include "x.h"\n')
+    (root / "include" / "x.h").write_text("#pragma once\n")
+
+    def build():
+        make_projects({
+            "generic": CProject(
+                str(root),
+                output_name="libgeneric.a",
+                output_type=CProject.OutputType.STATIC,
+            )
+        })
+
+    build()
+    outputs = [root / "target" / "Makefile", root / "target" / "Projects.mk"]
+    for output in outputs:
+        os.utime(output, ns=(0, 0))
+
+    build()
+    assert [output.stat().st_mtime_ns for output in outputs] == [0, 0]
+
+
+def test_dep_fragments_only_touch_changed_objects(tmp_path):
+    root = tmp_path / "generic"
+    (root / "src" / "sub").mkdir(parents=True)
+    (root / "include").mkdir(parents=True)
+    (root / "src" / "x.c").write_text('#include "x.h"\n')
+    (root / "src" / "sub" / "y.c").write_text('#include "x.h"\n')
+    (root / "src" / "z.c").write_text("int z;\n")
+    (root / "include" / "x.h").write_text("#pragma once\n")
+    (root / "include" / "y.h").write_text("#pragma once\n")
+
+    def build():
+        make_projects({
+            "generic": CProject(
+                str(root),
+                output_name="libgeneric.a",
+                output_type=CProject.OutputType.STATIC,
+                dep_fragments=True,
+            )
+        })
+
+    build()
+    deps = root / "target" / "deps" / "obj"
+    mk = (root / "target" / "Makefile").read_text()
+    assert "-include target/deps/obj/sub/y.d target/deps/obj/x.d target/deps/obj/z.d" in mk
+    assert (deps / "sub" / "y.d").read_text() == "target/obj/sub/y.o : src/sub/y.c include/x.h\n"
+
+    for fragment in deps.rglob("*.d"):
+        os.utime(fragment, ns=(0, 0))
+    (root / "src" / "sub" / "y.c").write_text('#include "y.h"\n')
+    (root / "src" / "z.c").unlink()
+    build()
+
+    assert (deps / "sub" / "y.d").read_text() == "target/obj/sub/y.o : src/sub/y.c include/y.h\n"
+    assert (deps / "x.d").stat().st_mtime_ns == 0
+    assert not (deps / "z.d").exists()
+
+
+@pytest.mark.skipif(shutil.which("gcc") is None, reason="gcc not available")
+def test_clean_keeps_dep_fragments(tmp_path):
+    root = tmp_path / "generic"
+    (root / "src").mkdir(parents=True)
+    (root / "include").mkdir(parents=True)
+    (root / "src" / "f.c").write_text('#include "lib.h"\nint f = VALUE;\n')
+    (root / "include" / "lib.h").write_text("#define VALUE 1\n")
+    make_projects({
+        "generic": CProject(
+            str(root),
+            output_name="libgeneric.a",
+            output_type=CProject.OutputType.STATIC,
+            dep_fragments=True,
+        )
+    }, verbose=0)
+
+    def make(*args):
+        return subprocess.run(
+            ["make", "-f", "target/Makefile", *args], cwd=root, check=True,
+            capture_output=True, text=True).stdout
+
+    make("clean")
+    assert (root / "target" / "deps" / "obj" / "f.d").exists()
+    make()
+    (root / "include" / "lib.h").write_text("#define VALUE 2\n")
+    assert "CC src/f.c" in make()
+
+
+def test_compiler_deps_mode_skips_scanning_and_orders_generated_headers(tmp_path):
+    from mkmake.projects import YYProject
+
+    gen = tmp_path / "gen"
+    parser = tmp_path / "parser"
+    (gen / "src").mkdir(parents=True)
+    (gen / "include").mkdir(parents=True)
+    (gen / "src" / "gen.c").write_text('#include "gen.h"\n')
+    (gen / "include" / "gen.h").write_text("#pragma once\n")
+    (parser / "src" / "yy").mkdir(parents=True)
+    (parser / "include").mkdir(parents=True)
+    (parser / "src" / "yy" / "calc.y").write_text("%%\nstart : ;\n%%\n")
+    (parser / "src" / "use.c").write_text('#include "calc.tab.h"\n#include "gen.h"\n')
+
+    projects = {
+        "gen": CProject(
+            str(gen),
+            output_name="libgen.a",
+            output_type=CProject.OutputType.STATIC,
+        ),
+        "parser": YYProject(
+            str(parser),
+            output_name="libparser.a",
+            output_type=CProject.OutputType.STATIC,
+            depends=["gen"],
+            compiler_deps=True,
+        ),
+    }
+    report = make_projects(projects)
+
+    assert report["cache"] == {"hits": 0, "misses": 2}
+    mk = (parser / "target" / "Makefile").read_text()
+    cflags = [line for line in mk.splitlines() if line.startswith("CFLAGS=")][0]
+    assert "-MMD -MP" in cflags
+    assert "target/obj/use.o : src/use.c\n" in mk
+    assert (
+        "target/obj/use.o target/obj/generated/calc.tab.o : | "
+        f"target/generated-src/calc.tab.h {(gen / 'target' / 'include' / 'gen.h').as_posix()}\n"
+    ) in mk
+    assert "-include target/obj/use.d target/obj/generated/calc.tab.d\n" in mk
+
+
+@pytest.mark.skipif(shutil.which("gcc") is None, reason="gcc not available")
+def test_dependents_of_compiler_deps_project_see_nested_headers(tmp_path):
+    core = tmp_path / "core"
+    app = tmp_path / "app"
+    for root in [core, app]:
+        (root / "src").mkdir(parents=True)
+        (root / "include").mkdir(parents=True)
+    (core / "include" / "pub.h").write_text('#pragma once\n#include "inner.h"\n')
+    (core / "include" / "inner.h").write_text("#define VALUE 1\n")
+    (core / "src" / "core.c").write_text('#include "pub.h"\nint core = VALUE;\n')
+    (app / "src" / "main.c").write_text(
+        '#include "pub.h"\nint main(void){return VALUE;}\n')
+
+    def build():
+        make_projects({
+            "core": CProject(
+                str(core), output_name="libcore.a",
+                output_type=CProject.OutputType.STATIC, compiler_deps=True),
+            "app": CProject(
+                str(app), output_name="app",
+                output_type=CProject.OutputType.BINARY, depends=["core"]),
+        }, verbose=0)
+        subprocess.run(
+            ["make", "-s", "-f", "target/Projects.mk", "all-all"],
+            cwd=tmp_path, check=True, stdout=subprocess.DEVNULL)
+        return subprocess.run([str(app / "target" / "app")]).returncode
+
+    assert build() == 1
+    mk = (app / "target" / "Makefile").read_text()
+    inner = (core / "target" / "include" / "inner.h").as_posix()
+    assert inner in mk
+
+    (core / "include" / "inner.h").write_text("#define VALUE 2\n")
+    assert build() == 2
+
+
+def test_pch_covers_headers_shared_by_most_sources(tmp_path):
+    root = tmp_path / "lib"
+    (root / "src").mkdir(parents=True)
+    (root / "include").mkdir(parents=True)
+    (root / "include" / "common.h").write_text('#pragma once\n#include "big.h"\n')
+    (root / "include" / "big.h").write_text("#pragma once\n" + "int x;\n" * 100)
+    (root / "include" / "rare.h").write_text("#pragma once\n")
+    for i in range(4):
+        (root / "src" / f"f{i}.c").write_text('#include "common.h"\n')
+    (root / "src" / "g.c").write_text('#include "rare.h"\n')
+
+    make_projects({
+        "lib": CProject(
+            str(root),
+            output_name="liblib.a",
+            output_type=CProject.OutputType.STATIC,
+            pch=True,
+            pch_threshold=0.6,
+        )
+    })
+
+    assert (root / "target" / "pch" / "pch.h").read_text() == '#include "common.h"\n'
+    mk = (root / "target" / "Makefile").read_text()
+    assert "$(CC) -c $(CFLAGS) $(PCHFLAGS) -o $@ $<" in mk
+    assert "target/pch/pch.h.gch : target/pch/pch.h include/common.h include/big.h\n" in mk
+    assert "$(CC) -x c-header -c $(CFLAGS) -o $@ $<" in mk
+    objs = " ".join(f"target/obj/f{i}.o" for i in range(4))
+    assert f"{objs} : PCHFLAGS = -include target/pch/pch.h\n" in mk
+    assert f"{objs} : target/pch/pch.h.gch\n" in mk
+    assert "target/obj/g.o : PCHFLAGS" not in mk
+
+
+def test_unity_batches_group_sources_by_header_closure(tmp_path):
+    root = tmp_path / "lib"
+    (root / "src").mkdir(parents=True)
+    (root / "include").mkdir(parents=True)
+    for header in ["a.h", "b.h"]:
+        (root / "include" / header).write_text("#pragma once\n")
+    for name, header in [("a1", "a.h"), ("b1", "b.h"), ("a2", "a.h"), ("b2", "b.h"), ("a3", "a.h")]:
+        (root / "src" / f"{name}.c").write_text(f'#include "{header}"\n')
+    (root / "src" / "solo.c").write_text('#include "a.h"\n')
+
+    make_projects({
+        "lib": CProject(
+            str(root),
+            output_name="liblib.a",
+            output_type=CProject.OutputType.STATIC,
+            unity=True,
+            unity_batch_size=3,
+            unity_exclude=["solo.c"],
+        )
+    })
+
+    unity = root / "target" / "unity"
+    assert sorted(p.name for p in unity.iterdir()) == ["unity_0.c", "unity_1.c"]
+    assert (unity / "unity_0.c").read_text() == (
+        '#include "../../src/a1.c"\n#include "../../src/a2.c"\n#include "../../src/a3.c"\n'
+    )
+    assert (unity / "unity_1.c").read_text() == (
+        '#include "../../src/b1.c"\n#include "../../src/b2.c"\n'
+    )
+
+    mk = (root / "target" / "Makefile").read_text()
+    assert "target/obj/unity/%.o : target/unity/%.c\n" in mk
+    assert (
+        "target/obj/unity/unity_0.o : target/unity/unity_0.c "
+        "src/a1.c src/a2.c src/a3.c include/a.h\n"
+    ) in mk
+    assert "target/obj/solo.o : src/solo.c include/a.h\n" in mk
+    assert "target/obj/a1.o" not in mk
+    assert (
+        "target/liblib.a : target/obj/unity/unity_0.o "
+        "target/obj/unity/unity_1.o target/obj/solo.o\n"
+    ) in mk
+
+
+def test_shared_header_closures_become_make_variables(tmp_path):
+    root = tmp_path / "lib"
+    (root / "src").mkdir(parents=True)
+    (root / "include").mkdir(parents=True)
+    (root / "include" / "a.h").write_text('#include "b.h"\n')
+    (root / "include" / "b.h").write_text('#include "c.h"\n#include "d.h"\n')
+    (root / "include" / "c.h").write_text('#include "b.h"\n')
+    (root / "include" / "d.h").write_text("#pragma once\n")
+    for name in ["x", "y"]:
+        (root / "src" / f"{name}.c").write_text('#include "a.h"\n')
+
+    make_projects({
+        "lib": CProject(
+            str(root),
+            output_name="liblib.a",
+            output_type=CProject.OutputType.STATIC,
+        )
+    }, verbose=0)
+
+    mk = (root / "target" / "Makefile").read_text()
+    variables = {}
+    rules = {}
+    for line in mk.splitlines():
+        if " := " in line:
+            name, value = line.split(" := ")
+            variables[name] = value.split()
+        elif line.startswith("target/obj/") and " : " in line:
+            target, value = line.split(" : ")
+            rules[target] = value.split()
+
+    def expand(words):
+        for word in words:
+            if word.startswith("$("):
+                yield from expand(variables[word[2:-1]])
+            else:
+                yield word
+
+    closure = {"include/a.h", "include/b.h", "include/c.h", "include/d.h"}
+    assert rules["target/obj/x.o"][1:] == rules["target/obj/y.o"][1:]
+    assert len(rules["target/obj/x.o"]) == 3
+    assert set(expand(rules["target/obj/x.o"])) == {"src/x.c"} | closure
+
+
+def test_long_include_chain_does_not_recurse(tmp_path):
+    root = tmp_path / "lib"
+    (root / "src").mkdir(parents=True)
+    (root / "include").mkdir(parents=True)
+    n = 1500
+    for i in range(n):
+        (root / "include" / f"h{i}.h").write_text(f'#include "h{i + 1}.h"\n')
+    (root / "include" / f"h{n}.h").write_text("#pragma once\n")
+    (root / "src" / "x.c").write_text('#include "h0.h"\n')
+
+    make_projects({
+        "lib": CProject(
+            str(root),
+            output_name="liblib.a",
+            output_type=CProject.OutputType.STATIC,
+        )
+    }, verbose=0)
+
+    mk = (root / "target" / "Makefile").read_text()
+    assert f"include/h{n - 2}.h $(CLOSURE_0)\n" in mk
+    assert "target/obj/x.o : src/x.c include/h0.h $(CLOSURE_" in mk
+
+
+def test_incremental_and_thin_archives_track_members(tmp_path):
+    for mode in [CProject.ArchiveMode.INCREMENTAL, CProject.ArchiveMode.THIN]:
+        root = tmp_path / mode.name
+        (root / "src").mkdir(parents=True)
+        for name in ["a", "b"]:
+            (root / "src" / f"{name}.c").write_text(f"int {name}(void){{return 0;}}\n")
+
+        def generate():
+            make_projects({
+                "lib": CProject(
+                    str(root),
+                    output_name="liblib.a",
+                    output_type=CProject.OutputType.STATIC,
+                    archive_mode=mode,
+                )
+            }, verbose=0)
+            return (root / "target" / "Makefile").read_text()
+
+        mk = generate()
+        members = root / "target" / "liblib.a.members"
+        assert members.read_text() == "target/obj/a.o\ntarget/obj/b.o\n"
+        assert (
+            "target/liblib.a : target/obj/a.o target/obj/b.o "
+            "target/liblib.a.members\n"
+        ) in mk
+        if mode == CProject.ArchiveMode.INCREMENTAL:
+            assert "\t$(if $(filter %.members %.sig,$?),rm -f $@)\n" in mk
+            assert (
+                "-rcs $@ $(filter-out %.members %.sig,"
+                "$(if $(filter %.members %.sig,$?),$^,$?))\n"
+            ) in mk
+        else:
+            assert "\trm -f $@\n" in mk
+            assert "-rcsT $@ $(filter-out %.members %.sig,$^)\n" in mk
+
+        (root / "src" / "b.c").unlink()
+        generate()
+        assert members.read_text() == "target/obj/a.o\n"
+
+
+def test_flag_stamps_change_only_with_the_flags(tmp_path):
+    root = tmp_path / "lib"
+    (root / "src").mkdir(parents=True)
+    (root / "src" / "a.c").write_text("int a(void){return 0;}\n")
+
+    def generate(**kwargs):
+        make_projects({
+            "lib": CProject(
+                str(root),
+                output_name="liblib.a",
+                output_type=CProject.OutputType.STATIC,
+                **kwargs,
+            )
+        }, verbose=0)
+        return (root / "target" / "Makefile").read_text()
+
+    mk = generate()
+    stamp = root / "target" / "flags" / "compile.sig"
+    assert "target/obj/a.o : target/flags/compile.sig\n" in mk
+    assert "target/liblib.a : target/flags/link.sig\n" in mk
+    assert "-rcs $@ $(filter-out %.sig,$^)\n" in mk
+    assert stamp.read_text() == "gcc -Wall -O2 -DNDEBUG -DNTEST -Iinclude -Isrc/include\n"
+
+    os.utime(stamp, (0, 0))
+    generate()
+    assert stamp.stat().st_mtime == 0
+    generate(std="c99")
+    assert stamp.stat().st_mtime > 0
+    assert stamp.read_text().endswith(" -std=c99 -Iinclude -Isrc/include\n")
+
+
+def test_object_stamps_carry_per_object_flags(tmp_path):
+    root = tmp_path / "lib"
+    (root / "src").mkdir(parents=True)
+    (root / "include").mkdir(parents=True)
+    (root / "include" / "big.h").write_text("#pragma once\n")
+    for name in ["a", "b"]:
+        (root / "src" / f"{name}.c").write_text('#include "big.h"\n')
+    (root / "src" / "c.c").write_text("int c;\n")
+
+    make_projects({
+        "lib": CProject(
+            str(root),
+            output_name="liblib.a",
+            output_type=CProject.OutputType.STATIC,
+            pch=True,
+            object_stamps=True,
+        )
+    }, verbose=0)
+
+    mk = (root / "target" / "Makefile").read_text()
+    flags = root / "target" / "flags"
+    assert "target/obj/a.o : target/flags/obj/a.o.sig\n" in mk
+    assert "target/pch/pch.h.gch : target/flags/pch/pch.h.gch.sig\n" in mk
+    assert (flags / "obj" / "a.o.sig").read_text().endswith(
+        " -include target/pch/pch.h\n")
+    assert "-include" not in (flags / "obj" / "c.o.sig").read_text()
+    assert not (flags / "compile.sig").exists()
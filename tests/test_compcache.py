@@ -0,0 +1,73 @@
+import shutil
+
+import pytest
+
+from mkmake import make_projects
+from mkmake.compcache import CompileCache, Invocation, parse_size
+from mkmake.projects import CProject
+
+
+def test_parse_size():
+    assert parse_size("512") == 512
+    assert parse_size("2K") == 2048
+    assert parse_size("1.5G") == 3 << 29
+
+
+def test_invocation_splits_command():
+    inv = Invocation([
+        "gcc", "-Iinclude", "-include", "pch.h", "-ffile-prefix-map=/ws=.",
+        "-MMD", "-MP", "-c", "-o", "obj/x.o", "src/x.c",
+    ])
+    assert inv.cacheable()
+    assert inv.sources == ["src/x.c"]
+    assert inv.output == "obj/x.o"
+    assert inv.depfile == "obj/x.d"
+    assert inv.prefix_maps == [("/ws", ".")]
+    assert "-E" in inv.preprocess_args and "-c" not in inv.preprocess_args
+    assert not Invocation(["gcc", "-o", "app", "x.o"]).cacheable()
+
+
+@pytest.mark.skipif(shutil.which("gcc") is None, reason="gcc not available")
+def test_cache_hits_across_checkout_locations(tmp_path):
+    cache = CompileCache(str(tmp_path / "cache"), parse_size("1M"))
+    for checkout in ["a", "b"]:
+        root = tmp_path / checkout
+        (root / "include").mkdir(parents=True)
+        (root / "include" / "x.h").write_text("#define X __FILE__\n")
+        (root / "x.c").write_text(
+            '#include "x.h"\nconst char *x(void){return X;}\n')
+        ret = cache.compile([
+            "gcc", f"-I{root}/include", f"-ffile-prefix-map={root}=.",
+            "-MMD", "-c", "-o", str(root / "x.o"), str(root / "x.c"),
+        ])
+        assert ret == 0
+        assert (root / "x.o").exists()
+        assert f"{root}/include/x.h" in (root / "x.d").read_text()
+
+    assert (tmp_path / "a" / "x.o").read_bytes() == \
+        (tmp_path / "b" / "x.o").read_bytes()
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["entries"] == 1
+
+
+def test_compile_cache_wraps_compiler(tmp_path):
+    root = tmp_path / "generic"
+    (root / "src").mkdir(parents=True)
+    (root / "include").mkdir(parents=True)
+    (root / "src" / "x.c").write_text("int x(void){return 1;}\n")
+
+    p = CProject(
+        str(root),
+        output_name="libgeneric.a",
+        output_type=CProject.OutputType.STATIC,
+        compile_cache=str(tmp_path / "cache"),
+        compile_cache_size="1G",
+    )
+    make_projects({"generic": p}, cache=False, jobs=1, verbose=0)
+
+    mk = (root / "target" / "Makefile").read_text()
+    assert f"-m mkmake.compcache --dir {tmp_path / 'cache'} --max-size 1G" in mk
+    assert "CC=$(CCACHE) gcc" in mk
+    assert f"-ffile-prefix-map={root}=." in mk
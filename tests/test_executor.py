@@ -0,0 +1,189 @@
+import json
+import shutil
+from types import SimpleNamespace
+
+import pytest
+
+from mkmake import make_projects
+from mkmake.actions import PHONY, Action, ActionGraph, Rule
+from mkmake.cli import load_projects, main
+from mkmake.executor import Executor
+from mkmake.projects import TestProject
+
+STEP = Rule("step", "echo $out >> order.log && touch $out", "STEP $out")
+
+
+def make_graph(tmp_path, actions):
+    graph = ActionGraph()
+    for action in actions:
+        graph.add(action)
+    project = SimpleNamespace(
+        path_root=str(tmp_path), actions=graph, phony=lambda word: word)
+    return [("ws", project)]
+
+
+def chains():
+    # a -> b -> c is the long chain, x stands alone
+    return [
+        Action(STEP, ["a"]),
+        Action(STEP, ["b"], ["a"]),
+        Action(STEP, ["c"], ["b"]),
+        Action(STEP, ["x"]),
+        Action(PHONY, ["all"], ["c", "x"]),
+    ]
+
+
+def test_critical_path_runs_first(tmp_path):
+    target = tmp_path / "target"
+    target.mkdir()
+    seconds = {"a": 1.0, "b": 1.0, "c": 1.0, "x": 2.5}
+    (target / "build-log.json").write_text(json.dumps({
+        str(tmp_path / name): {"command": "", "seconds": value, "deps": []}
+        for name, value in seconds.items()
+    }))
+    executor = Executor(
+        make_graph(tmp_path, chains()), str(target), jobs=1, verbose=0)
+    result = executor.build(["all"])
+
+    assert result["ran"] == 4 and not result["failed"]
+    # a leads 3s of work, x only 2.5s
+    assert (tmp_path / "order.log").read_text().split() == ["a", "x", "b", "c"]
+    times = json.loads((target / "project-times.json").read_text())
+    assert times["ws"] > 0
+
+
+def test_up_to_date_actions_are_skipped(tmp_path):
+    target = str(tmp_path / "target")
+    Executor(make_graph(tmp_path, chains()), target, verbose=0).build(["all"])
+    result = Executor(
+        make_graph(tmp_path, chains()), target, verbose=0).build(["all"])
+    assert result["ran"] == 0 and result["up_to_date"] == 4
+
+    # a changed command reruns the action and what uses its output
+    actions = chains()
+    actions[1] = Action(STEP, ["b"], ["a"], variables={"extra": "1"})
+    actions[1].rule = Rule("step2", STEP.command + " # $extra", "STEP $out")
+    result = Executor(
+        make_graph(tmp_path, actions), target, verbose=0).build(["all"])
+    assert result["ran"] == 2
+
+    with pytest.raises(ValueError, match="Unknown target 'nope'"):
+        Executor(make_graph(tmp_path, chains()), target).build(["nope"])
+
+
+def test_actions_share_a_jobserver(tmp_path):
+    rule = Rule("env", "echo \"$$MAKEFLAGS\" > $out", "ENV $out")
+    executor = Executor(
+        make_graph(tmp_path, [Action(rule, ["flags"])]),
+        str(tmp_path / "target"), jobs=3, verbose=0)
+    executor.build(["flags"])
+    assert "-j3 --jobserver-auth=" in (tmp_path / "flags").read_text()
+
+
+def test_pools_bound_parallel_actions(tmp_path):
+    rule = Rule(
+        "slow", "echo start >> pool.log && sleep 0.1 && "
+        "echo end >> pool.log && touch $out", "SLOW $out", pool="link")
+    actions = [Action(rule, [name]) for name in "abc"]
+    actions.append(Action(PHONY, ["all"], list("abc")))
+    executor = Executor(
+        make_graph(tmp_path, actions), str(tmp_path / "target"),
+        jobs=4, pools={"link": 1}, verbose=0)
+    assert executor.build(["all"])["ran"] == 3
+    assert (tmp_path / "pool.log").read_text().split() == \
+        ["start", "end"] * 3
+
+
+def test_failed_action_stops_the_build(tmp_path):
+    fail = Rule("fail", "exit 3", "FAIL $out")
+    actions = [Action(fail, ["a"]), Action(STEP, ["b"], ["a"])]
+    result = Executor(
+        make_graph(tmp_path, actions), str(tmp_path / "target"),
+        verbose=0).build(["b"])
+    assert result["failed"] == [str(tmp_path / "a")]
+    assert not (tmp_path / "b").exists()
+
+
+@pytest.mark.skipif(
+    shutil.which("gcc") is None or shutil.which("bison") is None,
+    reason="gcc or bison not available")
+def test_make_projects_executes_build(tmp_path):
+    core = tmp_path / "core"
+    parser = tmp_path / "parser"
+    tests = tmp_path / "tests"
+    for root in [core, parser, tests]:
+        (root / "src").mkdir(parents=True)
+        (root / "include").mkdir(parents=True)
+    (core / "include" / "core.h").write_text("int core(void);\n")
+    (core / "src" / "core.c").write_text(
+        '#include "core.h"\nint core(void){return 0;}\n')
+    (parser / "src" / "yy").mkdir()
+    (parser / "src" / "yy" / "calc.y").write_text(
+        "%{\nint yylex(void);\nvoid yyerror(const char *s);\n%}\n"
+        "%%\nstart: ;\n%%\n")
+    (parser / "src" / "parse.c").write_text('#include "calc.tab.h"\n')
+    (tests / "src" / "main.c").write_text(
+        '#include "core.h"\nint main(void){return core();}\n')
+    script = tmp_path / "workspace.py"
+    script.write_text(
+        "from mkmake.projects import CProject, TestProject, YYProject\n"
+        f"ROOT = {str(tmp_path)!r}\n"
+        "projects = {\n"
+        "    'core': CProject(ROOT + '/core', output_name='libcore.a',\n"
+        "        output_type=CProject.OutputType.STATIC),\n"
+        "    'parser': YYProject(ROOT + '/parser', output_name='libparser.a',\n"
+        "        output_type=CProject.OutputType.STATIC, depends=['core']),\n"
+        "    'tests': TestProject(ROOT + '/tests', test_command='target/test',\n"
+        "        depends=['core']),\n"
+        "}\n")
+
+    def workspace():
+        return load_projects(str(script))
+
+    report = make_projects(
+        workspace(), execute=["all", "test"], verbose=0, jobs=2)
+    assert not report["build"]["failed"]
+    assert (parser / "target" / "libparser.a").exists()
+    assert (tests / "target" / "test").exists()
+    assert (core / "target" / "Makefile").exists()
+
+    report = make_projects(workspace(), execute=True, verbose=0, jobs=2)
+    assert report["build"]["ran"] == 0
+
+    (core / "src" / "core.c").write_text("int core(void){return 0}\n")
+    assert main(["build", str(script), "-q", "--flat"]) == 1
+
+
+@pytest.mark.skipif(shutil.which("gcc") is None, reason="gcc not available")
+def test_executed_variants_reuse_the_plan_and_time_apart(tmp_path):
+    root = tmp_path / "app"
+    (root / "src").mkdir(parents=True)
+    (root / "include").mkdir(parents=True)
+    (root / "include" / "app.h").write_text("int f(void);\n")
+    (root / "src" / "main.c").write_text(
+        '#include "app.h"\nint main(void){return f();}\n')
+    (root / "src" / "f.c").write_text(
+        '#include "app.h"\nint f(void){return 0;}\n')
+    planned = []
+
+    class Counted(TestProject):
+        def plan_units(self):
+            planned.append(self.variant)
+            return super().plan_units()
+
+    app = Counted(
+        str(root), test_command="sleep 0.3", unity=True, unity_batch_size=2)
+    report = make_projects(
+        {"app": app}, execute=["all", "test"], verbose=0, jobs=2,
+        variants={"debug": {"debug": True}, "release": {}})
+
+    # the actions come from the plan the Makefiles were written with
+    assert planned == ["debug", "release"]
+    assert set(report["build"]) == {"debug", "release"}
+    assert report["build"]["release"]["ran"] > 0
+    # generation is timed without the build
+    assert report["total_seconds"] < 0.3 <= report["build"]["debug"]["seconds"]
+    times = json.loads((root / "target" / "project-times.json").read_text())
+    debug = report["build"]["debug"]["projects"]["app"]
+    release = report["build"]["release"]["projects"]["app"]
+    assert times["app"] == pytest.approx((debug + release) / 2, abs=1e-5)
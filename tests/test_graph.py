@@ -0,0 +1,36 @@
+from mkmake.graph import transitive_closure
+
+
+def test_closure_follows_includes_in_order():
+    edges = {"a.c": ["x.h", "y.h"], "x.h": ["z.h"], "y.h": ["z.h"], "z.h": []}
+    deps = transitive_closure(["a.c"], edges)
+    assert deps["a.c"] == ["x.h", "z.h", "y.h"]
+
+
+def test_closure_of_cycle_is_independent_of_root_order():
+    edges = {"a.c": ["a.h"], "b.c": ["b.h"], "a.h": ["b.h"], "b.h": ["a.h", "c.h"]}
+    forward = transitive_closure(["a.c", "b.c"], edges)
+    backward = transitive_closure(["b.c", "a.c"], edges)
+    assert forward == backward
+    assert forward["a.c"] == ["a.h", "b.h", "c.h"]
+    assert transitive_closure(["a.h"], edges)["a.h"] == ["b.h", "a.h", "c.h"]
+
+
+def test_self_include_is_part_of_closure():
+    assert transitive_closure(["x.h"], {"x.h": ["x.h"]})["x.h"] == ["x.h"]
+    assert transitive_closure(["x.h"], {"x.h": []})["x.h"] == []
+
+
+def test_memo_is_shared_and_not_traversed():
+    edges = {"a.c": ["dep.h"], "dep.h": ["never.h"]}
+    memo = {"dep.h": ["other.h"]}
+    deps = transitive_closure(["a.c"], edges, memo)
+    assert deps["a.c"] == ["dep.h", "other.h"]
+    assert memo["a.c"] is deps["a.c"]
+
+
+def test_deep_chain_does_not_recurse():
+    n = 100000
+    edges = {i: [i + 1] for i in range(n)}
+    deps = transitive_closure([n - 3, n - 2], edges)
+    assert deps[n - 3] == [n - 2, n - 1, n]
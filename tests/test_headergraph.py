@@ -0,0 +1,72 @@
+from mkmake import make_projects
+from mkmake.headergraph import HeaderGraph, LayeredView
+from mkmake.projects import CProject
+
+
+def test_cycle_members_share_one_closure():
+    graph = HeaderGraph()
+    cycle = ["x.h", "y.h"]
+    graph.store(graph.layer("own"), {"x.h": cycle, "y.h": cycle})
+    view = LayeredView([(graph, ("own", "closures"))])
+    assert view["x.h"] == ("x.h", "y.h")
+    assert view["x.h"] is view["y.h"]
+
+
+def test_views_shadow_in_layer_order():
+    graph = HeaderGraph()
+    own = graph.publish(("own", "exports"), {"x.h": "own/x.h"})
+    dep = graph.publish(("dep", "exports"), {"x.h": "dep/x.h", "y.h": "dep/y.h"})
+    other = HeaderGraph()
+    foreign = other.publish(("far", "exports"), {"y.h": "far/y.h", "z.h": "far/z.h"})
+
+    view = LayeredView([(graph, own), (other, foreign), (graph, dep)])
+    assert view["x.h"] == "own/x.h"
+    assert view["y.h"] == "far/y.h"
+    assert view["z.h"] == "far/z.h"
+    assert "w.h" not in view
+    assert list(view) == ["x.h", "y.h", "z.h"]
+    assert dict(view.items())["y.h"] == "far/y.h"
+
+    assert len(view) == 3
+    graph.publish(("dep", "exports"), {"w.h": "dep/w.h"})
+    assert len(view) == 4
+
+
+def test_relayer_replaces_closures_seen_by_views():
+    graph = HeaderGraph()
+    dep = graph.layer("dep")
+    graph.store(dep, {"d.h": ["e.h"]})
+    view = LayeredView([(graph, graph.layer("app")), (graph, dep)])
+    assert view["d.h"] == ("e.h",)
+
+    dep = graph.layer("dep")
+    assert "d.h" not in view
+    graph.store(dep, {"d.h": ["f.h"]})
+    assert view["d.h"] == ("f.h",)
+
+
+def test_dependents_share_dependency_tables(tmp_path):
+    names = ["base", "mid", "app"]
+    projects = {}
+    for i, name in enumerate(names):
+        (tmp_path / name / "src").mkdir(parents=True)
+        (tmp_path / name / "include").mkdir()
+        (tmp_path / name / "include" / f"{name}.h").write_text(
+            "".join(f'#include "{dep}.h"\n' for dep in names[:i]))
+        (tmp_path / name / "src" / f"{name}.c").write_text(
+            f'#include "{name}.h"\n')
+        projects[name] = CProject(
+            str(tmp_path / name), depends=names[:i],
+            output_name=f"lib{name}.a",
+            output_type=CProject.OutputType.STATIC)
+
+    make_projects(projects, verbose=0, jobs=1, cache=False)
+    base, app = projects["base"], projects["app"]
+    assert app.graph is base.graph
+    assert base.graph.tables[base.closures] is app.graph.tables[base.closures]
+    assert app.deps["app.c"] == ("app.h", "base.h", "mid.h")
+    assert app.all_deps["base.h"] == base.exports["base.h"]
+
+    mk = (tmp_path / "app" / "target" / "Makefile").read_text()
+    assert "base/target/include/base.h" in mk
+    assert "mid/target/include/mid.h" in mk
@@ -235,3 +235,211 @@ def test_duplicate_dependency_header_keeps_transitive_mapping_consistent(tmp_pat
     assert f"{(dep1 / 'target' / 'include' / 'x.h').as_posix()}" in mk
     assert f"{(dep1 / 'target' / 'include' / 'dep1_only.h').as_posix()}" in mk
     assert f"{(dep2 / 'target' / 'include' / 'dep2_only.h').as_posix()}" not in mk
+
+
+def test_parallel_generation_matches_serial_output(tmp_path):
+    names = ["base", "left", "right", "top"]
+    depends = {"base": [], "left": ["base"], "right": ["base"], "top": ["base", "left", "right"]}
+    for name in names:
+        root = tmp_path / name
+        (root / "src" / "sub").mkdir(parents=True)
+        (root / "include").mkdir(parents=True)
+        (root / "include" / f"{name}.h").write_text(
+            "#pragma once\n" + "".join(f'#include "{dep}.h"\n' for dep in depends[name])
+        )
+        for i in range(8):
+            (root / "src" / "sub" / f"f{i}.c").write_text(
+                f'#include "{name}.h"\nint f{i}(void){{return {i};}}\n'
+            )
+
+    def build(jobs):
+        projects = {
+            name: CProject(
+                str(tmp_path / name),
+                output_name=f"lib{name}.a",
+                output_type=CProject.OutputType.STATIC,
+                depends=depends[name],
+            )
+            for name in names
+        }
+        make_projects(projects, jobs=jobs)
+        files = [tmp_path / name / "target" / "Makefile" for name in names]
+        files.append(tmp_path / "target" / "Projects.mk")
+        return [f.read_bytes() for f in files]
+
+    assert build(1) == build(4)
+
+
+def test_non_recursive_mode_writes_namespaced_workspace_makefile(tmp_path):
+    gen = tmp_path / "gen"
+    app = tmp_path / "app"
+    for root in [gen, app]:
+        (root / "src").mkdir(parents=True)
+        (root / "include").mkdir(parents=True)
+    (gen / "include" / "gen.h").write_text("#pragma once\nint gen(void);\n")
+    (gen / "src" / "gen.c").write_text('#include "gen.h"\nint gen(void){return 0;}\n')
+    (app / "src" / "main.c").write_text('#include "gen.h"\nint main(void){return gen();}\n')
+
+    projects = {
+        "gen": CProject(
+            str(gen),
+            output_name="libgen.a",
+            output_type=CProject.OutputType.STATIC,
+        ),
+        "app": CProject(
+            str(app),
+            output_name="app",
+            output_type=CProject.OutputType.BINARY,
+            depends=["gen"],
+        ),
+    }
+    make_projects(projects, recursive=False)
+
+    workspace = (tmp_path / "target" / "Workspace.mk").read_text()
+    assert "include gen/target/Project.mk\n" in workspace
+    assert "include app/target/Project.mk\n" in workspace
+    assert "all-all : all-gen all-app" in workspace
+    assert not (tmp_path / "target" / "Projects.mk").exists()
+
+    mk = (app / "target" / "Project.mk").read_text()
+    assert "app_CFLAGS=" in mk
+    assert "-Igen/target/include" in mk
+    assert "$(app_CC) -c $(app_CFLAGS) -o $@ $<" in mk
+    assert "app/target/obj/main.o : app/src/main.c gen/target/include/gen.h" in mk
+    assert "app/target/app : app/target/obj/main.o gen/target/libgen.a" in mk
+    assert "all-app : app/target/app headers-app" in mk
+    assert "default : all" not in mk
+
+
+def test_make_projects_returns_phase_report(tmp_path, capsys):
+    root = tmp_path / "a"
+    (root / "src").mkdir(parents=True)
+    (root / "include").mkdir(parents=True)
+    (root / "src" / "x.c").write_text('#include "x.h"\n')
+    (root / "src" / "y.c").write_text("int y;\n")
+    (root / "include" / "x.h").write_text("#pragma once\n")
+
+    projects = {
+        "a": CProject(
+            str(root),
+            output_name="liba.a",
+            output_type=CProject.OutputType.STATIC,
+        ),
+    }
+    report = make_projects(projects, verbose=0, trace_memory=True)
+
+    assert capsys.readouterr().out == ""
+    phases = report["projects"]["a"]
+    assert set(phases) == {"scan_sources", "inject_depends", "scan_deps", "write_makefile"}
+    assert phases["scan_sources"]["files"] == 3
+    assert phases["write_makefile"]["files"] == 2
+    assert all(phase["seconds"] >= 0 for phase in phases.values())
+    assert report["cache"] == {"hits": 0, "misses": 3}
+    assert report["peak_memory"] > 0
+    assert report["total_seconds"] >= report["phases"]["scan_deps"]
+
+
+def _export_workspace(tmp_path, headers, **kwargs):
+    projects = {}
+    depends = []
+    for name, header in headers:
+        root = tmp_path / name
+        (root / "src").mkdir(parents=True)
+        (root / "include").mkdir(parents=True)
+        (root / "src" / f"{name}.c").write_text("".join(
+            f'#include "{h}"\n' for _, h in headers[:len(depends) + 1]))
+        (root / "include" / header).write_text("#pragma once\n")
+        projects[name] = CProject(
+            str(root),
+            output_name=f"lib{name}.a",
+            output_type=CProject.OutputType.STATIC,
+            depends=list(depends),
+            **kwargs,
+        )
+        depends.append(name)
+    return projects
+
+
+def test_merged_exports_share_one_include_tree(tmp_path):
+    projects = _export_workspace(
+        tmp_path, [("a", "a.h"), ("b", "b.h"), ("c", "c.h")],
+        export_mode=CProject.ExportMode.MERGED,
+    )
+    make_projects(projects, verbose=0)
+
+    mk = (tmp_path / "c" / "target" / "Makefile").read_text()
+    cflags = next(line for line in mk.splitlines() if line.startswith("CFLAGS="))
+    assert cflags.count("-I") == 3
+    assert f"-I{tmp_path}/target/include" in cflags
+    assert f"{tmp_path}/target/include/a.h" in mk
+    assert (
+        f"{tmp_path}/target/include/c.h : {tmp_path}/target/include/%.h : "
+        "include/%.h\n"
+    ) in mk
+    assert f"rm -fr {tmp_path}/c/target/obj {tmp_path}/target/include/c.h " in mk
+
+
+def test_merged_exports_report_conflicting_headers(tmp_path):
+    projects = _export_workspace(
+        tmp_path, [("a", "x.h"), ("b", "x.h")],
+        export_mode=CProject.ExportMode.MERGED,
+    )
+    with pytest.raises(ValueError, match="'x.h' of projects 'a' and 'b'"):
+        make_projects(projects, verbose=0)
+
+
+def test_link_export_modes(tmp_path):
+    for mode, command in [
+        (CProject.ExportMode.HARDLINK, "\tln -f $< $@"),
+        (CProject.ExportMode.SYMLINK, "\tln -sf $(abspath $<) $@\n"),
+    ]:
+        root = tmp_path / mode.name
+        projects = _export_workspace(root, [("a", "a.h")], export_mode=mode)
+        make_projects(projects, verbose=0)
+        mk = (root / "a" / "target" / "Makefile").read_text()
+        assert "target/include/%.h : include/%.h\n" in mk
+        assert command in mk
+
+
+def test_variants_share_one_scan_and_get_their_own_trees(tmp_path):
+    projects = _export_workspace(tmp_path, [("a", "a.h"), ("b", "b.h")])
+    report = make_projects(projects, verbose=0, variants={
+        "debug": {"debug": True},
+        "release": {},
+    })
+
+    assert set(report["projects"]) == {
+        "a", "b", "debug/a", "debug/b", "release/a", "release/b"}
+    assert set(report["projects"]["a"]) == {"scan_sources"}
+    assert "scan_deps" in report["projects"]["debug/b"]
+    assert "scan_deps" not in report["projects"]["release/b"]
+
+    debug = (tmp_path / "b" / "target" / "debug" / "Makefile").read_text()
+    release = (tmp_path / "b" / "target" / "release" / "Makefile").read_text()
+    assert "-g -O0" in debug
+    assert "-O2 -DNDEBUG" in release
+    assert "target/debug/obj/b.o : src/b.c" in debug
+    assert f"{tmp_path}/a/target/release/include/a.h" in release
+    for variant in ["debug", "release"]:
+        meta = (tmp_path / "target" / variant / "Projects.mk").read_text()
+        assert f"-f {tmp_path}/b/target/{variant}/Makefile\n" in meta
+    assert not (tmp_path / "b" / "target" / "Makefile").exists()
+
+
+def test_variants_changing_scan_settings_are_rescanned(tmp_path):
+    projects = _export_workspace(tmp_path, [("a", "a.h"), ("b", "b.h")])
+    (tmp_path / "b" / "src" / "skip.c").write_text('#include "b.h"\n')
+    report = make_projects(projects, verbose=0, jobs=1, variants={
+        "dev": {"compiler_deps": True, "exclude": ["skip.c"]},
+        "release": {},
+    })
+
+    dev = (tmp_path / "b" / "target" / "dev" / "Makefile").read_text()
+    release = (tmp_path / "b" / "target" / "release" / "Makefile").read_text()
+    assert "target/dev/obj/b.o : src/b.c\n" in dev
+    assert "skip.c" not in dev
+    # release is scanned again: header prerequisites and excluded files
+    assert "target/release/obj/b.o : src/b.c /" in release
+    assert "target/release/obj/skip.o : src/skip.c include/b.h\n" in release
+    assert "scan_sources" in report["projects"]["release/b"]
+    assert "scan_deps" in report["projects"]["release/b"]
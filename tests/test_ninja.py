@@ -0,0 +1,77 @@
+import shutil
+import subprocess
+
+import pytest
+
+from mkmake import make_projects
+from mkmake.actions import Action, Rule
+from mkmake.watch import CREATED, Watch
+
+
+PROJECTS = ("core", "parser", "tests")
+
+
+def test_action_expands_ninja_variables():
+    rule = Rule("cc", "$cc ${flags} -c $in -o $out.tmp && echo $$HOME", "CC")
+    action = Action(rule, ["a.o"], ["a.c"], variables={"flags": "${ns_FLAGS}"})
+    assert action.command({"cc": "gcc", "ns_FLAGS": "-O2"}) == \
+        "gcc -O2 -c a.c -o a.o.tmp && echo $HOME"
+
+
+def test_ninja_backend_writes_one_build_file(tmp_path, workspace):
+    make_projects(
+        workspace(*PROJECTS), backend="ninja", pools={"link": 1},
+        verbose=0, jobs=1)
+    assert not (tmp_path / "core" / "target" / "Makefile").exists()
+    ninja = (tmp_path / "target" / "build.ninja").read_text()
+
+    assert "builddir = target\n" in ninja
+    assert "pool link\n  depth = 1\n" in ninja
+    assert "pool generate\n  depth = 2\n" in ninja
+    assert "  depfile = $out.d\n  deps = gcc\n" in ninja
+    assert "core_CFLAGS = -Wall -O2 -DNDEBUG -DNTEST -Icore/include" in ninja
+    # compiles wait for dependency exports and generated headers
+    assert "build headers-parser: phony headers-core\n" in ninja
+    assert (
+        "build parser/target/obj/parse.o: cc parser/src/parse.c"
+        " || headers-parser parser/target/generated-src/grammar.tab.h\n"
+    ) in ninja
+    # unchanged generated headers keep their mtime
+    yacc = ninja[ninja.index("rule yacc"):]
+    assert "  pool = generate\n  restat = 1\n" in yacc
+    assert (
+        "build parser/target/generated-src/grammar.tab.c "
+        "parser/target/generated-src/grammar.tab.h: yacc parser/src/yy/grammar.y\n"
+    ) in ninja
+    assert "build tests/target/test: ld tests/target/obj/test.o" \
+        " | core/target/libcore.a\n" in ninja
+    assert "build test-tests: test | all-tests tests/run.py\n" in ninja
+    assert "build all: phony all-core all-parser all-tests\n" in ninja
+    assert "default all\n" in ninja
+
+
+def test_unknown_backend_is_rejected(tmp_path, workspace):
+    with pytest.raises(ValueError, match="Unknown backend 'scons'"):
+        make_projects(workspace(*PROJECTS), backend="scons", verbose=0)
+
+
+@pytest.mark.skipif(shutil.which("ninja") is None, reason="ninja not available")
+def test_ninja_accepts_build_file(tmp_path, workspace):
+    make_projects(workspace(*PROJECTS), backend="ninja", verbose=0)
+    ret = subprocess.run(
+        ["ninja", "-f", "target/build.ninja", "-n", "all"],
+        cwd=tmp_path, stdout=subprocess.PIPE, universal_newlines=True)
+    assert ret.returncode == 0
+    assert "LD tests/target/test" in ret.stdout
+
+
+def test_watch_rewrites_build_file(tmp_path, workspace):
+    watch = Watch(workspace(*PROJECTS), backend="ninja", verbose=0, jobs=1)
+    watch.start()
+    extra = tmp_path / "core" / "src" / "extra.c"
+    extra.write_text('#include "core.h"\n')
+    regenerated, _ = watch.handle([(str(extra), CREATED)])
+    assert "core" in regenerated
+    ninja = (tmp_path / "target" / "build.ninja").read_text()
+    assert "build core/target/obj/extra.o: cc core/src/extra.c" in ninja
+    assert "build test-tests: test" in ninja
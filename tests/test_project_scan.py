@@ -0,0 +1,62 @@
+import itertools
+import os.path as path
+from glob import glob
+
+from mkmake.projects import CProject, YYProject
+
+
+def glob_files(prefixes, suffixes):
+    ret = {}
+    for prefix, suffix in itertools.product(prefixes, suffixes):
+        paths = glob(f"{prefix}/**/*.{suffix}", recursive=True)
+        ret.update((path.relpath(p, prefix), p) for p in paths)
+    return ret
+
+
+def make_tree(root):
+    files = [
+        "src/a.c", "src/deep/er/b.c", "src/include/a.h", "src/include/sub/b.h",
+        "src/include/odd.c", "src/yy/lexer.l", "src/yy/parser.y", "src/yy/util.c",
+        "src/.hidden/c.c", "src/.d.c", "include/x.h", "include/nested/y.h",
+        "include/skip.c", "src/vendor/v.c", "src/vendor/v.h", "tests/t.c",
+        "target/generated-src/parser.tab.c",
+    ]
+    for file in files:
+        (root / file).parent.mkdir(parents=True, exist_ok=True)
+        (root / file).write_text("\n")
+
+
+def test_single_pass_scan_matches_glob(tmp_path):
+    root = tmp_path / "parser"
+    make_tree(root)
+
+    p = YYProject(
+        str(root),
+        output_name="libparser.a",
+        output_type=CProject.OutputType.STATIC,
+    )
+    p.scan_sources()
+
+    assert p.sources == glob_files([p.source_path], ["c"])
+    assert p.headers == glob_files([p.include_path], ["h"])
+    assert p.internals == glob_files([p.internal_path], ["h"])
+    assert p.lex_files == glob_files([p.grammar_path], ["l"])
+    assert p.yy_files == glob_files([p.grammar_path], ["y"])
+    assert p.scan_files([p.source_path, p.include_path], ["c", "h"]) == glob_files(
+        [p.source_path, p.include_path], ["c", "h"]
+    )
+
+
+def test_scan_skips_excluded_paths(tmp_path):
+    root = tmp_path / "generic"
+    make_tree(root)
+
+    p = CProject(
+        str(root),
+        output_name="libgeneric.a",
+        output_type=CProject.OutputType.STATIC,
+        exclude=["src/vendor", "er"],
+    )
+    p.scan_sources()
+
+    assert sorted(p.sources) == ["a.c", "include/odd.c", "yy/util.c"]
@@ -0,0 +1,108 @@
+import json
+
+from mkmake import make_projects
+from mkmake.cli import main
+from mkmake.query import affected, write_affected_makefile
+
+
+def _objects(result):
+    return {
+        name: sorted(obj.rsplit("/obj/", 1)[1] for obj in objs)
+        for name, objs in result.objects.items()
+    }
+
+
+def test_private_header_affects_owner_and_tests(tmp_path, workspace):
+    projects = workspace()
+    make_projects(projects, verbose=0, jobs=1)
+    result = affected(projects, [
+        str(tmp_path / "core" / "src" / "include" / "core_priv.h")])
+    assert _objects(result) == {"core": ["core.o"], "tests": ["test.o"]}
+    assert result.libraries == [str(tmp_path / "core" / "target" / "libcore.a")]
+    # app and parser link or archive against core, they are retested
+    assert result.projects == ["core", "parser", "app", "tests"]
+    assert result.tests == ["tests"]
+
+
+def test_exported_header_reaches_dependents(tmp_path, workspace):
+    projects = workspace()
+    make_projects(projects, verbose=0, jobs=1)
+    result = affected(projects, [str(tmp_path / "core" / "include" / "util.h")])
+    assert _objects(result) == {"core": ["util.o"], "app": ["main.o"]}
+
+    result = affected(projects, [str(tmp_path / "core" / "include" / "core.h")])
+    assert _objects(result) == {
+        "core": ["core.o"], "parser": ["generated/grammar.tab.o"],
+        "tests": ["test.o"],
+    }
+
+
+def test_grammar_maps_to_generated_sources_and_headers(tmp_path, workspace):
+    projects = workspace()
+    make_projects(projects, verbose=0, jobs=1)
+    result = affected(projects, [
+        str(tmp_path / "parser" / "src" / "yy" / "grammar.y")])
+    assert _objects(result) == {
+        "parser": ["generated/grammar.tab.o", "parse.o"]}
+    assert result.libraries == [
+        str(tmp_path / "parser" / "target" / "libparser.a")]
+    assert result.projects == ["parser", "app"]
+    assert result.tests == []
+
+
+def test_test_files_and_unrelated_files(tmp_path, workspace):
+    projects = workspace()
+    make_projects(projects, verbose=0, jobs=1)
+    result = affected(projects, [str(tmp_path / "tests" / "run.py")])
+    assert result.objects == {} and result.projects == ["tests"]
+    assert affected(projects, [str(tmp_path / "README.md")]).projects == []
+
+    # a deleted source still relinks its project
+    result = affected(projects, [str(tmp_path / "app" / "src" / "gone.c")])
+    assert result.objects == {} and result.projects == ["app"]
+
+
+def test_affected_makefile_keeps_needed_dependencies(tmp_path, workspace):
+    projects = workspace()
+    make_projects(projects, verbose=0, jobs=1)
+    result = affected(projects, [str(tmp_path / "tests" / "run.py")])
+    meta = tmp_path / "target" / "Affected.mk"
+    assert write_affected_makefile(projects, result, str(meta)) == [
+        "core", "tests"]
+    mk = meta.read_text()
+    assert "tests : core" in mk
+    assert "test-tests :" in mk
+    assert "parser" not in mk and "app" not in mk
+
+
+def test_cli_affected_reads_stdin(tmp_path, workspace, monkeypatch, capsys):
+    workspace("core")
+    script = tmp_path / "workspace.py"
+    script.write_text(
+        "from mkmake.projects import CProject\n"
+        f"projects = {{'core': CProject({str(tmp_path / 'core')!r}, "
+        "output_name='libcore.a', output_type=CProject.OutputType.STATIC)}\n")
+    monkeypatch.setattr("sys.stdin", [
+        str(tmp_path / "core" / "src" / "util.c") + "\n"])
+    meta = tmp_path / "target" / "Affected.mk"
+    assert main(["affected", str(script), "-", "--makefile", str(meta)]) == 0
+    result = json.loads(capsys.readouterr().out)
+    assert result["projects"] == ["core"]
+    assert result["objects"]["core"][0].endswith("core/target/obj/util.o")
+    assert "core :" in meta.read_text()
+
+
+def test_cli_affected_only_scans(tmp_path, workspace, capsys):
+    workspace("core")
+    core = tmp_path / "core"
+    script = tmp_path / "workspace.py"
+    script.write_text(
+        "from mkmake.projects import CProject\n"
+        f"projects = {{'core': CProject({str(core)!r}, "
+        "output_name='libcore.a', output_type=CProject.OutputType.STATIC)}\n")
+    assert main([
+        "affected", str(script), str(core / "include" / "core.h")]) == 0
+    result = json.loads(capsys.readouterr().out)
+    assert result["objects"]["core"][0].endswith("core/target/obj/core.o")
+    assert not (core / "target" / "Makefile").exists()
+    assert not (tmp_path / "target" / "Projects.mk").exists()
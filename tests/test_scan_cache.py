@@ -0,0 +1,82 @@
+import json
+import os
+
+from mkmake import make_projects
+from mkmake.projects import CProject
+from mkmake.scancache import ScanCache
+
+
+def write_project(root):
+    (root / "src").mkdir(parents=True)
+    (root / "include").mkdir(parents=True)
+    (root / "src" / "x.c").write_text('#include "x.h"\nint x(void){return 1;}\n')
+    (root / "src" / "y.c").write_text('#include "x.h"\nint y(void){return 2;}\n')
+    (root / "include" / "x.h").write_text("#pragma once\n")
+
+
+def make_project(root):
+    return CProject(
+        str(root),
+        output_name="libgeneric.a",
+        output_type=CProject.OutputType.STATIC,
+    )
+
+
+def test_scan_cache_only_rescans_changed_files(tmp_path):
+    root = tmp_path / "generic"
+    write_project(root)
+
+    p = make_project(root)
+    make_projects({"generic": p})
+    assert p.scan_cache.stats() == {"hits": 0, "misses": 3}
+
+    p = make_project(root)
+    make_projects({"generic": p})
+    assert p.scan_cache.stats() == {"hits": 3, "misses": 0}
+
+    source = root / "src" / "y.c"
+    source.write_text('#include "x.h"\n#include "z.h"\nint y(void){return 3;}\n')
+    st = source.stat()
+    os.utime(source, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+
+    p = make_project(root)
+    make_projects({"generic": p})
+    assert p.scan_cache.stats() == {"hits": 2, "misses": 1}
+
+    mk = (root / "target" / "Makefile").read_text()
+    assert "target/obj/y.o : src/y.c include/x.h" in mk
+
+
+def test_scan_cache_is_dropped_on_signature_change(tmp_path):
+    source = tmp_path / "x.c"
+    source.write_text('#include "x.h"\n')
+    cache_path = str(tmp_path / "target" / "scan-cache.json")
+
+    calls = []
+
+    def scanner(name):
+        calls.append(name)
+        return ["x.h"]
+
+    cache = ScanCache(cache_path, "re-1")
+    assert cache.get(str(source), scanner) == ["x.h"]
+    cache.save()
+
+    cache = ScanCache(cache_path, "re-1")
+    assert cache.get(str(source), scanner) == ["x.h"]
+    assert len(calls) == 1
+
+    cache = ScanCache(cache_path, "re-2")
+    assert cache.get(str(source), scanner) == ["x.h"]
+    assert len(calls) == 2
+
+
+def test_scan_cache_ignores_corrupt_file(tmp_path):
+    cache_path = tmp_path / "scan-cache.json"
+    cache_path.write_text("{not json")
+    cache = ScanCache(str(cache_path), "re")
+    assert cache.entries == {}
+
+    cache_path.write_text(json.dumps({"header": {}, "entries": {"a": []}}))
+    cache = ScanCache(str(cache_path), "re")
+    assert cache.entries == {}
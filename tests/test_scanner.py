@@ -0,0 +1,79 @@
+from mkmake.scanner import MMAP_THRESHOLD, scan_buffer, scan_includes
+
+
+def test_scan_buffer_handles_spacing_and_comments():
+    text = (
+        b'#include "a.h"\n'
+        b'  #  include   "b.h" // "not.h"\n'
+        b'#include <stdio.h>\n'
+        b'// #include "commented.h"\n'
+        b'#define X "x.h"\n'
+    )
+    assert scan_buffer(text) == ["a.h", "b.h"]
+
+
+def test_scan_includes_crlf_and_invalid_utf8(tmp_path):
+    source = tmp_path / "x.c"
+    source.write_bytes(
+        b'#include "a.h"\r\n'
+        b'const char *s = "\xff\xfe";\r\n'
+        b'#include "b.h"\r\n'
+    )
+    assert scan_includes(str(source)) == ["a.h", "b.h"]
+
+    empty = tmp_path / "empty.c"
+    empty.write_bytes(b"")
+    assert scan_includes(str(empty)) == []
+
+
+def test_scan_includes_maps_large_files(tmp_path):
+    source = tmp_path / "big.c"
+    body = b"int x;\n" * (MMAP_THRESHOLD // 7 + 1)
+    source.write_bytes(b'#include "a.h"\n' + body + b'#include "late.h"\n')
+    assert scan_includes(str(source)) == ["a.h", "late.h"]
+    assert scan_includes(str(source), preamble_lines=50) == ["a.h"]
+
+
+def test_preamble_mode_stops_after_directive_free_lines():
+    text = (
+        b"/* license\n * text\n */\n"
+        b'#include "a.h"\n'
+        b"#ifndef X\n"
+        b"\n"
+        b'#include "b.h"\n'
+        b"#endif\n"
+        b"int a;\nint b;\nint c;\nint d;\n"
+        b'#include "c.h"\n'
+    )
+    assert scan_buffer(text, preamble_lines=3) == ["a.h", "b.h"]
+    assert scan_buffer(text, preamble_lines=2) == []
+    assert scan_buffer(text) == ["a.h", "b.h", "c.h"]
+
+
+def test_make_projects_scan_preamble_lines(tmp_path):
+    from mkmake import make_projects
+    from mkmake.projects import CProject
+
+    root = tmp_path / "p"
+    (root / "src").mkdir(parents=True)
+    (root / "include").mkdir(parents=True)
+    (root / "include" / "a.h").write_text("#pragma once\n")
+    (root / "include" / "late.h").write_text("#pragma once\n")
+    (root / "src" / "x.c").write_text(
+        '#include "a.h"\n' + "int x;\n" * 20 + '#include "late.h"\n')
+    proj = CProject(
+        str(root),
+        output_name="libp.a",
+        output_type=CProject.OutputType.STATIC,
+    )
+
+    def object_rule():
+        mk = (root / "target" / "Makefile").read_text()
+        return next(line for line in mk.splitlines()
+                    if line.startswith("target/obj/x.o :"))
+
+    make_projects({"p": proj}, verbose=0)
+    assert "include/late.h" in object_rule()
+    make_projects({"p": proj}, verbose=0, scan_preamble_lines=10)
+    assert "include/a.h" in object_rule()
+    assert "include/late.h" not in object_rule()
@@ -0,0 +1,104 @@
+import json
+import shutil
+import subprocess
+
+import pytest
+
+from mkmake import Schedule, make_projects
+from mkmake.projects import CProject
+
+
+class Node(object):
+    def __init__(self, *depends):
+        self.depends = list(depends)
+
+
+def test_levels_and_critical_path_priority():
+    projects = {
+        "base": Node(),
+        "small": Node("base"),
+        "big": Node("base"),
+        "app": Node("big"),
+        "tool": Node(),
+    }
+    schedule = Schedule(projects, {"base": 1, "small": 1, "big": 10, "app": 5})
+    assert schedule.levels == [["base", "tool"], ["small", "big"], ["app"]]
+    assert schedule.priority["base"] == 16
+    assert schedule.critical_path() == ["base", "big", "app"]
+    # big is started before small, its chain is longer
+    assert schedule.order == ["base", "big", "app", "small", "tool"]
+    assert schedule.rank(["small", "tool", "big"]) == ["big", "small", "tool"]
+
+
+def test_long_chain_does_not_recurse():
+    projects = {"p0": Node()}
+    for i in range(1, 5000):
+        projects[f"p{i}"] = Node(f"p{i - 1}")
+    schedule = Schedule(projects)
+    assert len(schedule.levels) == 5000
+    assert schedule.order[0] == "p0"
+
+
+def test_cycle_reports_full_path():
+    projects = {"a": Node("b"), "b": Node("c"), "c": Node("a"), "d": Node("a")}
+    with pytest.raises(ValueError, match="a -> b -> c -> a"):
+        Schedule(projects)
+    with pytest.raises(ValueError, match="Unknown project dependency 'x'"):
+        Schedule({"a": Node("x")})
+
+
+def test_meta_makefile_starts_critical_path_first(tmp_path):
+    projects = {}
+    for name, sources, depends in [
+        ("small", 1, []), ("big", 4, []), ("app", 2, ["big"]),
+    ]:
+        root = tmp_path / name
+        (root / "src").mkdir(parents=True)
+        (root / "include").mkdir(parents=True)
+        for i in range(sources):
+            (root / "src" / f"s{i}.c").write_text("int x;\n")
+        projects[name] = CProject(
+            str(root),
+            output_name=f"lib{name}.a",
+            output_type=CProject.OutputType.STATIC,
+            depends=depends,
+        )
+
+    report = make_projects(projects, verbose=0)
+    meta = (tmp_path / "target" / "Projects.mk").read_text()
+    assert "all-all : big app small" in meta
+    assert report["schedule"]["critical_path"] == ["big", "app"]
+
+    # recorded build times take over from source counts
+    (tmp_path / "target" / "project-times.json").write_text(
+        json.dumps({"small": 60.0, "big": 1.0, "app": 1.0}))
+    report = make_projects(projects, verbose=0)
+    meta = (tmp_path / "target" / "Projects.mk").read_text()
+    assert "all-all : small big app" in meta
+    assert report["schedule"]["weights"]["small"] == 60.0
+
+
+@pytest.mark.skipif(shutil.which("gcc") is None, reason="gcc not available")
+def test_meta_makefile_records_build_times(tmp_path):
+    projects = {}
+    for name, depends in [("base", []), ("app", ["base"])]:
+        root = tmp_path / name
+        (root / "src").mkdir(parents=True)
+        (root / "include").mkdir(parents=True)
+        (root / "src" / f"{name}.c").write_text("int x;\n")
+        projects[name] = CProject(
+            str(root),
+            output_name=f"lib{name}.a",
+            output_type=CProject.OutputType.STATIC,
+            depends=depends,
+        )
+
+    make_projects(projects, verbose=0, record_times=True)
+    subprocess.run(
+        ["make", "-s", "-j2", "-f", "target/Projects.mk"],
+        cwd=tmp_path, check=True, stdout=subprocess.DEVNULL)
+    times = json.loads((tmp_path / "target" / "project-times.json").read_text())
+    assert set(times) == {"base", "app"}
+
+    report = make_projects(projects, verbose=0)
+    assert report["schedule"]["weights"] == times
@@ -0,0 +1,89 @@
+import json
+import sys
+
+from mkmake.testrun import TestRunner, main, schedule
+
+SUITE = """\
+import os, sys, time
+case = sys.argv[1]
+with open('runs.log', 'a') as fout:
+    fout.write(case + '\\n')
+time.sleep(0.05 if case == 'slow' else 0)
+print('output of', case)
+sys.exit(1 if os.path.exists('fail-' + case) else 0)
+"""
+
+
+def _runner(tmp_path, **kwargs):
+    if not (tmp_path / "suite.py").exists():
+        (tmp_path / "suite.py").write_text(SUITE)
+        (tmp_path / "binary").write_bytes(b"\x7fELF v1")
+    return TestRunner(
+        str(tmp_path / "state"),
+        f"cd {tmp_path} && {sys.executable} suite.py {{case}}",
+        binary=str(tmp_path / "binary"),
+        inputs=[str(tmp_path / "suite.py")],
+        list_command="printf 'fast\\nslow\\nmid\\n'",
+        env=["MKMAKE_TEST_FLAVOR"], jobs=2, **kwargs)
+
+
+def _runs(tmp_path):
+    log = tmp_path / "runs.log"
+    runs = log.read_text().split() if log.exists() else []
+    log.write_text("")
+    return runs
+
+
+def test_schedule_runs_slowest_and_unknown_first():
+    durations = {"a": 0.1, "b": 2.0, "c": 0.5}
+    assert schedule(["a", "b", "c", "d"], durations) == ["d", "b", "c", "a"]
+
+
+def test_runner_caches_passes_and_reruns_failures(tmp_path, capsys):
+    assert _runner(tmp_path).run() == 0
+    assert sorted(_runs(tmp_path)) == ["fast", "mid", "slow"]
+    summary = (tmp_path / "state" / "summary.out").read_text()
+    assert "==== slow: PASS" in summary
+    assert "output of mid" in summary
+    assert "3 passed, 0 failed, 0 cached" in summary
+
+    # unchanged: nothing runs, the cases are not even listed
+    assert _runner(tmp_path).run() == 0
+    assert _runs(tmp_path) == []
+
+    # a new binary invalidates every case, slowest are started first
+    (tmp_path / "fail-mid").write_text("")
+    (tmp_path / "binary").write_bytes(b"\x7fELF v2")
+    assert _runner(tmp_path).run() == 1
+    assert set(_runs(tmp_path)) == {"fast", "mid", "slow"}
+    state = json.loads((tmp_path / "state" / "state.json").read_text())
+    assert state["passed"] == ["fast", "slow"]
+    assert state["durations"]["slow"] > state["durations"]["fast"]
+    assert "FAIL mid (exit 1)" in capsys.readouterr().err
+
+    # only the failure reruns
+    (tmp_path / "fail-mid").unlink()
+    assert _runner(tmp_path).run() == 0
+    assert _runs(tmp_path) == ["mid"]
+    summary = (tmp_path / "state" / "summary.out").read_text()
+    assert "==== fast: PASS (cached)" in summary
+    assert "3 passed, 0 failed, 2 cached" in summary
+
+
+def test_runner_key_covers_selected_environment(tmp_path, monkeypatch):
+    assert _runner(tmp_path).run() == 0
+    _runs(tmp_path)
+    monkeypatch.setenv("UNRELATED", "1")
+    assert _runner(tmp_path).run() == 0
+    assert _runs(tmp_path) == []
+    monkeypatch.setenv("MKMAKE_TEST_FLAVOR", "asan")
+    assert _runner(tmp_path).run() == 0
+    assert len(_runs(tmp_path)) == 3
+
+
+def test_main_runs_whole_command_without_list(tmp_path):
+    state = tmp_path / "state"
+    command = f"{sys.executable} -c 'print(1)'"
+    assert main(["--dir", str(state), "--", command]) == 0
+    assert "==== test: PASS" in (state / "summary.out").read_text()
+    assert main(["--dir", str(state), "--", "exit 3"]) == 1
@@ -0,0 +1,118 @@
+import os
+import time
+
+import pytest
+
+from mkmake import make_projects
+from mkmake.cli import load_projects
+from mkmake.watch import (
+    CREATED, DELETED, MODIFIED, InotifyWatcher, PollWatcher, Watch
+)
+
+
+def test_make_projects_twice_is_stable(tmp_path, workspace):
+    projects = workspace("core", "app")
+    make_projects(projects, verbose=0)
+    first = (tmp_path / "app" / "target" / "Makefile").read_text()
+    make_projects(projects, verbose=0)
+    assert (tmp_path / "app" / "target" / "Makefile").read_text() == first
+    assert first.count("-lcore") == 1
+
+
+def test_watch_regenerates_only_affected_projects(tmp_path, workspace):
+    watch = Watch(workspace("core", "app"), verbose=0, jobs=1)
+    watch.start()
+    core_mk = tmp_path / "core" / "target" / "Makefile"
+    app_mk = tmp_path / "app" / "target" / "Makefile"
+
+    # same includes, nothing to regenerate
+    main = tmp_path / "app" / "src" / "main.c"
+    main.write_text('#include "util.h"\nint main(void){return 1;}\n')
+    regenerated, touched = watch.handle([(str(main), MODIFIED)])
+    assert regenerated == set()
+    assert touched == {"app"}
+
+    # a new source only affects its own project
+    extra = tmp_path / "core" / "src" / "extra.c"
+    extra.write_text("int extra;\n")
+    regenerated, _ = watch.handle([(str(extra), CREATED)])
+    assert regenerated == {"core"}
+    assert "target/obj/extra.o" in core_mk.read_text()
+
+    # a header nobody includes does not reach the dependents
+    unused = tmp_path / "core" / "include" / "unused.h"
+    unused.write_text("#pragma once\n")
+    regenerated, _ = watch.handle([(str(unused), CREATED)])
+    assert regenerated == {"core"}
+
+    # renaming an exported header reaches the dependents
+    header = tmp_path / "core" / "include" / "core.h"
+    renamed = tmp_path / "core" / "include" / "base.h"
+    os.rename(header, renamed)
+    main.write_text('#include "base.h"\n')
+    regenerated, _ = watch.handle([
+        (str(header), DELETED), (str(renamed), CREATED), (str(main), MODIFIED),
+    ])
+    assert regenerated == {"core", "app"}
+    app = app_mk.read_text()
+    assert "core/target/include/base.h" in app
+    assert "core.h" not in app
+
+    # editing a header's includes updates the dependent closures
+    (tmp_path / "core" / "include" / "inner.h").write_text("#pragma once\n")
+    renamed.write_text('#include "inner.h"\n')
+    regenerated, _ = watch.handle([
+        (str(tmp_path / "core" / "include" / "inner.h"), CREATED),
+        (str(renamed), MODIFIED),
+    ])
+    assert regenerated == {"core", "app"}
+    assert "core/target/include/inner.h" in app_mk.read_text()
+
+    # build outputs are ignored
+    regenerated, touched = watch.handle([(str(core_mk), MODIFIED)])
+    assert regenerated == set() and touched == set()
+
+
+def test_poll_watcher_reports_changes(tmp_path, workspace):
+    projects = workspace("core", "app")
+    make_projects(projects, verbose=0)
+    watcher = PollWatcher(list(projects.values()))
+    source = tmp_path / "core" / "src" / "new.c"
+    source.write_text("int x;\n")
+    (tmp_path / "core" / "src" / "core.c").unlink()
+    events = watcher.read(0)
+    assert (str(source), CREATED) in events
+    assert (str(tmp_path / "core" / "src" / "core.c"), DELETED) in events
+
+
+@pytest.mark.skipif(not InotifyWatcher.available(), reason="no inotify")
+def test_inotify_watcher_reports_changes(tmp_path, workspace):
+    projects = workspace("core", "app")
+    make_projects(projects, verbose=0)
+    watcher = InotifyWatcher(list(projects.values()))
+    try:
+        sub = tmp_path / "app" / "src" / "sub"
+        sub.mkdir()
+        source = sub / "x.c"
+        source.write_text("int x;\n")
+        header = tmp_path / "core" / "include" / "core.h"
+        header.write_text("#pragma once\n")
+
+        events = []
+        deadline = time.time() + 5
+        while time.time() < deadline and (str(header), MODIFIED) not in events:
+            events += watcher.read(0.1)
+        assert (str(sub), CREATED) in events
+        # created before the new directory was watched, or right after
+        assert {(str(source), CREATED), (str(source), MODIFIED)} & set(events)
+        assert (str(header), MODIFIED) in events
+        assert not any("target" in p for p, _ in events)
+    finally:
+        watcher.close()
+
+
+def test_load_projects_from_example():
+    script = os.path.join(
+        os.path.dirname(__file__), "..", "examples", "generic_make.py")
+    projects = load_projects(script)
+    assert sorted(projects) == ["generic", "parser", "test"]
@@ -1,3 +1,7 @@
+import shutil
+import subprocess
+
+from mkmake import make_projects
 from mkmake.projects import CProject, TestProject, YYProject
 import pytest
 
@@ -81,3 +85,71 @@ def test_testproject_private_depends_must_be_in_depends(tmp_path):
     projects["test"].scan_sources()
     with pytest.raises(ValueError):
         projects["test"].inject_depends(projects)
+
+
+def test_testproject_test_runner_command(tmp_path):
+    root = tmp_path / "test"
+    (root / "src").mkdir(parents=True)
+    (root / "tests").mkdir(parents=True)
+    (root / "src" / "main.c").write_text("int main(void){return 0;}\n")
+    (root / "tests" / "run.py").write_text("print('ok')\n")
+
+    p = TestProject(
+        str(root),
+        test_command="python3 {0} --case {case}",
+        test_list_command="python3 {0} --list",
+        test_files=["tests/run.py"],
+        test_runner=True,
+        test_jobs=4,
+        test_env=["CC"],
+    )
+    p.scan_sources()
+    p.inject_depends({})
+    p.scan_deps()
+    p.make()
+
+    mk = (root / "target" / "Makefile").read_text()
+    assert "-m mkmake.testrun" in mk
+    assert f"--dir {(root / 'target' / 'tests').as_posix()}" in mk
+    assert f"--binary {(root / 'target' / 'test').as_posix()}" in mk
+    assert "--input tests/run.py --list 'python3 tests/run.py --list'" in mk
+    assert "--jobs 4 --env CC -- 'python3 tests/run.py --case {case}'" in mk
+    assert "rm -fr" not in mk.split("test: all")[1]
+
+
+@pytest.mark.skipif(shutil.which("gcc") is None, reason="gcc not available")
+def test_test_runner_reruns_when_only_a_shared_dependency_changes(tmp_path):
+    core = tmp_path / "core"
+    tests = tmp_path / "tests"
+    for root in [core, tests]:
+        (root / "src").mkdir(parents=True)
+        (root / "include").mkdir(parents=True)
+    (core / "include" / "core.h").write_text("int core(void);\n")
+    (tests / "src" / "main.c").write_text(
+        '#include "core.h"\nint main(void){return core();}\n')
+    source = (
+        '#include "core.h"\n'
+        '__attribute__((visibility("default"))) int core(void){return %d;}\n')
+
+    def test(value):
+        (core / "src" / "core.c").write_text(source % value)
+        make_projects({
+            "core": CProject(
+                str(core), output_name="libcore.so",
+                output_type=CProject.OutputType.SHARED),
+            "tests": TestProject(
+                str(tests), depends=["core"], test_runner=True,
+                test_command=f"LD_LIBRARY_PATH={core / 'target'} target/test"),
+        }, verbose=0)
+        for goal in ["all-all", "test-tests"]:
+            ret = subprocess.run(
+                ["make", "-s", "-f", "target/Projects.mk", goal],
+                cwd=tmp_path, stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL)
+        return ret.returncode
+
+    assert test(0) == 0
+    mk = (tests / "target" / "Makefile").read_text()
+    assert f"--input {(core / 'target' / 'libcore.so').as_posix()}" in mk
+    # the relinked test binary is unchanged, the library is not
+    assert test(1) != 0